@@ -0,0 +1,622 @@
+import json
+import unittest
+from datetime import date, datetime, timedelta, timezone
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+from cache import response_cache
+from models import db, Movie, Actor, movie_actors
+from queries import MAX_PAGE_SIZE, TOMBSTONE_RETENTION_DAYS
+
+
+def ago(days):
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def since(days):
+    """An updated_since= value 'days' back."""
+    return ago(days).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def as_utc(value):
+    # SQLite returns naive UTC timestamps
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class CastingAgencyAPITestCase(unittest.TestCase):
+    """This class represents in-process test cases for the Casting Agency API,
+    run against a local database with locally minted tokens"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.headers = testing.auth_headers()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        cache.backend.clear()
+        response_cache.clear()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def seed_movies(self, count):
+        with app.app_context():
+            db.session.add_all([
+                Movie(title=f'Movie {i}', release_date=date(2000 + i % 25, 1, 1))
+                for i in range(count)
+            ])
+            db.session.commit()
+
+    def seed_actors(self, count):
+        with app.app_context():
+            db.session.add_all([
+                Actor(name=f'Actor {i}', age=20 + i, gender='Female' if i % 2 else 'Male')
+                for i in range(count)
+            ])
+            db.session.commit()
+
+    def seed_casts(self, casts):
+        """casts: {movie id: [actor ids]}"""
+        with app.app_context():
+            db.session.execute(movie_actors.insert(), [
+                {'movie_id': movie_id, 'actor_id': actor_id}
+                for movie_id, actor_ids in casts.items() for actor_id in actor_ids
+            ])
+            db.session.commit()
+        cache.invalidate('casts')
+
+    def without_change_feed(self, queries):
+        """The statements of a write other than its change feed entry."""
+        return [statement for statement, _ in queries
+                if 'changes' not in statement and 'pg_advisory_xact_lock' not in statement]
+
+    def count_queries(self, path):
+        with app.app_context(), testing.capture_queries(db.engine) as queries:
+            response = self.client.get(path, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+# ----------------------------------------
+# 1. List pagination, projection and filtering
+# ----------------------------------------
+
+    def test_movies_are_paged_with_cursor(self):
+        self.seed_movies(25)
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get(f'/movies?limit=10&cursor={cursor}', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            seen.extend(movie['id'] for movie in data['movies'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, list(range(1, 26)))
+
+    def test_page_is_stable_under_concurrent_inserts(self):
+        self.seed_movies(10)
+        first = self.client.get('/movies?limit=5', headers=self.headers).get_json()
+        self.seed_movies(3)
+        second = self.client.get(f'/movies?limit=5&cursor={first["next_cursor"]}',
+                                 headers=self.headers).get_json()
+        self.assertEqual([movie['id'] for movie in second['movies']], [6, 7, 8, 9, 10])
+
+    def test_limit_is_capped(self):
+        self.seed_actors(MAX_PAGE_SIZE + 1)
+        data = self.client.get(f'/actors?limit={MAX_PAGE_SIZE * 10}', headers=self.headers).get_json()
+        self.assertEqual(len(data['actors']), MAX_PAGE_SIZE)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_fields_projection(self):
+        self.seed_movies(1)
+        data = self.client.get('/movies?fields=title', headers=self.headers).get_json()
+        self.assertEqual(data['movies'], [{'id': 1, 'title': 'Movie 0'}])
+
+    def test_unknown_field_is_bad_request(self):
+        response = self.client.get('/movies?fields=budget', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor_is_bad_request(self):
+        response = self.client.get('/actors?cursor=not-a-cursor', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_movie_release_date_filter(self):
+        self.seed_movies(10)
+        data = self.client.get('/movies?release_date_from=2003-01-01&release_date_to=2005-12-31',
+                               headers=self.headers).get_json()
+        self.assertEqual([movie['release_date'] for movie in data['movies']],
+                         ['2003-01-01', '2004-01-01', '2005-01-01'])
+
+    def test_actor_gender_and_age_filters(self):
+        self.seed_actors(10)
+        data = self.client.get('/actors?gender=Female&age_min=23&age_max=27',
+                               headers=self.headers).get_json()
+        self.assertEqual([actor['age'] for actor in data['actors']], [23, 25, 27])
+
+# ----------------------------------------
+# 2. Validation and bulk writes
+# ----------------------------------------
+
+    def test_create_movie_with_invalid_date_is_unprocessable(self):
+        response = self.client.post('/movies', headers=self.headers,
+                                    json={'title': 'Bad Date', 'release_date': '10/10/2023'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_update_and_delete_run_one_statement(self):
+        self.seed_movies(2)
+        self.seed_actors(1)
+        self.seed_casts({1: [1], 2: [1]})
+        with app.app_context(), testing.capture_queries(db.engine) as queries:
+            response = self.client.patch('/movies/1', headers=self.headers, json={'title': 'Changed'})
+            returning = db.engine.dialect.full_returning
+        self.assertEqual(response.get_json(), {
+            'success': True, 'movie': {'id': 1, 'title': 'Changed', 'release_date': '2000-01-01'}})
+        # Without UPDATE ... RETURNING the row is read back
+        self.assertEqual(len(self.without_change_feed(queries)), 1 if returning else 2)
+
+        with app.app_context(), testing.capture_queries(db.engine) as queries:
+            response = self.client.delete('/movies/1', headers=self.headers)
+        self.assertEqual(response.get_json(), {'success': True, 'deleted': 1})
+        # On Postgres the movie leaves its casts in the same statement
+        postgres = db.engine.dialect.name == 'postgresql'
+        self.assertEqual(len(self.without_change_feed(queries)), 1 if postgres else 2)
+        with app.app_context():
+            self.assertEqual(db.session.execute(movie_actors.select()).fetchall(), [(2, 1)])
+        self.assertEqual(self.client.delete('/movies/1', headers=self.headers).status_code, 404)
+
+    def test_update_and_delete_of_missing_rows_are_not_found(self):
+        self.seed_actors(1)
+        self.assertEqual(self.client.patch('/actors/2', headers=self.headers, json={'age': 30}).status_code, 404)
+        self.assertEqual(self.client.patch('/actors/2', headers=self.headers, json={'age': 'old'}).status_code, 404)
+        self.assertEqual(self.client.patch('/actors/1', headers=self.headers, json={'age': 'old'}).status_code, 422)
+        self.assertEqual(self.client.patch('/actors/1', headers=self.headers, json={}).get_json()['actor'],
+                         {'id': 1, 'name': 'Actor 0', 'age': 20, 'gender': 'Male'})
+        self.assertEqual(self.client.delete('/actors/2', headers=self.headers).status_code, 404)
+
+    def test_bulk_create_movies(self):
+        movies = [{'title': f'Bulk {i}', 'release_date': '2024-01-01'} for i in range(3)]
+        response = self.client.post('/movies/bulk', headers=self.headers, json=movies)
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertEqual([movie['title'] for movie in data['movies']], ['Bulk 0', 'Bulk 1', 'Bulk 2'])
+        self.assertEqual([movie['id'] for movie in data['movies']], [1, 2, 3])
+
+    def test_bulk_create_is_atomic_by_default(self):
+        actors = [{'name': 'Valid', 'age': 30, 'gender': 'Male'}, {'name': 'No Age', 'gender': 'Male'}]
+        response = self.client.post('/actors/bulk', headers=self.headers, json={'actors': actors})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.get_json()['errors'][0]['index'], 1)
+        with app.app_context():
+            self.assertEqual(Actor.query.count(), 0)
+
+    def test_bulk_create_partial_success(self):
+        actors = [{'name': 'Valid', 'age': 30, 'gender': 'Male'}, {'name': 'No Age', 'gender': 'Male'}]
+        response = self.client.post('/actors/bulk?atomic=false', headers=self.headers, json=actors)
+        self.assertEqual(response.status_code, 207)
+        data = response.get_json()
+        self.assertEqual(len(data['actors']), 1)
+        self.assertEqual(data['errors'][0]['index'], 1)
+
+    def test_bulk_update_actors(self):
+        self.seed_actors(3)
+        updates = [{'id': 1, 'age': 99}, {'id': 3, 'name': 'Renamed'}]
+        response = self.client.patch('/actors/bulk', headers=self.headers, json=updates)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['actors'][0], {'id': 1, 'name': 'Actor 0', 'age': 99, 'gender': 'Male'})
+        self.assertEqual(data['actors'][1]['name'], 'Renamed')
+
+    def test_bulk_update_with_missing_id_changes_nothing(self):
+        self.seed_movies(1)
+        updates = [{'id': 1, 'title': 'Changed'}, {'id': 999, 'title': 'Missing'}]
+        response = self.client.patch('/movies/bulk', headers=self.headers, json=updates)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['errors'][0]['id'], 999)
+        with app.app_context():
+            self.assertEqual(Movie.query.get(1).title, 'Movie 0')
+
+    def test_bulk_delete_partial_success(self):
+        self.seed_movies(3)
+        response = self.client.delete('/movies/bulk?atomic=false', headers=self.headers,
+                                      json={'ids': [1, 3, 999]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.get_json()['deleted'], [1, 3])
+        with app.app_context():
+            self.assertEqual([movie.id for movie in Movie.query.filter(Movie.deleted_at.is_(None))], [2])
+
+# ----------------------------------------
+# 3. Streaming export
+# ----------------------------------------
+
+    def test_export_movies_as_ndjson(self):
+        self.seed_movies(2500)
+        response = self.client.get('/movies/export', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2500)
+        self.assertEqual(json.loads(lines[-1]), {'id': 2500, 'title': 'Movie 2499', 'release_date': '2024-01-01'})
+
+    def test_export_actors_as_json_array(self):
+        self.seed_actors(3)
+        response = self.client.get('/actors/export?format=json&fields=name&gender=Male',
+                                   headers=self.headers)
+        self.assertEqual(response.get_json(), [{'id': 1, 'name': 'Actor 0'}, {'id': 3, 'name': 'Actor 2'}])
+
+    def test_export_of_empty_table_is_empty_array(self):
+        response = self.client.get('/actors/export?format=json', headers=self.headers)
+        self.assertEqual(response.get_json(), [])
+
+    def test_export_unknown_format_is_bad_request(self):
+        response = self.client.get('/movies/export?format=xml', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+# ----------------------------------------
+# 4. Response caching and conditional GET
+# ----------------------------------------
+
+    def test_repeated_read_is_served_from_cache(self):
+        self.seed_movies(1)
+        first = self.client.get('/movies/1', headers=self.headers)
+        second = self.client.get('/movies/1', headers=self.headers)
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_matching_etag_is_not_modified(self):
+        self.seed_actors(2)
+        etag = self.client.get('/actors', headers=self.headers).headers['ETag']
+        response = self.client.get('/actors', headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response_cache.stats()['not_modified'], 1)
+
+    def test_write_invalidates_cached_reads(self):
+        self.seed_movies(1)
+        etag = self.client.get('/movies', headers=self.headers).headers['ETag']
+        self.client.patch('/movies/1', headers=self.headers, json={'title': 'Changed'})
+        response = self.client.get('/movies', headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.get_json()['movies'][0]['title'], 'Changed')
+
+    def test_not_found_is_not_cached(self):
+        self.assertEqual(self.client.get('/actors/1', headers=self.headers).status_code, 404)
+        self.seed_actors(1)
+        self.assertEqual(self.client.get('/actors/1', headers=self.headers).status_code, 200)
+
+# ----------------------------------------
+# 5. Casts
+# ----------------------------------------
+
+    def test_include_actors_runs_constant_number_of_queries(self):
+        self.seed_movies(2)
+        self.seed_actors(3)
+        self.seed_casts({1: [1, 2], 2: [3]})
+        few = self.count_queries('/movies?include=actors')
+
+        self.seed_movies(30)
+        self.seed_casts({movie_id: [1, 2, 3] for movie_id in range(3, 33)})
+        many = self.count_queries('/movies?include=actors&limit=50')
+
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 2)
+
+    def test_include_actors_on_list_and_detail(self):
+        self.seed_movies(2)
+        self.seed_actors(2)
+        self.seed_casts({1: [2, 1]})
+        movies = self.client.get('/movies?include=actors', headers=self.headers).get_json()['movies']
+        self.assertEqual([actor['id'] for actor in movies[0]['actors']], [1, 2])
+        self.assertEqual(movies[1]['actors'], [])
+        actor = self.client.get('/actors/2?include=movies', headers=self.headers).get_json()['actor']
+        self.assertEqual([movie['id'] for movie in actor['movies']], [1])
+
+    def test_unknown_include_is_bad_request(self):
+        response = self.client.get('/movies?include=crew', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_set_and_list_movie_actors(self):
+        self.seed_movies(1)
+        self.seed_actors(3)
+        response = self.client.put('/movies/1/actors', headers=self.headers,
+                                   json={'actor_ids': [3, 1]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([actor['id'] for actor in response.get_json()['actors']], [1, 3])
+
+        data = self.client.get('/movies/1/actors?fields=name', headers=self.headers).get_json()
+        self.assertEqual(data['actors'], [{'id': 1, 'name': 'Actor 0'}, {'id': 3, 'name': 'Actor 2'}])
+        data = self.client.get('/actors/3/movies', headers=self.headers).get_json()
+        self.assertEqual([movie['id'] for movie in data['movies']], [1])
+
+    def test_set_movie_actors_with_unknown_actor_is_unprocessable(self):
+        self.seed_movies(1)
+        response = self.client.put('/movies/1/actors', headers=self.headers, json={'actor_ids': [7]})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.client.get('/movies/2/actors', headers=self.headers).status_code, 404)
+
+    def test_deleting_actor_removes_them_from_casts(self):
+        self.seed_movies(1)
+        self.seed_actors(2)
+        self.seed_casts({1: [1, 2]})
+        self.client.get('/movies/1/actors', headers=self.headers)
+        self.client.delete('/actors/1', headers=self.headers)
+        data = self.client.get('/movies/1/actors', headers=self.headers).get_json()
+        self.assertEqual([actor['id'] for actor in data['actors']], [2])
+
+# ----------------------------------------
+# 6. Search
+# ----------------------------------------
+
+    def seed_catalog(self):
+        with app.app_context():
+            db.session.add_all([
+                Movie(title='Star Wars', release_date=date(1977, 5, 25)),
+                Movie(title='Star Trek', release_date=date(2009, 5, 8)),
+                Movie(title='Wars of the Roses', release_date=date(1989, 12, 8)),
+                Actor(name='Ringo Starr', age=84, gender='Male'),
+                Actor(name='Kathleen Turner', age=70, gender='Female'),
+            ])
+            db.session.commit()
+
+    def test_search_matches_every_word_as_prefix(self):
+        self.seed_catalog()
+        data = self.client.get('/search?q=star+war', headers=self.headers).get_json()
+        self.assertEqual(data['results'], [
+            {'type': 'movie', 'id': 1, 'title': 'Star Wars', 'rank': data['results'][0]['rank']},
+        ])
+
+    def test_search_covers_movies_and_actors(self):
+        self.seed_catalog()
+        results = self.client.get('/search?q=star', headers=self.headers).get_json()['results']
+        self.assertEqual(sorted((r['type'], r['id']) for r in results),
+                         [('actor', 1), ('movie', 1), ('movie', 2)])
+        self.assertEqual(results, sorted(results, key=lambda r: -r['rank']))
+
+        actors = self.client.get('/search?q=star&type=actors', headers=self.headers).get_json()
+        self.assertEqual([r['name'] for r in actors['results']], ['Ringo Starr'])
+
+    def test_search_is_paged(self):
+        self.seed_catalog()
+        first = self.client.get('/search?q=star&limit=2', headers=self.headers).get_json()
+        second = self.client.get(f'/search?q=star&limit=2&cursor={first["next_cursor"]}',
+                                 headers=self.headers).get_json()
+        self.assertEqual(len(first['results']), 2)
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next_cursor'])
+
+    def test_search_index_follows_writes(self):
+        self.seed_catalog()
+        self.client.patch('/movies/3', headers=self.headers, json={'title': 'Starship Troopers'})
+        self.client.delete('/movies/1', headers=self.headers)
+        results = self.client.get('/search?q=star', headers=self.headers).get_json()['results']
+        self.assertEqual(sorted(r['id'] for r in results if r['type'] == 'movie'), [2, 3])
+
+    def test_search_without_words_is_bad_request(self):
+        response = self.client.get('/search?q=%22*%22', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_requires_movie_and_actor_permissions(self):
+        headers = testing.auth_headers(['get:movies'])
+        self.assertEqual(self.client.get('/search?q=star', headers=headers).status_code, 403)
+
+# ----------------------------------------
+# 7. Row versions and If-Match
+# ----------------------------------------
+
+    def if_match(self, etag):
+        return dict(self.headers, **{'If-Match': etag})
+
+    def test_rows_carry_their_version_as_etag(self):
+        response = self.client.post('/actors', headers=self.headers,
+                                    json={'name': 'New', 'age': 30, 'gender': 'Male'})
+        self.assertEqual(response.headers['ETag'], '"1"')
+        response = self.client.get('/actors/1', headers=self.headers)
+        self.assertEqual(response.headers['ETag'], '"1"')
+        response = self.client.get('/actors/1', headers=dict(self.headers, **{'If-None-Match': '"1"'}))
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.patch('/actors/1', headers=self.if_match('"1"'), json={'age': 31})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"2"')
+        self.assertEqual(self.client.get('/actors/1', headers=self.headers).headers['ETag'], '"2"')
+
+    def test_row_etag_is_revalidated_without_the_database(self):
+        for name in ('One', 'Two'):
+            self.client.post('/actors', headers=self.headers, json={'name': name, 'age': 30, 'gender': 'Male'})
+        self.client.get('/actors/1', headers=self.headers)
+        # A write to another row leaves actor 1's ETag current
+        self.client.patch('/actors/2', headers=self.headers, json={'age': 31})
+
+        revalidate = dict(self.headers, **{'If-None-Match': '"1"'})
+        with app.app_context(), testing.capture_queries(db.engine) as queries:
+            response = self.client.get('/actors/1', headers=revalidate)
+        self.assertEqual((response.status_code, response.headers['ETag']), (304, '"1"'))
+        self.assertEqual(queries, [])
+
+        self.client.patch('/actors/1', headers=self.headers, json={'age': 32})
+        response = self.client.get('/actors/1', headers=revalidate)
+        self.assertEqual((response.status_code, response.headers['ETag']), (200, '"2"'))
+        # An expanded response also depends on the casts
+        response = self.client.get('/actors/1?include=movies', headers=dict(self.headers, **{'If-None-Match': '"2"'}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_stale_if_match_is_precondition_failed(self):
+        self.seed_movies(1)
+        # Two editors read version 1; the second one to write loses
+        first = self.client.patch('/movies/1', headers=self.if_match('"1"'), json={'title': 'First'})
+        second = self.client.patch('/movies/1', headers=self.if_match('"1"'), json={'title': 'Second'})
+        self.assertEqual((first.status_code, second.status_code), (200, 412))
+        movie = self.client.get('/movies/1', headers=self.headers).get_json()['movie']
+        self.assertEqual(movie['title'], 'First')
+
+        self.assertEqual(self.client.patch('/movies/1', headers=self.if_match('W/"2"'),
+                                           json={'title': 'Weak'}).status_code, 412)
+        self.assertEqual(self.client.patch('/movies/1', headers=self.if_match('"1", "2"'),
+                                           json={'title': 'Either'}).status_code, 200)
+        self.assertEqual(self.client.patch('/movies/1', headers=self.if_match('*'),
+                                           json={'title': 'Any'}).status_code, 200)
+        self.assertEqual(self.client.patch('/movies/2', headers=self.if_match('"1"'),
+                                           json={'title': 'Missing'}).status_code, 404)
+
+    def test_delete_with_if_match(self):
+        self.seed_actors(1)
+        self.client.patch('/actors/1', headers=self.headers, json={'age': 40})
+        self.assertEqual(self.client.delete('/actors/1', headers=self.if_match('"1"')).status_code, 412)
+        self.assertEqual(self.client.delete('/actors/1', headers=self.if_match('"2"')).status_code, 200)
+        self.assertEqual(self.client.delete('/actors/1', headers=self.if_match('"2"')).status_code, 404)
+
+    def test_bulk_update_bumps_versions(self):
+        self.seed_actors(2)
+        self.client.patch('/actors/bulk', headers=self.headers, json=[{'id': 1, 'age': 50}])
+        self.assertEqual(self.client.get('/actors/1', headers=self.headers).headers['ETag'], '"2"')
+        self.assertEqual(self.client.get('/actors/2', headers=self.headers).headers['ETag'], '"1"')
+
+    def test_bulk_update_without_changes_leaves_the_row(self):
+        self.seed_actors(2)
+        self.backdate(Actor, 2)
+        self.client.get('/actors/1', headers=self.headers)
+        response = self.client.patch('/actors/bulk', headers=self.headers, json=[{'id': 1}])
+        self.assertEqual(response.get_json()['actors'], [{'id': 1, 'name': 'Actor 0', 'age': 20, 'gender': 'Male'}])
+        # Nothing changed: no change feed entry, and the row ETag stays known
+        self.assertEqual(self.client.get('/changes', headers=self.headers).get_json()['changes'], [])
+        with app.app_context(), testing.capture_queries(db.engine) as queries:
+            response = self.client.get('/actors/1', headers=dict(self.headers, **{'If-None-Match': '"1"'}))
+        self.assertEqual((response.status_code, queries), (304, []))
+
+        response = self.client.patch('/actors/bulk', headers=self.headers, json=[{'id': 1}, {'id': 2, 'age': 50}])
+        self.assertEqual(response.status_code, 200)
+        # Updated rows come first
+        self.assertEqual([actor['id'] for actor in response.get_json()['actors']], [2, 1])
+        changes = self.client.get('/changes', headers=self.headers).get_json()['changes']
+        self.assertEqual([(change['id'], change['operation']) for change in changes], [(2, 'update')])
+        self.assertEqual(self.client.get('/actors/1', headers=self.headers).headers['ETag'], '"1"')
+        self.assertEqual(self.client.get('/actors/2', headers=self.headers).headers['ETag'], '"2"')
+
+        response = self.client.get('/actors?updated_since=' + since(1), headers=self.headers)
+        self.assertEqual([actor['id'] for actor in response.get_json()['actors']], [2])
+
+# ----------------------------------------
+# 8. Timestamps, soft delete and updated_since
+# ----------------------------------------
+
+    def backdate(self, model, days, **values):
+        """Moves every row's timestamps 'days' back."""
+        old = ago(days)
+        with app.app_context():
+            db.session.execute(model.__table__.update().values(created_at=old, updated_at=old, **values))
+            db.session.commit()
+        cache.invalidate(model.__tablename__)
+
+    def test_updated_since_returns_writes_and_tombstones(self):
+        self.seed_movies(4)
+        self.backdate(Movie, 10)
+        self.client.patch('/movies/2', headers=self.headers, json={'title': 'Changed'})
+        self.client.delete('/movies/3', headers=self.headers)
+
+        data = self.client.get(f'/movies?updated_since={since(5)}&fields=title', headers=self.headers).get_json()
+        items = data['movies']
+        self.assertEqual([item['id'] for item in items], [2, 3])
+        self.assertEqual(items[0]['title'], 'Changed')
+        self.assertEqual(set(items[1]), {'id', 'deleted', 'updated_at'})
+        self.assertTrue(items[1]['deleted'])
+        for item in items:
+            self.assertGreater(datetime.fromisoformat(item['updated_at'].replace('Z', '+00:00')), ago(5))
+
+        everything = self.client.get(f'/movies?updated_since={since(11)}', headers=self.headers).get_json()
+        self.assertEqual([item['id'] for item in everything['movies']], [1, 2, 3, 4])
+        tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        self.assertEqual(self.client.get(f'/movies?updated_since={tomorrow}%2B02:00',
+                                         headers=self.headers).get_json()['movies'], [])
+
+    def test_writes_maintain_timestamps(self):
+        self.seed_actors(2)
+        self.backdate(Actor, 10)
+        self.client.patch('/actors/bulk', headers=self.headers, json=[{'id': 1, 'age': 50}])
+        with app.app_context():
+            actors = {actor.id: actor for actor in Actor.query}
+            self.assertLess(as_utc(actors[1].created_at), ago(9))
+            self.assertGreater(as_utc(actors[1].updated_at), ago(9))
+            self.assertLess(as_utc(actors[2].updated_at), ago(9))
+            self.assertIsNone(actors[1].deleted_at)
+
+        self.client.delete('/actors/bulk', headers=self.headers, json=[2])
+        with app.app_context():
+            actor = db.session.get(Actor, 2)
+            self.assertIsNotNone(actor.deleted_at)
+            self.assertGreater(as_utc(actor.updated_at), ago(9))
+
+    def test_deleted_rows_are_gone_from_every_other_read_and_write(self):
+        self.seed_catalog()
+        self.client.delete('/movies/1', headers=self.headers)
+        self.client.delete('/actors/1', headers=self.headers)
+
+        self.assertEqual([movie['id'] for movie in self.client.get('/movies', headers=self.headers)
+                          .get_json()['movies']], [2, 3])
+        self.assertEqual(self.client.get('/movies/1', headers=self.headers).status_code, 404)
+        self.assertEqual(self.client.get('/movies/1/actors', headers=self.headers).status_code, 404)
+        self.assertEqual(self.client.patch('/movies/1', headers=self.headers, json={'title': 'X'}).status_code,
+                         404)
+        self.assertEqual(self.client.delete('/movies/1', headers=self.headers).status_code, 404)
+        self.assertEqual(self.client.put('/movies/2/actors', headers=self.headers,
+                                         json={'actor_ids': [1]}).status_code, 422)
+        self.assertEqual([result['id'] for result in self.client.get('/search?q=star', headers=self.headers)
+                          .get_json()['results']], [2])
+        export = self.client.get('/movies/export', headers=self.headers).get_data(as_text=True)
+        self.assertEqual([json.loads(line)['id'] for line in export.splitlines()], [2, 3])
+        response = self.client.patch('/movies/bulk', headers=self.headers, json=[{'id': 1, 'title': 'X'}])
+        self.assertEqual(response.status_code, 404)
+
+    def test_tombstones_have_no_includes(self):
+        self.seed_movies(2)
+        self.seed_actors(1)
+        self.seed_casts({1: [1], 2: [1]})
+        self.client.delete('/movies/1', headers=self.headers)
+        items = self.client.get(f'/movies?updated_since={since(1)}&include=actors',
+                                headers=self.headers).get_json()['movies']
+        self.assertNotIn('actors', items[0])
+        self.assertEqual([actor['id'] for actor in items[1]['actors']], [1])
+
+    def test_invalid_updated_since_is_bad_request(self):
+        response = self.client.get('/actors?updated_since=yesterday', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        # Older deletions may have been purged
+        response = self.client.get(f'/actors?updated_since={since(TOMBSTONE_RETENTION_DAYS + 1)}',
+                                   headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_removes_old_tombstones(self):
+        self.seed_movies(3)
+        self.client.delete('/movies/bulk', headers=self.headers, json=[1, 2])
+        with app.app_context():
+            old = ago(TOMBSTONE_RETENTION_DAYS + 1)
+            db.session.execute(Movie.__table__.update().where(Movie.id == 1)
+                               .values(updated_at=old, deleted_at=old))
+            db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['purge-tombstones'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('movies: purged 1 deleted rows', result.output)
+        with app.app_context():
+            self.assertEqual([movie.id for movie in Movie.query.order_by(Movie.id)], [2, 3])
+
+# ----------------------------------------
+# 9. Operations
+# ----------------------------------------
+
+    def test_db_pool_health(self):
+        self.assertEqual(self.client.get('/health/db').status_code, 401)
+        response = self.client.get('/health/db', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('checkouts', response.get_json()['pool'])
+
+
+if __name__ == "__main__":
+    unittest.main()
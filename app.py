@@ -1,11 +1,14 @@
 from os import environ as env
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, abort
 from flask_sqlalchemy import SQLAlchemy
-from models import setup_db, Movie, Actor
+from sqlalchemy.orm import selectinload
+from models import setup_db, Movie, Actor, pool_status
 from flask_cors import CORS
 from flask_migrate import Migrate
 from models import db
 import json
+import logging
+import click
 from urllib.parse import quote_plus, urlencode
 from authlib.integrations.flask_client import OAuth
 from dotenv import find_dotenv, load_dotenv
@@ -17,13 +20,44 @@ if ENV_FILE:
     load_dotenv(ENV_FILE)
 
 # Auth0 and RBAC imports
-from auth import requires_auth
+from auth import requires_auth, requires_metrics_access
+from app_logging import configure_logging
+from queries import fetch_page, get_live, linked_to, live, parse_include, InvalidQuery
+from validation import validate_movie, validate_actor, validate_ids, ValidationError
+from export import export_response
+from json_provider import jsonify
+from writes import (update_row, delete_row, row_exists, expected_versions, missing_status,
+                    row_etag, purge_tombstones)
+from search import search
+import auth
+import cache
+import metrics
+import profiling
+from cache import cached_response, invalidate
+from idempotency import idempotent
+import changes
+from changes import record_rows, record_deletes, record_links
+from bulk import (bulk_create, bulk_update, bulk_delete, parse_items, parse_atomic,
+                  response_status, BulkError)
+
+logger = logging.getLogger(__name__)
+
+# ?include= name -> cache resources the expanded response also depends on.
+# 'casts' is bumped whenever a movie's actors change.
+MOVIE_INCLUDES = {'actors': ('actors', 'casts')}
+ACTOR_INCLUDES = {'movies': ('movies', 'casts')}
 
 migrate = Migrate()
 
 def create_app(test_config=None):
+    """Builds the app without any database or network I/O, so importing this
+    module is cheap and safe to do before forking (gunicorn --preload).
+    The schema is managed separately with `flask db upgrade`."""
     app = Flask(__name__)
+    configure_logging(app)
+    metrics.init_app(app)
     setup_db(app)
+    profiling.init_app(app)
     CORS(app, resources={r"/*": {"origins": "https://fsnd.jasenc.dev"}})
     migrate.init_app(app, db)
     
@@ -87,33 +121,149 @@ def create_app(test_config=None):
             )
         )
 
-    # GET /movies
+    # GET /health/db
+    @app.route("/health/db")
+    @requires_metrics_access
+    def db_health():
+        """Connection pool metrics: connections checked out, overflow in use
+        and how long checkouts have waited."""
+        return jsonify({
+            'success': True,
+            'pool': pool_status()
+        }), 200
+
+    def pool_metrics():
+        status = pool_status()
+        lines = metrics.family('casting_db_pool_connections', 'Pooled connections by state.', 'gauge', [
+            ({'state': state}, status[state]) for state in ('checked_in', 'checked_out', 'overflow')
+            if state in status
+        ])
+        lines += metrics.family('casting_db_pool_checkouts_total', 'Connection checkouts, by outcome.',
+                                'counter', [({'result': 'ok'}, status['checkouts'] - status['timeouts']),
+                                            ({'result': 'timeout'}, status['timeouts'])])
+        lines += metrics.family('casting_db_pool_wait_seconds_total', 'Time checkouts waited for a connection.',
+                                'counter', [({}, status['wait_seconds_total'])])
+        return lines
+
+    def cache_metrics():
+        responses = cache.response_cache.stats()
+        tokens = auth.token_cache.stats()
+        lines = metrics.family('casting_response_cache_requests_total', 'Cacheable requests, by outcome.',
+                               'counter', [({'result': 'hit'}, responses['hits']),
+                                           ({'result': 'miss'}, responses['misses']),
+                                           ({'result': 'not_modified'}, responses['not_modified'])])
+        lines += metrics.family('casting_token_cache_requests_total', 'Token verifications, by cache outcome.',
+                                'counter', [({'result': 'hit'}, tokens['hits']),
+                                            ({'result': 'miss'}, tokens['misses'])])
+        return lines
+
+    # GET /metrics (Prometheus text format)
+    @app.route("/metrics")
+    @requires_metrics_access
+    def prometheus_metrics():
+        """Request and phase timings per route, plus pool and cache counters."""
+        return Response(metrics.render([pool_metrics, cache_metrics]), content_type=metrics.CONTENT_TYPE)
+
+    # GET /movies?limit=&cursor=&fields=&include=actors&release_date_from=&release_date_to=&updated_since=
     @app.route('/movies', methods=['GET'])
     @requires_auth('get:movies')
+    @cached_response('movies', include=MOVIE_INCLUDES)
     def get_movies(payload):
-        movies = Movie.query.all()
-        formatted_movies = [movie.format() for movie in movies]
+        try:
+            formatted_movies, next_cursor = fetch_page(db.session, Movie, request.args)
+        except InvalidQuery as e:
+            abort(400, str(e))
         return jsonify({
             'success': True,
-            'movies': formatted_movies
+            'movies': formatted_movies,
+            'next_cursor': next_cursor
         }), 200
 
-    # GET /actors
+    # GET /actors?limit=&cursor=&fields=&include=movies&gender=&age_min=&age_max=&updated_since=
     @app.route('/actors', methods=['GET'])
     @requires_auth('get:actors')
+    @cached_response('actors', include=ACTOR_INCLUDES)
     def get_actors(payload):
-        actors = Actor.query.all()
-        formatted_actors = [actor.format() for actor in actors]
+        try:
+            formatted_actors, next_cursor = fetch_page(db.session, Actor, request.args)
+        except InvalidQuery as e:
+            abort(400, str(e))
         return jsonify({
             'success': True,
-            'actors': formatted_actors
+            'actors': formatted_actors,
+            'next_cursor': next_cursor
         }), 200
         
+    # GET /search?q=&type=movies,actors&limit=&cursor=
+    @app.route('/search', methods=['GET'])
+    @requires_auth('get:movies', 'get:actors')
+    @cached_response('movies', 'actors')
+    def search_catalog(payload):
+        try:
+            results, next_cursor = search(db.session, request.args)
+        except InvalidQuery as e:
+            abort(400, str(e))
+        return jsonify({
+            'success': True,
+            'results': results,
+            'next_cursor': next_cursor
+        }), 200
+
+    # GET /changes?since=&limit=&wait=&resources=movies,actors,casts
+    @app.route('/changes', methods=['GET'])
+    @requires_auth('get:movies', 'get:actors')
+    def get_changes(payload):
+        try:
+            feed, next_since = changes.poll(db.session, request.args)
+        except InvalidQuery as e:
+            abort(400, str(e))
+        response = jsonify({
+            'success': True,
+            'changes': feed,
+            'next_since': next_since
+        })
+        response.headers['Cache-Control'] = 'no-store'
+        return response, 200
+
+    # GET /movies/export?format=ndjson|json
+    @app.route('/movies/export', methods=['GET'])
+    @requires_auth('get:movies')
+    def export_movies(payload):
+        try:
+            return export_response(db.session, Movie, request.args)
+        except InvalidQuery as e:
+            abort(400, str(e))
+
+    # GET /actors/export?format=ndjson|json
+    @app.route('/actors/export', methods=['GET'])
+    @requires_auth('get:actors')
+    def export_actors(payload):
+        try:
+            return export_response(db.session, Actor, request.args)
+        except InvalidQuery as e:
+            abort(400, str(e))
+
+    # Loads one row with its ?include= relations eagerly (one query each)
+    def get_with_includes(model, id):
+        try:
+            includes = parse_include(model, request.args.get('include'))
+        except InvalidQuery as e:
+            abort(400, str(e))
+        options = [selectinload(getattr(model, name)) for name in includes]
+        return get_live(db.session, model, id, options), includes
+
+    def format_with_includes(row, includes):
+        formatted = row.format()
+        for name in includes:
+            formatted[name] = [related.format() for related in getattr(row, name)]
+        return formatted
+
     @app.route('/movies/<int:id>', methods=['GET'])
     @requires_auth('get:movies')  # Assuming your decorator requires this permission
+    @cached_response('movies', include=MOVIE_INCLUDES, row='id')
     def get_movie(payload, id):  # Make sure 'payload' is accepted as the first argument
         # Query the movie by its ID
-        movie = Movie.query.get(id)
+        movie, includes = get_with_includes(Movie, id)
 
         # If the movie doesn't exist, return 404
         if not movie:
@@ -123,16 +273,21 @@ def create_app(test_config=None):
             }), 404
 
         # If the movie exists, format the movie and return it
-        return jsonify({
+        response = jsonify({
             "success": True,
-            "movie": movie.format()  # Assuming your Movie model has a `format` method
-        }), 200
+            "movie": format_with_includes(movie, includes)
+        })
+        if not includes:
+            # The row's version; expanded responses also depend on the casts
+            response.set_etag(row_etag(movie.version))
+        return response, 200
         
     @app.route('/actors/<int:id>', methods=['GET'])
     @requires_auth('get:actors')  # Assuming your decorator requires this permission
+    @cached_response('actors', include=ACTOR_INCLUDES, row='id')
     def get_actor(payload, id):  # Make sure 'payload' is accepted as the first argument
         # Query the movie by its ID
-        actor = Actor.query.get(id)
+        actor, includes = get_with_includes(Actor, id)
 
         # If the movie doesn't exist, return 404
         if not actor:
@@ -142,38 +297,118 @@ def create_app(test_config=None):
             }), 404
 
         # If the movie exists, format the movie and return it
-        return jsonify({
+        response = jsonify({
             "success": True,
-            "actor": actor.format()  # Assuming your Movie model has a `format` method
+            "actor": format_with_includes(actor, includes)
+        })
+        if not includes:
+            # The row's version; expanded responses also depend on the casts
+            response.set_etag(row_etag(actor.version))
+        return response, 200
+
+
+    # Casts: a movie's actors and an actor's movies, both backed by movie_actors
+    def linked_page(model, relation, related, id):
+        if get_live(db.session, model, id) is None:
+            abort(404)
+        try:
+            items, next_cursor = fetch_page(db.session, related, request.args,
+                                            where=linked_to(model, relation, id))
+        except InvalidQuery as e:
+            abort(400, str(e))
+        return jsonify({
+            'success': True,
+            relation: items,
+            'next_cursor': next_cursor
         }), 200
 
+    def replace_links(model, relation, related, id, key):
+        row = get_live(db.session, model, id)
+        if row is None:
+            abort(404)
+        try:
+            ids = validate_ids(request.get_json(), key)
+        except ValidationError as e:
+            abort(422, str(e))
+
+        linked = related.query.filter(related.id.in_(ids), live(related)).order_by(related.id).all() if ids else []
+        missing = set(ids) - {item.id for item in linked}
+        if missing:
+            abort(422, f'Unknown ids: {", ".join(map(str, sorted(missing)))}.')
+
+        try:
+            setattr(row, relation, linked)
+            formatted = [item.format() for item in linked]
+            record_links(db.session, model, id, relation, [item.id for item in linked])
+            db.session.commit()
+            invalidate('casts')
+            return jsonify({
+                'success': True,
+                relation: formatted
+            }), 200
+        except Exception:
+            logger.exception('Error updating cast', extra={'resource': model.__tablename__})
+            db.session.rollback()
+            abort(500)
+        finally:
+            db.session.close()
+
+    # GET /movies/<id>/actors?limit=&cursor=&fields=&gender=&age_min=&age_max=
+    @app.route('/movies/<int:id>/actors', methods=['GET'])
+    @requires_auth('get:actors')
+    @cached_response('movies', 'actors', 'casts')
+    def get_movie_actors(payload, id):
+        return linked_page(Movie, 'actors', Actor, id)
+
+    # GET /actors/<id>/movies?limit=&cursor=&fields=&release_date_from=&release_date_to=
+    @app.route('/actors/<int:id>/movies', methods=['GET'])
+    @requires_auth('get:movies')
+    @cached_response('movies', 'actors', 'casts')
+    def get_actor_movies(payload, id):
+        return linked_page(Actor, 'movies', Movie, id)
+
+    # PUT /movies/<id>/actors {"actor_ids": [...]} replaces the movie's cast
+    @app.route('/movies/<int:id>/actors', methods=['PUT'])
+    @requires_auth('patch:movies')
+    def set_movie_actors(payload, id):
+        return replace_links(Movie, 'actors', Actor, id, 'actor_ids')
+
+    # PUT /actors/<id>/movies {"movie_ids": [...]} replaces the actor's movies
+    @app.route('/actors/<int:id>/movies', methods=['PUT'])
+    @requires_auth('patch:actors')
+    def set_actor_movies(payload, id):
+        return replace_links(Actor, 'movies', Movie, id, 'movie_ids')
 
     # POST /movies
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
+    @idempotent
     def create_movie(payload):
-        body = request.get_json()
-
-        title = body.get('title', None)
-        release_date = body.get('release_date', None)
-
-        if not title or not release_date:
-            abort(422)
+        try:
+            values = validate_movie(request.get_json())
+        except ValidationError as e:
+            abort(422, str(e))
 
         try:
             # Create a new movie object
-            movie = Movie(title=title, release_date=release_date)
+            movie = Movie(**values)
             
-            # Add and commit the movie to the database
+            # Add the movie and its change-feed entry, then commit both
             db.session.add(movie)
+            db.session.flush()
+            formatted = movie.format()
+            record_rows(db.session, Movie, 'create', [formatted])
             db.session.commit()
+            invalidate('movies')
             
-            return jsonify({
+            response = jsonify({
                 'success': True,
-                'movie': movie.format()
-            }), 201
-        except Exception as e:
-            print(f"Error creating movie: {e}")
+                'movie': formatted
+            })
+            response.set_etag(row_etag(movie.version))
+            return response, 201
+        except Exception:
+            logger.exception('Error creating movie')
             db.session.rollback()  # Rollback in case of any errors
             abort(500)
         finally:
@@ -182,26 +417,29 @@ def create_app(test_config=None):
     # POST /actors
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
+    @idempotent
     def create_actor(payload):
-        body = request.get_json()
-
-        name = body.get('name', None)
-        age = body.get('age', None)
-        gender = body.get('gender', None)
-
-        if not name or not age or not gender:
-            abort(422)
+        try:
+            values = validate_actor(request.get_json())
+        except ValidationError as e:
+            abort(422, str(e))
 
         try:
-            actor = Actor(name=name, age=age, gender=gender)
+            actor = Actor(**values)
             db.session.add(actor)
+            db.session.flush()
+            formatted = actor.format()
+            record_rows(db.session, Actor, 'create', [formatted])
             db.session.commit()
-            return jsonify({
+            invalidate('actors')
+            response = jsonify({
                 'success': True,
-                'actor': actor.format()
-            }), 201
-        except Exception as e:
-            print(f"Error creating actor: {e}")
+                'actor': formatted
+            })
+            response.set_etag(row_etag(actor.version))
+            return response, 201
+        except Exception:
+            logger.exception('Error creating actor')
             db.session.rollback()
             abort(500)
         finally:
@@ -211,111 +449,213 @@ def create_app(test_config=None):
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
     def delete_movie(payload, movie_id):
-        movie = Movie.query.get(movie_id)
-        if not movie:
-            abort(404)
-
+        versions = expected_versions(request.headers.get('If-Match'))
         try:
-            db.session.delete(movie)
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'deleted': movie_id
-            }), 200
-        except Exception as e:
-            print(f"Error deleting movie: {e}")
+            deleted = delete_row(db.session, Movie, movie_id, versions)
+            if deleted:
+                record_deletes(db.session, Movie, [movie_id])
+                db.session.commit()
+                invalidate('movies', rows=[movie_id])
+        except Exception:
+            logger.exception('Error deleting movie')
             db.session.rollback()
             abort(500)
         finally:
             db.session.close()
 
+        if not deleted:
+            abort(missing_status(db.session, Movie, movie_id, versions))
+        return jsonify({
+            'success': True,
+            'deleted': movie_id
+        }), 200
+
     # DELETE /actors/<int:actor_id>
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
     def delete_actor(payload, actor_id):
-        actor = Actor.query.get(actor_id)
-        if not actor:
-            abort(404)
-
+        versions = expected_versions(request.headers.get('If-Match'))
         try:
-            db.session.delete(actor)
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'deleted': actor_id
-            }), 200
-        except Exception as e:
-            print(f"Error deleting actor: {e}")
+            deleted = delete_row(db.session, Actor, actor_id, versions)
+            if deleted:
+                record_deletes(db.session, Actor, [actor_id])
+                db.session.commit()
+                invalidate('actors', rows=[actor_id])
+        except Exception:
+            logger.exception('Error deleting actor')
             db.session.rollback()
             abort(500)
         finally:
             db.session.close()
 
+        if not deleted:
+            abort(missing_status(db.session, Actor, actor_id, versions))
+        return jsonify({
+            'success': True,
+            'deleted': actor_id
+        }), 200
+
     # PATCH /movies/<int:movie_id>
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies')
     def update_movie(payload, movie_id):
-        movie = Movie.query.get(movie_id)
-        if not movie:
-            abort(404)
-
-        body = request.get_json()
-
-        title = body.get('title', None)
-        release_date = body.get('release_date', None)
-
-        if title:
-            movie.title = title
-        if release_date:
-            movie.release_date = release_date
+        versions = expected_versions(request.headers.get('If-Match'))
+        try:
+            values = validate_movie(request.get_json(), partial=True)
+        except ValidationError as e:
+            # A missing movie is reported before an invalid body
+            if not row_exists(db.session, Movie, movie_id):
+                abort(404)
+            abort(422, str(e))
 
         try:
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'movie': movie.format()
-            }), 200
-        except Exception as e:
-            print(f"Error updating movie: {e}")
+            updated = update_row(db.session, Movie, movie_id, values, versions)
+            if updated is not None:
+                record_rows(db.session, Movie, 'update', [updated[0]])
+                db.session.commit()
+                invalidate('movies', rows=[movie_id])
+        except Exception:
+            logger.exception('Error updating movie')
             db.session.rollback()
             abort(500)
         finally:
             db.session.close()
 
+        if updated is None:
+            abort(missing_status(db.session, Movie, movie_id, versions))
+        movie, version = updated
+        response = jsonify({
+            'success': True,
+            'movie': movie
+        })
+        response.set_etag(row_etag(version))
+        return response, 200
+
     # PATCH /actors/<int:actor_id>
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors')
     def update_actor(payload, actor_id):
-        actor = Actor.query.get(actor_id)
-        if not actor:
-            abort(404)
+        versions = expected_versions(request.headers.get('If-Match'))
+        try:
+            values = validate_actor(request.get_json(), partial=True)
+        except ValidationError as e:
+            # A missing actor is reported before an invalid body
+            if not row_exists(db.session, Actor, actor_id):
+                abort(404)
+            abort(422, str(e))
 
-        body = request.get_json()
+        try:
+            updated = update_row(db.session, Actor, actor_id, values, versions)
+            if updated is not None:
+                record_rows(db.session, Actor, 'update', [updated[0]])
+                db.session.commit()
+                invalidate('actors', rows=[actor_id])
+        except Exception:
+            logger.exception('Error updating actor')
+            db.session.rollback()
+            abort(500)
+        finally:
+            db.session.close()
 
-        name = body.get('name', None)
-        age = body.get('age', None)
-        gender = body.get('gender', None)
+        if updated is None:
+            abort(missing_status(db.session, Actor, actor_id, versions))
+        actor, version = updated
+        response = jsonify({
+            'success': True,
+            'actor': actor
+        })
+        response.set_etag(row_etag(version))
+        return response, 200
 
-        if name:
-            actor.name = name
-        if age:
-            actor.age = age
-        if gender:
-            actor.gender = gender
+    BULK_CHANGES = {bulk_create: 'create', bulk_update: 'update'}
 
+    # Bulk endpoints: the body is a JSON array (or {"movies": [...]}, {"ids": [...]}, ...)
+    # and ?atomic=false writes the valid items even if others fail.
+    def run_bulk(operation, model, key, success_status, result_key):
         try:
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'actor': actor.format()
-            }), 200
-        except Exception as e:
-            print(f"Error updating actor: {e}")
+            items = parse_items(request.get_json(), key)
+        except BulkError as e:
+            abort(422, str(e))
+        atomic = parse_atomic(request.args.get('atomic'))
+
+        try:
+            if operation is bulk_update:
+                # Items without changes are answered but neither recorded nor invalidated
+                written, unchanged, errors = operation(db.session, model, items, atomic)
+            else:
+                written, errors = operation(db.session, model, items, atomic)
+                unchanged = []
+            if errors and atomic:
+                db.session.rollback()
+            else:
+                if operation is bulk_delete:
+                    record_deletes(db.session, model, written)
+                else:
+                    record_rows(db.session, model, BULK_CHANGES[operation], written)
+                db.session.commit()
+                if written:
+                    ids = [item if operation is bulk_delete else item['id'] for item in written]
+                    invalidate(model.__tablename__, rows=ids)
+        except Exception:
+            logger.exception('Error in bulk write', extra={'resource': key})
             db.session.rollback()
             abort(500)
         finally:
             db.session.close()
 
+        return jsonify({
+            'success': not errors,
+            result_key: written + unchanged,
+            'errors': errors
+        }), response_status(written + unchanged, errors, success_status)
+
+    # POST /movies/bulk
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('post:movies')
+    @idempotent
+    def create_movies_bulk(payload):
+        return run_bulk(bulk_create, Movie, 'movies', 201, 'movies')
+
+    # POST /actors/bulk
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('post:actors')
+    @idempotent
+    def create_actors_bulk(payload):
+        return run_bulk(bulk_create, Actor, 'actors', 201, 'actors')
+
+    # PATCH /movies/bulk
+    @app.route('/movies/bulk', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    def update_movies_bulk(payload):
+        return run_bulk(bulk_update, Movie, 'movies', 200, 'movies')
+
+    # PATCH /actors/bulk
+    @app.route('/actors/bulk', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    def update_actors_bulk(payload):
+        return run_bulk(bulk_update, Actor, 'actors', 200, 'actors')
+
+    # DELETE /movies/bulk
+    @app.route('/movies/bulk', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies_bulk(payload):
+        return run_bulk(bulk_delete, Movie, 'ids', 200, 'deleted')
+
+    # DELETE /actors/bulk
+    @app.route('/actors/bulk', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors_bulk(payload):
+        return run_bulk(bulk_delete, Actor, 'ids', 200, 'deleted')
+
+    # flask purge-tombstones, to be run daily (e.g. by Heroku Scheduler)
+    @app.cli.command('purge-tombstones')
+    def purge_tombstones_command():
+        """Removes movies and actors deleted more than TOMBSTONE_RETENTION_DAYS ago."""
+        for model in (Movie, Actor):
+            purged = purge_tombstones(db.session, model)
+            click.echo(f'{model.__tablename__}: purged {purged} deleted rows')
+        db.session.commit()
+
     return app
 
 app = create_app()
@@ -0,0 +1,144 @@
+"""Structured, leveled logging for the app.
+
+Log calls made while handling a request only enqueue the record; a background
+QueueListener thread formats it and writes it to stdout, so request threads
+never block on (or contend for) the stream. DEBUG records are emitted only
+for a sampled fraction of requests, which keeps debug detail available in
+production without paying for it on every request.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+from flask import g, has_request_context, request
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0))
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        elif record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that tags records with the current request and drops
+    records below `base_level` unless the request was sampled."""
+
+    def __init__(self, log_queue, base_level=logging.INFO):
+        super().__init__(log_queue)
+        self.base_level = base_level
+
+    def filter(self, record):
+        in_request = has_request_context()
+        if record.levelno < self.base_level and not (in_request and g.get('log_debug', False)):
+            return False
+        if in_request:
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+        return super().filter(record)
+
+    def prepare(self, record):
+        # Resolve the message and traceback here, in the calling thread, so
+        # the record can be formatted later without its args or exc_info.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_listener_after_fork():
+    # The writer thread does not survive a fork (e.g. gunicorn --preload), so
+    # each worker starts its own on the queue it inherited.
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(
+            _listener.queue, *_listener.handlers, respect_handler_level=True
+        )
+        _listener.start()
+
+
+def debug_sampled():
+    """Returns True if DEBUG records for the current request will be kept.
+
+    Use it to skip building expensive debug messages on unsampled requests.
+    """
+    return has_request_context() and g.get('log_debug', False)
+
+
+def configure_logging(app=None, level=LOG_LEVEL, sample_rate=LOG_DEBUG_SAMPLE_RATE, stream=None):
+    """Routes all logging through a non-blocking queue and, given a Flask app,
+    enables per-request debug sampling for it. Safe to call more than once."""
+    global _listener
+
+    root = logging.getLogger()
+    if _listener is None:
+        log_queue = queue.SimpleQueue()
+        writer = logging.StreamHandler(stream or sys.stdout)
+        if LOG_FORMAT == 'json':
+            writer.setFormatter(JSONFormatter())
+        else:
+            writer.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(RequestQueueHandler(log_queue))
+
+        _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_stop_listener)
+        os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+    # Sampled debug records can only be emitted if the loggers let them
+    # through; the queue handler then drops them for unsampled requests.
+    base_level = logging.getLevelName(level) if isinstance(level, str) else level
+    for handler in root.handlers:
+        if isinstance(handler, RequestQueueHandler):
+            handler.base_level = base_level
+    root.setLevel(logging.DEBUG if sample_rate > 0 else base_level)
+
+    if app is not None:
+        @app.before_request
+        def sample_request_logging():
+            g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+            g.log_debug = sample_rate > 0 and random.random() < sample_rate
+
+    return _listener
@@ -0,0 +1,120 @@
+import io
+import json
+import logging
+import os
+import sys
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+import testing
+
+testing.configure_environment()
+
+import app_logging
+from app_logging import JSONFormatter, RequestQueueHandler, configure_logging, debug_sampled
+
+
+class QueuedLoggingTestCase(unittest.TestCase):
+    """This class represents the queued, sampled logging test cases"""
+
+    def setUp(self):
+        self.listener = configure_logging()
+        self.writer = self.listener.handlers[0]
+        self.stream = io.StringIO()
+        self.saved_stream = self.writer.setStream(self.stream)
+        self.saved_formatter = self.writer.formatter
+        self.writer.setFormatter(JSONFormatter())
+        self.logger = logging.getLogger('app_logging_test')
+
+    def tearDown(self):
+        self.drain()
+        self.writer.setStream(self.saved_stream)
+        self.writer.setFormatter(self.saved_formatter)
+        configure_logging()
+
+    def drain(self):
+        """Waits for the listener to write everything queued so far."""
+        app_logging._listener.stop()
+        app_logging._listener.start()
+
+    def lines(self):
+        self.drain()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_go_through_the_queue(self):
+        handlers = logging.getLogger().handlers
+        self.assertEqual(sum(isinstance(handler, RequestQueueHandler) for handler in handlers), 1)
+        self.assertIs(configure_logging(), self.listener)
+
+        self.logger.info('Movie %s created', 7, extra={'movie_id': 7})
+        self.logger.debug('Not sampled')
+        [entry] = self.lines()
+        self.assertEqual(entry['message'], 'Movie 7 created')
+        self.assertEqual((entry['level'], entry['logger'], entry['movie_id']), ('INFO', 'app_logging_test', 7))
+
+    def test_debug_records_follow_the_sampling_rate(self):
+        app = Flask(__name__)
+        configure_logging(app, level='INFO', sample_rate=0.5)
+
+        @app.route('/')
+        def index():
+            self.logger.debug('Detail', extra={'sampled': debug_sampled()})
+            return ''
+
+        client = app.test_client()
+        with mock.patch('app_logging.random.random', return_value=0.4):
+            client.get('/', headers={'X-Request-ID': 'sampled'})
+        with mock.patch('app_logging.random.random', return_value=0.6):
+            client.get('/', headers={'X-Request-ID': 'skipped'})
+
+        [entry] = self.lines()
+        self.assertEqual((entry['request_id'], entry['path'], entry['sampled']), ('sampled', '/', True))
+        self.assertFalse(debug_sampled())
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_listener_is_restarted_after_fork(self):
+        read_end, write_end = os.pipe()
+        with os.fdopen(write_end, 'w') as pipe:
+            self.writer.setStream(pipe)
+            pid = os.fork()
+            if pid == 0:
+                # The parent's writer thread is gone here: only a restarted
+                # listener can write this record
+                try:
+                    self.logger.warning('From the child')
+                    app_logging._listener.stop()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            self.writer.setStream(self.stream)
+        with os.fdopen(read_end) as output:
+            [entry] = [json.loads(line) for line in output.read().splitlines()]
+        self.assertEqual(entry['message'], 'From the child')
+
+
+class JSONFormatterTestCase(unittest.TestCase):
+    """This class represents the JSON log format test cases"""
+
+    def test_records_are_json_with_extra_fields(self):
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            record = logging.getLogger('formatter').makeRecord(
+                'formatter', logging.ERROR, __file__, 1, 'Failed for %s', ('movies',), sys.exc_info(),
+                extra={'resource': 'movies', 'duration_ms': 1.5, '_private': True})
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['message'], 'Failed for movies')
+        self.assertEqual((entry['level'], entry['resource'], entry['duration_ms']), ('ERROR', 'movies', 1.5))
+        self.assertNotIn('_private', entry)
+        self.assertIn('ValueError: bad', entry['exc_info'])
+        self.assertRegex(entry['time'], r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}Z$')
+
+    def test_values_json_cannot_encode_are_strings(self):
+        record = logging.makeLogRecord({'msg': 'Object', 'value': object})
+        self.assertEqual(json.loads(JSONFormatter().format(record))['value'], str(object))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+
+from sqlalchemy import create_engine
+from starlette.testclient import TestClient
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+import idempotency
+from asgi import create_asgi_app
+from models import db, Movie, Actor, movie_actors
+
+# An in-memory SQLite database cannot be shared with a second engine, so the
+# ASGI app then gets a file database seeded with the same rows.
+FLASK_DATABASE_URL = os.environ['DATABASE_URL']
+SEPARATE_DATABASE = FLASK_DATABASE_URL == 'sqlite://'
+
+
+def seed(connection):
+    connection.execute(Movie.__table__.insert(), [
+        {'title': f'Movie {i}', 'release_date': date(2000 + i, 1, 1)} for i in range(5)
+    ])
+    connection.execute(Actor.__table__.insert(), [
+        {'name': f'Actor {i}', 'age': 20 + i, 'gender': 'Female' if i % 2 else 'Male'} for i in range(5)
+    ])
+    connection.execute(movie_actors.insert(), [
+        {'movie_id': 1, 'actor_id': 2}, {'movie_id': 1, 'actor_id': 1}, {'movie_id': 2, 'actor_id': 3},
+    ])
+
+
+class ASGIParityTestCase(unittest.TestCase):
+    """Sends the same requests to the Flask app and to the ASGI app and
+    expects identical responses."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as connection:
+                seed(connection)
+        cache.backend.clear()
+        idempotency.store.clear()
+
+        database_url = FLASK_DATABASE_URL
+        if SEPARATE_DATABASE:
+            self.directory = tempfile.TemporaryDirectory()
+            database_url = f'sqlite:///{self.directory.name}/asgi.db'
+            engine = create_engine(database_url)
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                seed(connection)
+            engine.dispose()
+
+        self.flask = app.test_client()
+        self.asgi = TestClient(create_asgi_app(database_url))
+        self.asgi.__enter__()
+        self.headers = testing.auth_headers()
+
+    def tearDown(self):
+        self.asgi.__exit__(None, None, None)
+        if SEPARATE_DATABASE:
+            self.directory.cleanup()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def assertSameResponse(self, method, path, headers=None, **kwargs):
+        headers = self.headers if headers is None else headers
+        expected = self.flask.open(path, method=method, headers=headers, **kwargs)
+        actual = self.asgi.request(method, path, headers=headers, **kwargs)
+        self.assertEqual(actual.status_code, expected.status_code, path)
+        self.assertEqual(actual.headers['content-type'], expected.headers['Content-Type'], path)
+        return expected, actual
+
+    def assertSameBody(self, method, path, headers=None, **kwargs):
+        expected, actual = self.assertSameResponse(method, path, headers, **kwargs)
+        self.assertEqual(actual.content, expected.data, path)
+
+    def test_reads_match(self):
+        for path in [
+            '/movies', '/movies?limit=2', '/movies?fields=title&include=actors',
+            '/movies?release_date_from=2002-01-01', '/movies?cursor=bad', '/movies?include=crew',
+            '/actors?gender=Female&age_min=21', '/actors?include=movies', '/movies?updated_since=' + date.today().isoformat(),
+            '/movies/1', '/movies/1?include=actors', '/movies/99', '/actors/3', '/actors/99',
+        ]:
+            self.assertSameBody('GET', path)
+
+    def test_row_versions_match(self):
+        self.assertEqual(self.asgi.get('/movies/1', headers=self.headers).headers['ETag'],
+                         self.flask.get('/movies/1', headers=self.headers).headers['ETag'])
+        self.assertSameBody('PATCH', '/actors/1', headers=dict(self.headers, **{'If-Match': '"9"'}),
+                            json={'age': 1})
+        response = self.asgi.patch('/actors/1', headers=dict(self.headers, **{'If-Match': '"1"'}),
+                                   json={'age': 1})
+        self.assertEqual(response.headers['ETag'], '"2"')
+
+    def test_auth_errors_match(self):
+        self.assertSameBody('GET', '/movies', headers={})
+        self.assertSameBody('GET', '/movies', headers={'Authorization': 'Basic abc'})
+        self.assertSameBody('GET', '/actors', headers=testing.auth_headers(['get:movies']))
+        self.assertSameBody('GET', '/movies', headers=testing.auth_headers(expires_in=-10))
+
+    def test_writes_match(self):
+        self.assertSameBody('PATCH', '/movies/1', json={'title': 'Changed'})
+        self.assertSameBody('PATCH', '/actors/1', json={'age': 0})
+        self.assertSameBody('PATCH', '/actors/99', json={'age': 30})
+        self.assertSameBody('POST', '/movies', json={'title': 'New'})
+        headers = dict(self.headers, **{'Content-Type': 'application/json'})
+        expected = self.flask.post('/actors', headers=headers, data='{')
+        actual = self.asgi.post('/actors', headers=headers, content='{')
+        self.assertEqual((actual.status_code, actual.content), (expected.status_code, expected.data))
+
+        expected, actual = self.assertSameResponse('POST', '/actors',
+                                                   json={'name': 'New', 'age': 30, 'gender': 'Male'})
+        self.assertEqual(expected.status_code, 201)
+        self.assertEqual({**actual.json()['actor'], 'id': None}, {**expected.get_json()['actor'], 'id': None})
+
+        self.assertSameBody('DELETE', '/movies/99')
+        self.assertSameBody('DELETE', '/movies/1', headers=dict(self.headers, **{'If-Match': '"9"'}))
+        if SEPARATE_DATABASE:
+            self.assertSameBody('DELETE', '/movies/2')
+
+    def count_asgi_movies(self):
+        return len(self.asgi.get('/movies', headers=self.headers).json()['movies'])
+
+    def test_idempotent_posts_match(self):
+        movie = {'title': 'New', 'release_date': '2020-01-01'}
+        for client, key in ((self.flask, 'flask'), (self.asgi, 'asgi')):
+            headers = dict(self.headers, **{'Idempotency-Key': key})
+            first = client.post('/movies', headers=headers, json=movie)
+            count = self.count_asgi_movies()
+            retry = client.post('/movies', headers=headers, json=movie)
+            self.assertEqual((retry.status_code, retry.headers['ETag']), (201, first.headers['ETag']))
+            self.assertEqual(retry.headers['Content-Type'], 'application/json')
+            self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+            # A different body under a used key is refused
+            response = self.asgi.post('/movies', headers=headers, json=dict(movie, title='Other'))
+            self.assertIn(b'already used with a different request', response.content)
+            self.assertEqual(self.count_asgi_movies(), count)
+
+        self.assertSameBody('POST', '/movies', headers=dict(self.headers, **{'Idempotency-Key': 'x' * 256}),
+                            json=movie)
+
+if __name__ == "__main__":
+    unittest.main()
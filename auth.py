@@ -3,9 +3,18 @@ import jwt
 import urllib.request
 import json
 import base64
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import OrderedDict
 from flask import request, abort
 from functools import wraps
 from dotenv import load_dotenv
+from app_logging import debug_sampled
+import cache
+import metrics
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
@@ -18,13 +27,35 @@ AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN')
 AUDIENCE = os.getenv('AUDIENCE')
 ALGORITHMS = ['RS256']
 
+logger = logging.getLogger(__name__)
+
+# JWKS caching: keys are refreshed every JWKS_CACHE_TTL seconds, and an unknown
+# 'kid' triggers at most one refetch per JWKS_MIN_REFRESH_INTERVAL seconds.
+JWKS_URL = os.getenv('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_TTL = float(os.getenv('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = float(os.getenv('JWKS_FETCH_TIMEOUT', 5))
+
+# Verified-token cache: TOKEN_CACHE_SIZE=0 disables it. Tokens without an
+# 'exp' claim are kept for at most TOKEN_CACHE_MAX_TTL seconds.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_MAX_TTL = float(os.getenv('TOKEN_CACHE_MAX_TTL', 300))
+
+# Operational routes (/metrics, /health/db) also accept this static bearer
+# token, for scrapers that cannot fetch JWTs. Unset, only JWTs with the
+# 'get:metrics' permission are.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 ##############################################################################
 # AUTH HELPERS ###############################################################
 ##############################################################################
 
 def get_token_auth_header():
     """Extracts the Access Token from the Authorization Header."""
-    auth = request.headers.get("Authorization", None)
+    return parse_auth_header(request.headers.get("Authorization", None))
+
+def parse_auth_header(auth):
+    """Returns the bearer token from an Authorization header value."""
     if not auth:
         abort(401, 'Authorization header is missing.')
 
@@ -39,8 +70,8 @@ def get_token_auth_header():
 
     return parts[1]
 
-def get_rsa_pem(n, e):
-    """Convert the JWKS 'n' and 'e' values to an RSA public key in PEM format."""
+def get_rsa_public_key(n, e):
+    """Convert the JWKS 'n' and 'e' values to an RSA public key object."""
     # Decode the base64url-encoded modulus and exponent
     n_bytes = base64.urlsafe_b64decode(n + '==')
     e_bytes = base64.urlsafe_b64decode(e + '==')
@@ -50,7 +81,11 @@ def get_rsa_pem(n, e):
     e_int = int.from_bytes(e_bytes, 'big')
 
     # Create RSA key object
-    public_key = rsa.RSAPublicNumbers(e_int, n_int).public_key(default_backend())
+    return rsa.RSAPublicNumbers(e_int, n_int).public_key(default_backend())
+
+def get_rsa_pem(n, e):
+    """Convert the JWKS 'n' and 'e' values to an RSA public key in PEM format."""
+    public_key = get_rsa_public_key(n, e)
 
     # Serialize the key to PEM format
     pem = public_key.public_bytes(
@@ -60,61 +95,252 @@ def get_rsa_pem(n, e):
 
     return pem
 
-def verify_decode_jwt(token):
-    """Verifies and decodes the JWT token."""
-    jsonurl = urllib.request.urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+def fetch_jwks(url, timeout=JWKS_FETCH_TIMEOUT):
+    """Fetches a JWKS document. Accepts http(s):// as well as file:// URLs."""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def parse_jwks(jwks):
+    """Builds a {kid: public key} mapping from the RSA signing keys of a JWKS."""
+    keys = {}
+    for key in jwks.get('keys', []):
+        if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+            continue
+        if 'kid' not in key or 'n' not in key or 'e' not in key:
+            continue
+        keys[key['kid']] = get_rsa_public_key(key['n'], key['e'])
+    return keys
+
+class JWKSKeyStore:
+    """In-process store of the JWKS signing keys, keyed by 'kid'.
+
+    Keys are kept as ready-to-use public key objects and refetched once the
+    TTL has passed. A token signed with an unknown 'kid' (key rotation)
+    triggers a refetch, rate limited to one per min_refresh_interval.
+    Refreshes are single-flight: when many threads need a refresh at once,
+    one of them fetches and the others wait for and reuse its result. If a
+    refresh fails the previously fetched keys keep being served.
+
+    Given a cache backend, the raw JWKS document is shared through it, so
+    workers sharing the backend fetch it once between them.
+    """
+
+    def __init__(self, url, ttl=JWKS_CACHE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL, fetch=fetch_jwks, cache=None):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch = fetch
+        self.cache = cache
+        self.fetch_count = 0
+        self._keys = {}
+        self._expires_at = 0.0
+        self._last_attempt = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        """Returns the public key for 'kid', or None if the JWKS has no such key."""
+        generation = self._generation
+        if time.monotonic() >= self._expires_at:
+            self.refresh(generation)
+            generation = self._generation
+
+        key = self._keys.get(kid)
+        if key is None:
+            self.refresh(generation, kid=kid)
+            key = self._keys.get(kid)
+        return key
+
+    def cached_key(self, kid):
+        """Returns the key for 'kid' if it is held and fresh, else None.
+        Never fetches, so it is safe to call from an event loop."""
+        if time.monotonic() >= self._expires_at:
+            return None
+        return self._keys.get(kid)
+
+    def _load(self, kid=None):
+        """Returns the JWKS document, going through the shared cache if any.
+
+        A cached document is reused unless it lacks the 'kid' being looked
+        for, in which case it is refetched and the cache updated.
+        """
+        if self.cache is None:
+            self.fetch_count += 1
+            return self.fetch(self.url)
+
+        def fetch():
+            self.fetch_count += 1
+            return self.fetch(self.url)
+
+        key = f'jwks:{self.url}'
+        if kid is None:
+            return self.cache.get_or_set(key, fetch, ttl=self.ttl)
+
+        document = self.cache.get(key)
+        if document is None or kid not in {k.get('kid') for k in document.get('keys', [])}:
+            document = fetch()
+            self.cache.set(key, document, ttl=self.ttl)
+        return document
+
+    def refresh(self, generation=None, kid=None):
+        """Refetches the JWKS unless another thread already did so since 'generation'."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            now = time.monotonic()
+            if (self._keys and self._last_attempt is not None
+                    and now - self._last_attempt < self.min_refresh_interval):
+                return
+            self._last_attempt = now
 
-    # Get the token header without verification
-    unverified_header = jwt.get_unverified_header(token)
+            try:
+                keys = parse_jwks(self._load(kid))
+            except Exception:
+                if not self._keys:
+                    logger.exception('JWKS fetch failed', extra={'jwks_url': self.url})
+                    raise
+                # Keep serving the stale keys and retry after the rate limit.
+                logger.warning('JWKS refresh failed, serving cached keys',
+                               exc_info=True, extra={'jwks_url': self.url})
+                self._expires_at = now + self.min_refresh_interval
+                return
 
-    # Choose our key
-    rsa_key = {}
+            logger.info('Fetched JWKS', extra={'jwks_url': self.url, 'key_count': len(keys)})
+            self._keys = keys
+            self._expires_at = now + self.ttl
+            self._generation += 1
+
+    def clear(self):
+        """Drops all cached keys so the next lookup refetches the JWKS."""
+        with self._lock:
+            self._keys = {}
+            self._expires_at = 0.0
+            self._last_attempt = None
+            self._generation += 1
+
+jwks_store = JWKSKeyStore(JWKS_URL, cache=cache.backend)
+
+class TokenCache:
+    """Bounded LRU cache of verified token payloads.
+
+    Entries are keyed by the SHA-256 of the raw token, so the tokens
+    themselves are never kept in memory, and expire at the token's 'exp'.
+    Only payloads that passed full signature, audience and issuer checks
+    are stored.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        """Returns the cached payload for 'token', or None on a miss."""
+        if self.maxsize <= 0:
+            return None
+
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, token, payload):
+        """Caches a verified payload until its 'exp' claim."""
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.time() + self.max_ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops all cached payloads and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+token_cache = TokenCache()
+
+def token_kid(token):
+    """Returns the 'kid' from the token header, which is read unverified."""
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.InvalidTokenError as e:
+        abort(401, f'Invalid token: {str(e)}')
     if 'kid' not in unverified_header:
         abort(401, 'Authorization malformed: "kid" not found in token header.')
+    return unverified_header['kid']
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-            break
-
-    if rsa_key:
-        try:
-            # Construct the public key
-            pem_key = get_rsa_pem(rsa_key['n'], rsa_key['e'])
-
-            # Decode the token
-            payload = jwt.decode(
-                token,
-                pem_key,
-                algorithms=ALGORITHMS,
-                audience=AUDIENCE,
-                issuer=f'https://{AUTH0_DOMAIN}/'
-            )
-
-            # Print the payload for debugging
-            # print("Decoded JWT Payload:", payload)
-
-            return payload
-
-        except jwt.ExpiredSignatureError:
-            abort(401, 'Token expired.')
-        except jwt.InvalidAudienceError:
-            abort(401, 'Incorrect audience.')
-        except jwt.InvalidIssuerError:
-            abort(401, 'Incorrect issuer.')
-        except jwt.InvalidTokenError as e:
-            abort(401, f'Invalid token: {str(e)}')
-        except Exception as e:
-            abort(400, f'Error decoding token headers: {str(e)}')
-
-    abort(401, 'Unable to find appropriate key.')
+def decode_token(token, public_key):
+    """Verifies the token against 'public_key' and caches its payload."""
+    if public_key is None:
+        abort(401, 'Unable to find appropriate key.')
+
+    try:
+        # Decode the token
+        payload = jwt.decode(
+            token,
+            public_key,
+            algorithms=ALGORITHMS,
+            audience=AUDIENCE,
+            issuer=f'https://{AUTH0_DOMAIN}/'
+        )
+    except jwt.ExpiredSignatureError:
+        abort(401, 'Token expired.')
+    except jwt.InvalidAudienceError:
+        abort(401, 'Incorrect audience.')
+    except jwt.InvalidIssuerError:
+        abort(401, 'Incorrect issuer.')
+    except jwt.InvalidTokenError as e:
+        abort(401, f'Invalid token: {str(e)}')
+    except Exception as e:
+        abort(400, f'Error decoding token headers: {str(e)}')
+
+    token_cache.set(token, payload)
+    return payload
+
+def verify_decode_jwt(token):
+    """Verifies and decodes the JWT token."""
+    # Tokens seen recently were already fully verified
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    return decode_token(token, jwks_store.get_key(token_kid(token)))
 
 def check_permissions(permission, payload):
     """Checks if the required permission is in the JWT payload."""
@@ -130,22 +356,38 @@ def check_permissions(permission, payload):
 # AUTH DECORATORS ############################################################
 ##############################################################################
 
-def requires_auth(permission=''):
-    """Decorator for handling authentication and authorization."""
+def requires_auth(*permissions):
+    """Decorator for handling authentication and authorization. The token
+    must carry every one of 'permissions'."""
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            #print(f"Token: {token}")  # Log the token for debugging
+            with metrics.phase('auth_header'):
+                token = get_token_auth_header()
+            with metrics.phase('jwt'):
+                payload = verify_decode_jwt(token)
+            for permission in permissions or ('',):
+                check_permissions(permission, payload)
 
-            payload = verify_decode_jwt(token)
-            print(f"Decoded JWT payload: {payload}")  # Log the decoded payload
-
-            check_permissions(permission, payload)
-
-            # Log the function arguments to see if payload or kwargs are affected
-            print(f"Function arguments before calling: args={args}, kwargs={kwargs}")
+            # Only the subject is logged; the full claims never leave the process
+            if debug_sampled():
+                logger.debug('Authorized request', extra={
+                    'sub': payload.get('sub'),
+                    'permission': ','.join(permissions),
+                    'view_args': kwargs,
+                })
             return f(payload, *args, **kwargs)  # Pass payload to the decorated function
         return wrapper
     return decorator
 
+
+def requires_metrics_access(f):
+    """Decorator for the operational routes: the bearer token must be
+    METRICS_TOKEN, or a JWT with the 'get:metrics' permission."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        token = get_token_auth_header()
+        if not (METRICS_TOKEN and hmac.compare_digest(token.encode('utf-8'), METRICS_TOKEN.encode('utf-8'))):
+            check_permissions('get:metrics', verify_decode_jwt(token))
+        return f(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+
+import testing
+
+testing.configure_environment()
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask
+
+import auth
+from cache import LocalCache
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the test cases for the JWKS key store"""
+
+    def setUp(self):
+        self.url = testing.write_jwks_file()
+        self.fetches = 0
+
+    def counting_fetch(self, url):
+        self.fetches += 1
+        return auth.fetch_jwks(url)
+
+    def test_get_key_from_local_jwks_file(self):
+        store = auth.JWKSKeyStore(self.url)
+        key = store.get_key(testing.TEST_KID)
+        self.assertIsInstance(key, rsa.RSAPublicKey)
+        self.assertEqual(key.public_numbers(), testing.private_key().public_key().public_numbers())
+
+    def test_keys_are_cached_until_ttl(self):
+        store = auth.JWKSKeyStore(self.url, ttl=60, fetch=self.counting_fetch)
+        for _ in range(10):
+            store.get_key(testing.TEST_KID)
+        self.assertEqual(self.fetches, 1)
+
+    def test_expired_ttl_refetches(self):
+        store = auth.JWKSKeyStore(self.url, ttl=0, min_refresh_interval=0, fetch=self.counting_fetch)
+        store.get_key(testing.TEST_KID)
+        store.get_key(testing.TEST_KID)
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        store = auth.JWKSKeyStore(self.url, ttl=60, min_refresh_interval=60, fetch=self.counting_fetch)
+        store.get_key(testing.TEST_KID)
+        for _ in range(5):
+            self.assertIsNone(store.get_key('rotated-key'))
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_picks_up_rotated_key(self):
+        store = auth.JWKSKeyStore(self.url, ttl=60, min_refresh_interval=0)
+        store.get_key(testing.TEST_KID)
+        new_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        store.url = testing.write_jwks_file(testing.jwks(kid='rotated-key', key=new_key))
+        self.assertIsNotNone(store.get_key('rotated-key'))
+
+    def test_concurrent_refresh_is_single_flight(self):
+        def slow_fetch(url):
+            time.sleep(0.1)
+            return self.counting_fetch(url)
+
+        store = auth.JWKSKeyStore(self.url, fetch=slow_fetch)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(store.get_key(testing.TEST_KID)))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetches, 1)
+        self.assertTrue(all(key is not None for key in results))
+
+    def test_stores_sharing_a_cache_fetch_once(self):
+        shared = LocalCache()
+        first = auth.JWKSKeyStore(self.url, fetch=self.counting_fetch, cache=shared)
+        second = auth.JWKSKeyStore(self.url, fetch=self.counting_fetch, cache=shared)
+        self.assertIsNotNone(first.get_key(testing.TEST_KID))
+        self.assertIsNotNone(second.get_key(testing.TEST_KID))
+        self.assertEqual(self.fetches, 1)
+
+    def test_failed_refresh_keeps_stale_keys(self):
+        store = auth.JWKSKeyStore(self.url, ttl=0, min_refresh_interval=0)
+        store.get_key(testing.TEST_KID)
+        store.url = 'file:///nonexistent/jwks.json'
+        self.assertIsNotNone(store.get_key(testing.TEST_KID))
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the test cases for the verified-token cache"""
+
+    def test_hit_and_miss_counters(self):
+        cache = auth.TokenCache(maxsize=10)
+        self.assertIsNone(cache.get('token'))
+        cache.set('token', {'exp': time.time() + 60})
+        self.assertIsNotNone(cache.get('token'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10})
+
+    def test_entries_expire_at_exp(self):
+        cache = auth.TokenCache(maxsize=10)
+        cache.set('token', {'exp': time.time() - 1})
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = auth.TokenCache(maxsize=2)
+        payload = {'exp': time.time() + 60}
+        cache.set('a', payload)
+        cache.set('b', payload)
+        cache.get('a')
+        cache.set('c', payload)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+
+    def test_zero_size_disables_cache(self):
+        cache = auth.TokenCache(maxsize=0)
+        cache.set('token', {'exp': time.time() + 60})
+        self.assertIsNone(cache.get('token'))
+
+
+class VerifyDecodeJWTTestCase(unittest.TestCase):
+    """This class represents the test cases for token verification"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        auth.token_cache.clear()
+
+    def test_valid_token(self):
+        token = testing.mint_token(permissions=['get:movies'])
+        with self.app.test_request_context():
+            payload = auth.verify_decode_jwt(token)
+        self.assertEqual(payload['permissions'], ['get:movies'])
+
+    def test_repeated_token_is_served_from_cache(self):
+        token = testing.mint_token()
+        with self.app.test_request_context():
+            first = auth.verify_decode_jwt(token)
+            second = auth.verify_decode_jwt(token)
+        self.assertEqual(first, second)
+        self.assertEqual(auth.token_cache.stats()['hits'], 1)
+
+    def test_invalid_token_is_not_cached(self):
+        token = testing.mint_token(aud='https://someone-else/')
+        with self.app.test_request_context():
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    auth.verify_decode_jwt(token)
+        self.assertEqual(auth.token_cache.stats()['size'], 0)
+
+    def test_unknown_kid_is_unauthorized(self):
+        token = testing.mint_token(kid='not-in-jwks')
+        with self.app.test_request_context():
+            with self.assertRaises(Exception) as context:
+                auth.verify_decode_jwt(token)
+        self.assertEqual(context.exception.code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+from benchmarks import bench_routes
+from models import db
+
+
+class RouteBenchmarkTestCase(unittest.TestCase):
+    """This class represents the route benchmark suite test cases"""
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_every_route_has_a_scenario(self):
+        self.assertEqual(bench_routes.uncovered_routes(app), [])
+
+    def test_every_scenario_runs_without_errors(self):
+        results = bench_routes.run(rows=20, requests=3, warmup=1)
+        self.assertEqual(list(results), [name for name, *_ in bench_routes.SCENARIOS])
+        for name, result in results.items():
+            self.assertEqual((result['requests'], result['errors']), (3, 0), name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+
+    def test_compare_reports_regressions_beyond_the_threshold(self):
+        meta = {'timestamp': '', 'database': 'sqlite', 'rows': 20, 'concurrency': 1, 'cache': False}
+        baseline = {'meta': meta, 'routes': {'GET /movies': {'p95_ms': 2.0}, 'GET /actors': {'p95_ms': 2.0}}}
+        results = {'GET /movies': {'p95_ms': 2.2}, 'GET /actors': {'p95_ms': 3.0}, 'GET /search': {'p95_ms': 9.0}}
+        self.assertEqual(bench_routes.compare(results, meta, baseline, threshold=0.2), ['GET /actors'])
+
+
+if __name__ == "__main__":
+    unittest.main()
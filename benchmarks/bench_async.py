@@ -0,0 +1,173 @@
+"""Flask under gunicorn versus the ASGI app under uvicorn.
+
+Starts both servers with the same number of workers against DATABASE_URL
+(a seeded SQLite file unless set; use Postgres for meaningful numbers),
+then keeps --concurrency requests in flight against each for --seconds.
+gunicorn runs with gunicorn.conf.py and each --worker-class given (named
+in the results), so threads per worker follow DB_POOL_SIZE as in a
+deployment. --db-latency-ms routes Postgres traffic through a local
+proxy that delays every reply, to model a database on another host: that
+is where the async mode pays off, while with a local database the two
+come out close.
+
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_async --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import httpx
+
+import testing
+
+testing.configure_environment()
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from models import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUNICORN = ['gunicorn', '-c', 'gunicorn.conf.py', 'app:app', '--workers', '{workers}', '-b', '127.0.0.1:{port}']
+UVICORN = ['uvicorn', 'asgi:app', '--workers', '{workers}', '--port', '{port}', '--log-level', 'warning']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_latency_proxy(host, port, latency):
+    """Forwards a local port to host:port, delaying every server reply by
+    'latency' seconds. Returns the local port."""
+    async def pipe(reader, writer, delay):
+        try:
+            while data := await reader.read(65536):
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(host, port)
+        await asyncio.gather(pipe(client_reader, server_writer, 0),
+                             pipe(server_reader, client_writer, latency),
+                             return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server.sockets[0].getsockname()[1]
+
+
+def prepare_database(rows):
+    engine = create_engine(os.environ['DATABASE_URL'])
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if connection.exec_driver_sql('SELECT count(*) FROM movies').scalar() < rows:
+            connection.execute(db.metadata.tables['movies'].insert(), [
+                {'title': f'Movie {i}', 'release_date': date(2020, 1, 1)} for i in range(rows)
+            ])
+    engine.dispose()
+
+
+def start(command, workers, **environ):
+    port = free_port()
+    command = [part.format(workers=workers, port=port) for part in command]
+    # The ASGI app has no response cache, so the Flask one is kept cold too
+    env = dict(os.environ, LOG_LEVEL='WARNING', RESPONSE_CACHE_TTL='0', **environ)
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'{url}/movies')
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{command[0]} did not start')
+
+
+async def drive(url, path, concurrency, seconds, headers):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                except httpx.TransportError:
+                    # Sync workers close every connection after one response,
+                    # so a reused one can be reset
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', action='append', choices=('sync', 'gthread'),
+                        help='gunicorn worker class, repeatable (default: gthread, as gunicorn.conf.py picks)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--path', default='/movies?limit=20')
+    parser.add_argument('--db-latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    if os.environ['DATABASE_URL'] == 'sqlite://':
+        os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+    prepare_database(100)
+    headers = testing.auth_headers()
+
+    if args.db_latency_ms:
+        url = make_url(os.environ['DATABASE_URL'])
+        if url.get_backend_name() != 'postgresql':
+            sys.exit('--db-latency-ms needs a Postgres DATABASE_URL with a host.')
+        port = start_latency_proxy(url.host or 'localhost', url.port or 5432, args.db_latency_ms / 1000)
+        os.environ['DATABASE_URL'] = str(url.set(host='127.0.0.1', port=port))
+
+    print(f'database: {os.environ["DATABASE_URL"].split(":")[0]} (+{args.db_latency_ms:g} ms), '
+          f'workers: {args.workers}, concurrency: {args.concurrency}, path: {args.path}')
+    # The worker class goes through gunicorn.conf.py, which sets the threads
+    # to match: with -k alone, sync would turn into gthread
+    servers = [(f'flask (gunicorn {worker_class})', GUNICORN, {'GUNICORN_WORKER_CLASS': worker_class})
+               for worker_class in args.worker_class or ['gthread']]
+    servers.append(('asgi (uvicorn)', UVICORN, {}))
+    for label, command, environ in servers:
+        process, url = start(command, args.workers, **environ)
+        try:
+            latencies, errors = asyncio.run(drive(url, args.path, args.concurrency, args.seconds, headers))
+        finally:
+            process.terminate()
+            process.wait()
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f'{label:<24} {len(latencies) / args.seconds:8.0f} req/s  '
+              f'p50 {statistics.median(latencies) * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms  '
+              f'errors {errors}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Per-request authentication cost with the verified-token cache on and off.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_auth --requests 2000
+"""
+import argparse
+import time
+
+import testing
+
+testing.configure_environment()
+
+from flask import Flask, jsonify
+
+import auth
+from auth import requires_auth
+
+
+def build_app():
+    app = Flask(__name__)
+
+    @app.route('/protected')
+    @requires_auth('get:movies')
+    def protected(payload):
+        return jsonify({'success': True})
+
+    return app
+
+
+def run(client, token, requests):
+    headers = {'Authorization': f'Bearer {token}'}
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get('/protected', headers=headers)
+        assert response.status_code == 200, response.status_code
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    client = build_app().test_client()
+    token = testing.mint_token()
+
+    # Warm the JWKS key store so neither run pays for the fetch.
+    auth.jwks_store.get_key(testing.TEST_KID)
+
+    auth.token_cache.maxsize = 0
+    uncached = run(client, token, args.requests)
+
+    auth.token_cache.maxsize = auth.TOKEN_CACHE_SIZE or 1024
+    auth.token_cache.clear()
+    cached = run(client, token, args.requests)
+
+    print(f'requests per run:  {args.requests}')
+    print(f'cache off:         {uncached * 1e6:9.1f} us/request')
+    print(f'cache on:          {cached * 1e6:9.1f} us/request')
+    print(f'speedup:           {uncached / cached:9.2f}x')
+    print(f'cache stats:       {auth.token_cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Bulk endpoints versus N single-row calls.
+
+Runs in-process against DATABASE_URL (an in-memory SQLite database unless
+set; point it at Postgres to measure the executemany/RETURNING paths):
+
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_bulk --rows 2000
+"""
+import argparse
+import time
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+from bulk import BULK_MAX_ITEMS
+from models import db
+
+
+def timed(label, rows, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<32} {elapsed:8.3f} s  {rows / elapsed:10.0f} rows/s')
+    return elapsed
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    headers = testing.auth_headers()
+    movies = [{'title': f'Movie {i}', 'release_date': '2024-01-01'} for i in range(args.rows)]
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    ids = []
+
+    def single_create():
+        for movie in movies:
+            response = client.post('/movies', headers=headers, json=movie)
+            ids.append(response.get_json()['movie']['id'])
+
+    def single_update():
+        for id in ids:
+            client.patch(f'/movies/{id}', headers=headers, json={'title': 'Updated'})
+
+    def single_delete():
+        for id in ids:
+            client.delete(f'/movies/{id}', headers=headers)
+
+    def bulk_create():
+        ids.clear()
+        for chunk in chunks(movies, BULK_MAX_ITEMS):
+            response = client.post('/movies/bulk', headers=headers, json=chunk)
+            ids.extend(movie['id'] for movie in response.get_json()['movies'])
+
+    def bulk_update():
+        for chunk in chunks(ids, BULK_MAX_ITEMS):
+            client.patch('/movies/bulk', headers=headers,
+                         json=[{'id': id, 'title': 'Updated'} for id in chunk])
+
+    def bulk_delete():
+        for chunk in chunks(ids, BULK_MAX_ITEMS):
+            client.delete('/movies/bulk', headers=headers, json={'ids': chunk})
+
+    print(f'database: {db.engine.url.drivername}, rows: {args.rows}')
+    results = {}
+    for operation, single, bulk in (
+        ('create', single_create, bulk_create),
+        ('update', single_update, bulk_update),
+        ('delete', single_delete, bulk_delete),
+    ):
+        results[operation] = (
+            timed(f'{operation}: {args.rows} single calls', args.rows, single),
+            timed(f'{operation}: bulk', args.rows, bulk),
+        )
+
+    for operation, (single, bulk) in results.items():
+        print(f'{operation} speedup: {single / bulk:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Serialization cost of a movie list, per 10k rows.
+
+Compares how a list response body can be produced from the same rows:
+
+- orm + format() + json: ORM objects, Movie.format(), the standard library
+  encoder (what jsonify did before json_provider),
+- tuples + format_row + json: column tuples, dates formatted in Python,
+- tuples + orjson: column tuples as dicts, dates encoded by orjson (what
+  fetch_page and json_provider do now).
+
+Fetch, dict building and encoding are timed separately (best of --repeat):
+
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_json --rows 10000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_json.db'))
+
+import testing
+
+testing.configure_environment()
+
+from sqlalchemy import select
+
+from app import app
+from json_provider import OrjsonProvider, StdlibProvider, orjson
+from models import db, Movie
+from queries import FIELDS, format_row
+
+FLASK_JSONIFY = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Movie.__table__.insert(), [
+        {'title': f'Movie {i}', 'release_date': date(2000 + i % 25, 1 + i % 12, 1 + i % 28)}
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def orm_format_json():
+    movies = db.session.query(Movie).order_by(Movie.id).all()
+    fetched = time.perf_counter()
+    items = [movie.format() for movie in movies]
+    built = time.perf_counter()
+    FLASK_JSONIFY.encode({'success': True, 'movies': items}).encode('utf-8')
+    return fetched, built
+
+
+def tuples(build, provider):
+    fields = FIELDS[Movie]
+    statement = select(*[getattr(Movie, field) for field in fields]).order_by(Movie.id)
+
+    def run():
+        rows = db.session.execute(statement).all()
+        fetched = time.perf_counter()
+        items = [build(row, fields) for row in rows]
+        built = time.perf_counter()
+        provider.dumps({'success': True, 'movies': items})
+        return fetched, built
+    return run
+
+
+def dict_row(row, fields):
+    return dict(zip(fields, row))
+
+
+def candidates():
+    yield 'orm + format() + json', orm_format_json
+    yield 'tuples + format_row + json', tuples(format_row, StdlibProvider())
+    yield 'tuples + json', tuples(dict_row, StdlibProvider())
+    if orjson is not None:
+        yield 'tuples + orjson', tuples(dict_row, OrjsonProvider())
+
+
+def measure(run, repeat):
+    """Best (fetch, build, encode) seconds over 'repeat' runs."""
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        fetched, built = run()
+        end = time.perf_counter()
+        times = (fetched - start, built - fetched, end - built)
+        if best is None or sum(times) < sum(best):
+            best = times
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    scale = 10000 / args.rows * 1000
+    with app.app_context():
+        seed(args.rows)
+        print(f'{args.rows} rows, ms per 10k rows (best of {args.repeat})')
+        print(f'{"":<28} {"fetch":>8} {"build":>8} {"encode":>8} {"total":>8}')
+        for name, run in candidates():
+            times = measure(run, args.repeat)
+            print(f'{name:<28}', *(f'{t * scale:8.2f}' for t in (*times, sum(times))))
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
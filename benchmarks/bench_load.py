@@ -0,0 +1,80 @@
+"""Bulk loader (COPY, one transaction per batch) versus the previous loader's
+one autocommitted INSERT per row.
+
+Needs a Postgres database with the schema applied (`flask db upgrade`);
+both loaders write to it and the rows are deleted again afterwards:
+
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_load --rows 50000
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+import psycopg2
+
+import load_data
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title', 'release_date'])
+        writer.writerows((f'Movie {i}', f'{1950 + i % 70}-01-01') for i in range(rows))
+
+
+def row_by_row(connection, path):
+    """What load_data.load_movies used to do, for every row of the file."""
+    connection.autocommit = True
+    with open(path, newline='') as f, connection.cursor() as cursor:
+        for record in csv.DictReader(f):
+            cursor.execute('INSERT INTO movies (title, release_date) VALUES (%s, %s)',
+                           (record['title'], record['release_date']))
+    connection.autocommit = False
+
+
+def bulk(connection, path, batch_size):
+    with open(path, newline='') as f:
+        load_data.load(connection, 'movies', load_data.read_csv(f), batch_size)
+
+
+def delete_movies(connection, first_id):
+    with connection, connection.cursor() as cursor:
+        cursor.execute('DELETE FROM movies WHERE id > %s', (first_id,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=load_data.LOAD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'movies.csv')
+    write_csv(path, args.rows)
+
+    connection = psycopg2.connect(os.environ['DATABASE_URL'])
+    with connection, connection.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(max(id), 0) FROM movies')
+        first_id = cursor.fetchone()[0]
+
+    results = {}
+    try:
+        for label, run in (
+            ('row by row (autocommit)', lambda: row_by_row(connection, path)),
+            (f'COPY, batches of {args.batch_size}', lambda: bulk(connection, path, args.batch_size)),
+        ):
+            start = time.perf_counter()
+            run()
+            results[label] = time.perf_counter() - start
+            delete_movies(connection, first_id)
+            print(f'{label:<32} {results[label]:8.3f} s  {args.rows / results[label]:10.0f} rows/s')
+    finally:
+        connection.close()
+
+    old, new = results.values()
+    print(f'speedup: {old / new:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
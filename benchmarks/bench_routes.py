@@ -0,0 +1,326 @@
+"""Latency and throughput of every API route, in-process.
+
+Seeds --rows movies and actors (three actors per movie) into DATABASE_URL, a
+temporary SQLite file unless set, signs requests with a local key and JWKS
+(see testing.py), then sends --requests requests to each route through the
+Flask test client and reports requests/s and p50/p95/p99 latency. The tables
+are dropped and recreated first, so point it at a scratch database:
+
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_routes \\
+        --rows 10000 --output before.json
+    ... change something ...
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_routes \\
+        --rows 10000 --output after.json --compare before.json
+
+--compare exits with status 1 when a route's p95 grew by more than
+--threshold. The response cache is disabled so every request reaches the
+database; --cache measures repeat requests served from it instead.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+
+from sqlalchemy.engine import make_url
+
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{tempfile.mkdtemp()}/bench_routes.db')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+from models import db, Movie, Actor, movie_actors
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Auth0 login flow redirects to Auth0; there is nothing local to measure
+NOT_BENCHMARKED = {'/', '/login', '/callback', '/logout', '/static/<path:filename>'}
+
+SEED_BATCH_SIZE = 10000
+CAST_SIZE = 3
+BULK_SIZE = 10
+
+
+class Seed:
+    """The seeded rows, and fresh ones for requests that use rows up."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def id(self, i):
+        return i % self.rows + 1
+
+    def cast(self, i):
+        return [self.id(i + offset) for offset in range(CAST_SIZE)]
+
+    def fresh_ids(self, model, count):
+        table = model.__table__
+        with db.engine.begin() as connection:
+            first = connection.execute(db.select(db.func.coalesce(db.func.max(table.c.id), 0))).scalar()
+            connection.execute(table.insert(), [new_row(model, first + i) for i in range(count)])
+            return list(connection.execute(
+                db.select(table.c.id).where(table.c.id > first).order_by(table.c.id)).scalars())
+
+
+def new_row(model, i):
+    if model is Movie:
+        return {'title': f'Movie {i}', 'release_date': date(1950 + i % 70, 1 + i % 12, 1)}
+    return {'name': f'Actor {i}', 'age': 18 + i % 60, 'gender': 'Female' if i % 2 else 'Male'}
+
+
+def seed(rows):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with db.engine.begin() as connection:
+            for model in (Movie, Actor):
+                for start in range(0, rows, SEED_BATCH_SIZE):
+                    connection.execute(model.__table__.insert(), [
+                        new_row(model, i) for i in range(start, min(start + SEED_BATCH_SIZE, rows))
+                    ])
+            for start in range(0, rows, SEED_BATCH_SIZE):
+                connection.execute(movie_actors.insert(), [
+                    {'movie_id': movie_id, 'actor_id': actor_id}
+                    for movie_id in range(start + 1, min(start + SEED_BATCH_SIZE, rows) + 1)
+                    for actor_id in {(movie_id + offset - 1) % rows + 1 for offset in range(CAST_SIZE)}
+                ])
+    return Seed(rows)
+
+
+# (name, method, URL rule, make_requests). make_requests(seed, n) returns n
+# (path, json body) pairs and runs before the clock starts, so any rows the
+# requests use up are created outside the measurement.
+SCENARIOS = [
+    ('GET /health/db', 'GET', '/health/db', lambda s, n: [('/health/db', None)] * n),
+    ('GET /metrics', 'GET', '/metrics', lambda s, n: [('/metrics', None)] * n),
+    ('GET /movies', 'GET', '/movies', lambda s, n: [('/movies?limit=20', None)] * n),
+    ('GET /movies?include=actors', 'GET', '/movies',
+     lambda s, n: [('/movies?limit=20&include=actors', None)] * n),
+    ('GET /actors', 'GET', '/actors', lambda s, n: [('/actors?limit=20&gender=Female&age_min=30', None)] * n),
+    ('GET /search', 'GET', '/search', lambda s, n: [(f'/search?q=movie+{s.id(i)}', None) for i in range(n)]),
+    ('GET /changes', 'GET', '/changes', lambda s, n: [('/changes?limit=100', None)] * n),
+    ('GET /movies/export', 'GET', '/movies/export', lambda s, n: [('/movies/export?format=ndjson', None)] * n),
+    ('GET /actors/export', 'GET', '/actors/export', lambda s, n: [('/actors/export', None)] * n),
+    ('GET /movies/<id>', 'GET', '/movies/<int:id>',
+     lambda s, n: [(f'/movies/{s.id(i)}?include=actors', None) for i in range(n)]),
+    ('GET /actors/<id>', 'GET', '/actors/<int:id>', lambda s, n: [(f'/actors/{s.id(i)}', None) for i in range(n)]),
+    ('GET /movies/<id>/actors', 'GET', '/movies/<int:id>/actors',
+     lambda s, n: [(f'/movies/{s.id(i)}/actors', None) for i in range(n)]),
+    ('GET /actors/<id>/movies', 'GET', '/actors/<int:id>/movies',
+     lambda s, n: [(f'/actors/{s.id(i)}/movies', None) for i in range(n)]),
+    ('PUT /movies/<id>/actors', 'PUT', '/movies/<int:id>/actors',
+     lambda s, n: [(f'/movies/{s.id(i)}/actors', {'actor_ids': s.cast(i + 1)}) for i in range(n)]),
+    ('PUT /actors/<id>/movies', 'PUT', '/actors/<int:id>/movies',
+     lambda s, n: [(f'/actors/{s.id(i)}/movies', {'movie_ids': s.cast(i + 1)}) for i in range(n)]),
+    ('POST /movies', 'POST', '/movies',
+     lambda s, n: [('/movies', {'title': f'New movie {i}', 'release_date': '2024-01-01'}) for i in range(n)]),
+    ('POST /actors', 'POST', '/actors',
+     lambda s, n: [('/actors', {'name': f'New actor {i}', 'age': 30, 'gender': 'Male'}) for i in range(n)]),
+    ('PATCH /movies/<id>', 'PATCH', '/movies/<int:movie_id>',
+     lambda s, n: [(f'/movies/{s.id(i)}', {'title': f'Movie {i}'}) for i in range(n)]),
+    ('PATCH /actors/<id>', 'PATCH', '/actors/<int:actor_id>',
+     lambda s, n: [(f'/actors/{s.id(i)}', {'age': 18 + i % 60}) for i in range(n)]),
+    ('DELETE /movies/<id>', 'DELETE', '/movies/<int:movie_id>',
+     lambda s, n: [(f'/movies/{id}', None) for id in s.fresh_ids(Movie, n)]),
+    ('DELETE /actors/<id>', 'DELETE', '/actors/<int:actor_id>',
+     lambda s, n: [(f'/actors/{id}', None) for id in s.fresh_ids(Actor, n)]),
+    (f'POST /movies/bulk ({BULK_SIZE})', 'POST', '/movies/bulk', lambda s, n: [
+        ('/movies/bulk', [{'title': f'New movie {i}', 'release_date': '2024-01-01'} for i in range(BULK_SIZE)])
+    ] * n),
+    (f'POST /actors/bulk ({BULK_SIZE})', 'POST', '/actors/bulk', lambda s, n: [
+        ('/actors/bulk', [{'name': f'New actor {i}', 'age': 30, 'gender': 'Male'} for i in range(BULK_SIZE)])
+    ] * n),
+    (f'PATCH /movies/bulk ({BULK_SIZE})', 'PATCH', '/movies/bulk', lambda s, n: [
+        ('/movies/bulk', [{'id': s.id(i * BULK_SIZE + j), 'title': 'Updated'} for j in range(BULK_SIZE)])
+        for i in range(n)]),
+    (f'PATCH /actors/bulk ({BULK_SIZE})', 'PATCH', '/actors/bulk', lambda s, n: [
+        ('/actors/bulk', [{'id': s.id(i * BULK_SIZE + j), 'age': 40} for j in range(BULK_SIZE)])
+        for i in range(n)]),
+    (f'DELETE /movies/bulk ({BULK_SIZE})', 'DELETE', '/movies/bulk', lambda s, n: [
+        ('/movies/bulk', {'ids': ids}) for ids in chunks(s.fresh_ids(Movie, n * BULK_SIZE), BULK_SIZE)]),
+    (f'DELETE /actors/bulk ({BULK_SIZE})', 'DELETE', '/actors/bulk', lambda s, n: [
+        ('/actors/bulk', {'ids': ids}) for ids in chunks(s.fresh_ids(Actor, n * BULK_SIZE), BULK_SIZE)]),
+]
+
+
+def chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def uncovered_routes(flask_app, scenarios=SCENARIOS):
+    """(method, rule) pairs of the app that no scenario exercises."""
+    covered = {(method, rule) for _, method, rule, _ in scenarios}
+    return sorted(
+        (method, rule.rule)
+        for rule in flask_app.url_map.iter_rules() if rule.rule not in NOT_BENCHMARKED
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+        if (method, rule.rule) not in covered
+    )
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[max(int(round(fraction * len(ordered))) - 1, 0)]
+
+
+def measure(method, requests, headers, concurrency):
+    """Sends 'requests' with 'concurrency' clients in flight. Returns the
+    latency of each in seconds, the number of 4xx/5xx responses and the
+    wall-clock time taken."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    pending = iter(requests)
+
+    def client_loop():
+        nonlocal errors
+        client = app.test_client()
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                return
+            path, body = request
+            start = time.perf_counter()
+            response = client.open(path, method=method, headers=headers, json=body)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            response.close()
+            with lock:
+                latencies.append(elapsed)
+                errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(client_loop) for _ in range(concurrency)]:
+            future.result()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run(rows, requests, concurrency=1, warmup=5, scenarios=SCENARIOS):
+    """Seeds the database and benchmarks each scenario. Returns the
+    per-route summary, keyed by scenario name."""
+    seeded = seed(rows)
+    headers = testing.auth_headers()
+    results = {}
+    for name, method, _, make_requests in scenarios:
+        with app.app_context():
+            measure(method, make_requests(seeded, warmup), headers, 1)
+            batch = make_requests(seeded, requests)
+        latencies, errors, seconds = measure(method, batch, headers, concurrency)
+        latencies.sort()
+        results[name] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': round(len(latencies) / seconds, 1),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COMPARABLE_SETTINGS = ('database', 'rows', 'concurrency', 'cache')
+
+
+def compare(results, meta, baseline, threshold):
+    """Prints the p95 change of each route against a previous run's results.
+    Returns the names of the routes that regressed beyond 'threshold'."""
+    regressed = []
+    print(f'\nagainst {baseline["meta"].get("revision") or "baseline"} ({baseline["meta"]["timestamp"]}):')
+    for setting in COMPARABLE_SETTINGS:
+        if baseline['meta'].get(setting) != meta[setting]:
+            print(f'warning: {setting} differs ({baseline["meta"].get(setting)} before, {meta[setting]} now)')
+    for name, result in results.items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        change = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressed.append(name)
+            flag = '  REGRESSED'
+        print(f'{name:<32} p95 {before["p95_ms"]:8.2f} -> {result["p95_ms"]:8.2f} ms  {change:+7.1%}{flag}')
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='movies and actors to seed')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per route')
+    parser.add_argument('--route', action='append', help='only routes whose name contains this')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare p95 against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='p95 increase counted as a regression by --compare (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    for method, rule in uncovered_routes(app):
+        print(f'warning: no scenario for {method} {rule}', file=sys.stderr)
+    if not args.cache:
+        cache.response_cache.ttl = 0
+
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.route or any(part in scenario[0] for part in args.route)]
+    database = make_url(os.environ['DATABASE_URL']).get_backend_name()
+    print(f'database: {database}, rows: {args.rows}, requests: {args.requests}, '
+          f'concurrency: {args.concurrency}, cache: {"on" if args.cache else "off"}')
+    results = run(args.rows, args.requests, args.concurrency, args.warmup, scenarios)
+
+    print(f'{"route":<32} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>6}')
+    for name, result in results.items():
+        print(f'{name:<32} {result["rps"]:8.0f} {result["p50_ms"]:8.2f} {result["p95_ms"]:8.2f} '
+              f'{result["p99_ms"]:8.2f} {result["errors"]:6d}')
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'database': database,
+            'python': platform.python_version(),
+            'rows': args.rows,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'cache': args.cache,
+        },
+        'routes': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    status = 1 if any(result['errors'] for result in results.values()) else 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, report['meta'], baseline, args.threshold):
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Cold-start cost: importing the app and serving its first requests.
+
+Each run is a fresh interpreter, so module imports, app creation and the
+first database connection are all counted. The schema is created once up
+front (as `flask db upgrade` would), not by the app.
+
+    python -m benchmarks.bench_startup --runs 10
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_startup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import testing
+
+CHILD = '''
+import json, time
+start = time.perf_counter()
+import testing
+testing.configure_environment()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+assert client.get('/health/db', headers=testing.auth_headers()).status_code == 200
+health = time.perf_counter()
+assert client.get('/movies', headers=testing.auth_headers()).status_code == 200
+movies = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'first /health/db': health - imported,
+    'first GET /movies': movies - health,
+    'total': movies - start,
+}))
+'''
+
+
+def create_schema():
+    testing.configure_environment()
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.create_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{directory}/startup.db')
+    # Children sign their own tokens, so they must not inherit this
+    # process's test JWKS settings.
+    child_env = dict(os.environ)
+    create_schema()
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD], check=True, capture_output=True, text=True, env=child_env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'database: {os.environ["DATABASE_URL"].split(":")[0]}, runs: {args.runs}')
+    for phase in runs[0]:
+        print(f'{phase:<20} {statistics.median(run[phase] for run in runs) * 1000:8.1f} ms (median)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Single-row PATCH/DELETE write paths: ORM load-then-write versus one statement.
+
+'orm' is how the handlers used to write: Query.get, a flush on commit and,
+for updates, a refresh when the expired row is formatted. 'statement' is
+writes.update_row/delete_row, as the handlers write now. Each write is its
+own transaction, as in a request. Runs in-process against DATABASE_URL (a
+SQLite file unless set; use Postgres, where UPDATE ... RETURNING and the
+delete's CTE apply):
+
+    DATABASE_URL=postgresql://localhost/casting_bench python -m benchmarks.bench_writes --rows 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_writes.db'))
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+from models import db, Movie
+from writes import delete_row, update_row
+
+
+def orm_update(id, values):
+    movie = Movie.query.get(id)
+    for key, value in values.items():
+        setattr(movie, key, value)
+    db.session.commit()
+    formatted = movie.format()
+    db.session.close()
+    return formatted
+
+
+def statement_update(id, values):
+    formatted = update_row(db.session, Movie, id, values)
+    db.session.commit()
+    db.session.close()
+    return formatted
+
+
+def orm_delete(id):
+    db.session.delete(Movie.query.get(id))
+    db.session.commit()
+    db.session.close()
+
+
+def statement_delete(id):
+    delete_row(db.session, Movie, id)
+    db.session.commit()
+    db.session.close()
+
+
+PATHS = {
+    'orm': (orm_update, orm_delete),
+    'statement': (statement_update, statement_delete),
+}
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Movie.__table__.insert(), [
+        {'title': f'Movie {i}', 'release_date': date(2000, 1, 1)} for i in range(rows)
+    ])
+    db.session.commit()
+    db.session.close()
+
+
+def timed(label, ids, write):
+    with testing.capture_queries(db.engine) as queries:
+        start = time.perf_counter()
+        for id in ids:
+            write(id)
+        elapsed = time.perf_counter() - start
+    print(f'{label:<20} {len(ids) / elapsed:10.0f} writes/s  {len(queries) / len(ids):5.1f} statements/write')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        for name, (update, delete) in PATHS.items():
+            seed(args.rows)
+            ids = list(range(1, args.rows + 1))
+            timed(f'{name} update', ids, lambda id: update(id, {'title': f'Updated {id}'}))
+            timed(f'{name} delete', ids, delete)
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
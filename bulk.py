@@ -0,0 +1,267 @@
+"""Bulk create/update/delete of movies and actors.
+
+Each bulk request is validated item by item, exactly like the single-row
+handlers, and then written with as few statements as the database allows,
+all inside the caller's transaction:
+
+- inserts are one executemany INSERT ... RETURNING (psycopg2 sends it as a
+  single multi-row VALUES statement),
+- updates are one UPDATE ... FROM (VALUES ...) RETURNING,
+- deletes are soft (see writes.py): one UPDATE ... SET deleted_at = now()
+  WHERE id IN (...) RETURNING, plus one DELETE of the deleted rows' casts.
+
+Databases without RETURNING support (SQLite, used for local tests) fall back
+to a statement per row, still in a single transaction.
+
+In atomic mode any item error means nothing is written (the caller rolls the
+transaction back); otherwise the valid items are written and the failed ones
+are reported by index.
+"""
+import os
+
+from sqlalchemy import Integer, cast, column, func, select, values
+
+from models import Movie, Actor
+from queries import FIELDS, format_row, live
+from validation import ValidationError, validate_movie, validate_actor
+from writes import delete_links, tombstone_values
+
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 1000))
+
+VALIDATORS = {
+    Movie: validate_movie,
+    Actor: validate_actor,
+}
+
+
+class BulkError(ValueError):
+    """Raised when a bulk request body as a whole is unusable."""
+
+
+def parse_items(body, key):
+    """Accepts either a JSON array or an object wrapping one under 'key'."""
+    items = body.get(key) if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise BulkError(f'Expected a JSON array or an object with a "{key}" array.')
+    if not items:
+        raise BulkError('No items given.')
+    if len(items) > BULK_MAX_ITEMS:
+        raise BulkError(f'At most {BULK_MAX_ITEMS} items can be sent at once.')
+    return items
+
+
+def parse_atomic(value):
+    """Parses the ?atomic= query parameter; bulk writes are atomic by default."""
+    return value is None or value.lower() not in ('0', 'false', 'no')
+
+
+def item_error(index, status, message, id=None):
+    error = {'index': index, 'status': status, 'error': message}
+    if id is not None:
+        error['id'] = id
+    return error
+
+
+def response_status(written, errors, success_status):
+    """success_status if every item was written, 207 if only some were,
+    otherwise the most relevant item error status."""
+    if not errors:
+        return success_status
+    if written:
+        return 207
+    return 422 if any(error['status'] == 422 for error in errors) else 404
+
+
+def _supports(session, feature):
+    return getattr(session.bind.dialect, feature, False)
+
+
+def _output_columns(model):
+    return [getattr(model.__table__.c, field) for field in FIELDS[model]]
+
+
+def _parse_id(item):
+    if not isinstance(item, dict):
+        raise ValidationError('Expected a JSON object.')
+    id = item.get('id')
+    if not isinstance(id, int) or isinstance(id, bool):
+        raise ValidationError('id must be an integer.')
+    return id
+
+
+##############################################################################
+# CREATE #####################################################################
+##############################################################################
+
+def insert_rows(session, model, rows):
+    """Inserts validated rows and returns them formatted, in input order."""
+    if not rows:
+        return []
+
+    table = model.__table__
+    fields = FIELDS[model]
+    if _supports(session, 'insert_executemany_returning'):
+        result = session.execute(table.insert().returning(*_output_columns(model)), rows)
+        return [format_row(row, fields) for row in result]
+
+    created = []
+    for row in rows:
+        result = session.execute(table.insert(), row)
+        row = dict(row, id=result.inserted_primary_key[0])
+        created.append(format_row([row.get(field) for field in fields], fields))
+    return created
+
+
+def bulk_create(session, model, items, atomic=True):
+    """Validates and inserts 'items'. Returns (created, errors)."""
+    validate = VALIDATORS[model]
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            rows.append(validate(item))
+        except ValidationError as e:
+            errors.append(item_error(index, 422, str(e)))
+
+    if errors and atomic:
+        return [], errors
+    return insert_rows(session, model, rows), errors
+
+
+##############################################################################
+# UPDATE #####################################################################
+##############################################################################
+
+def _column_types(model):
+    return {name: col.type for name, col in model.__table__.c.items()}
+
+
+def update_rows(session, model, changes):
+    """Applies {id: values}. Returns (updated, unchanged): the rows formatted
+    by id, those the update changed and those it left as they are.
+
+    An item without values leaves its row, version and updated_at as they
+    are; the row is still returned if it exists.
+    """
+    if not changes:
+        return {}, {}
+
+    table = model.__table__
+    fields = FIELDS[model]
+    unchanged = [id for id, row in changes.items() if not row]
+    changes = {id: row for id, row in changes.items() if row}
+    updated = {}
+
+    if changes and _supports(session, 'full_returning'):
+        # One UPDATE ... FROM (VALUES ...) for every item; absent fields are
+        # NULL in the VALUES list and keep their current value.
+        names = [name for name in fields if name != 'id']
+        types = _column_types(model)
+        data = values(
+            column('id', Integer), *[column(name, types[name]) for name in names],
+            name='changes'
+        ).data([
+            (id, *[row.get(name) for name in names]) for id, row in changes.items()
+        ])
+        statement = (
+            table.update()
+            .where(table.c.id == data.c.id, live(model))
+            .values({
+                **{name: func.coalesce(cast(data.c[name], types[name]), table.c[name]) for name in names},
+                'version': table.c.version + 1,
+            })
+            .returning(*_output_columns(model))
+        )
+        updated = {row.id: format_row(row, fields) for row in session.execute(statement)}
+    elif changes:
+        existing = session.execute(
+            select(table.c.id).where(table.c.id.in_(list(changes)), live(model))
+        ).scalars().all()
+        for id in existing:
+            session.execute(table.update().where(table.c.id == id)
+                            .values({**changes[id], 'version': table.c.version + 1}))
+        # Read back with the unchanged rows
+        unchanged.extend(existing)
+
+    rows = {}
+    if unchanged:
+        result = session.execute(select(*_output_columns(model)).where(table.c.id.in_(unchanged), live(model)))
+        rows = {row.id: format_row(row, fields) for row in result}
+    updated.update((id, rows.pop(id)) for id in changes if id in rows)
+    return updated, rows
+
+
+def bulk_update(session, model, items, atomic=True):
+    """Validates and applies partial updates. Returns (updated, unchanged,
+    errors), the rows in request order: those changed, and those whose item
+    had no values to apply.
+
+    Each item must carry the 'id' of the row to update.
+    """
+    validate = VALIDATORS[model]
+    changes, indexes, errors = {}, {}, []
+    for index, item in enumerate(items):
+        try:
+            id = _parse_id(item)
+            if id in changes:
+                raise ValidationError(f'Duplicate id {id}.')
+            changes[id] = validate(item, partial=True)
+            indexes[id] = index
+        except ValidationError as e:
+            errors.append(item_error(index, 422, str(e)))
+
+    if errors and atomic:
+        return [], [], errors
+
+    updated, unchanged = update_rows(session, model, changes)
+    missing = [id for id in changes if id not in updated and id not in unchanged]
+    errors.extend(item_error(indexes[id], 404, 'Not found.', id=id) for id in missing)
+    errors.sort(key=lambda error: error['index'])
+
+    if missing and atomic:
+        return [], [], errors
+    return ([updated[id] for id in changes if id in updated],
+            [unchanged[id] for id in changes if id in unchanged], errors)
+
+
+##############################################################################
+# DELETE #####################################################################
+##############################################################################
+
+def delete_rows(session, model, ids):
+    """Soft-deletes rows by id and returns the set of ids that existed."""
+    if not ids:
+        return set()
+
+    table = model.__table__
+    statement = table.update().where(table.c.id.in_(ids), live(model)).values(tombstone_values(table))
+    if _supports(session, 'full_returning'):
+        deleted = set(session.execute(statement.returning(table.c.id)).scalars())
+    else:
+        deleted = set(session.execute(select(table.c.id).where(table.c.id.in_(ids), live(model))).scalars())
+        session.execute(statement)
+    if deleted:
+        delete_links(session, model, sorted(deleted))
+    return deleted
+
+
+def bulk_delete(session, model, items, atomic=True):
+    """Deletes the given ids. Returns (deleted ids, errors)."""
+    ids, indexes, errors = [], {}, []
+    for index, id in enumerate(items):
+        if not isinstance(id, int) or isinstance(id, bool):
+            errors.append(item_error(index, 422, 'Expected an integer id.'))
+        elif id not in indexes:
+            ids.append(id)
+            indexes[id] = index
+
+    if errors and atomic:
+        return [], errors
+
+    deleted = delete_rows(session, model, ids)
+    missing = [id for id in ids if id not in deleted]
+    errors.extend(item_error(indexes[id], 404, 'Not found.', id=id) for id in missing)
+    errors.sort(key=lambda error: error['index'])
+
+    if missing and atomic:
+        return [], errors
+    return [id for id in ids if id in deleted], errors
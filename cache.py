@@ -0,0 +1,521 @@
+"""Shared caching for the read endpoints and the JWKS key lookup.
+
+Two interchangeable backends are provided:
+
+- LocalCache: an in-process LRU with per-entry TTLs (the default),
+- FileCache: a SQLite file shared by every worker on the host, so gunicorn
+  workers see one copy of each cached response and of the JWKS document,
+  and a write handled by one worker invalidates the caches of all of them.
+
+Select one with CACHE_BACKEND=local|file (and CACHE_FILE_PATH for the
+latter); gunicorn.conf.py picks 'file' when it runs more than one worker.
+With LocalCache, invalidations stay in the process that handled the write:
+other processes serving the same data keep their cached bodies and ETags
+until RESPONSE_CACHE_TTL runs out.
+
+Both backends support get_or_set(), which lets only one caller compute a
+missing value while the others wait for it (stampede protection), across
+threads and, for FileCache, across processes.
+
+On top of the backend, every resource ('movies', 'actors') has a version
+counter that the write handlers bump after they commit. A read response is
+identified by (resource, version, path + query string); that identity is
+both the cache key of the serialized body and the source of the strong ETag.
+A request whose If-None-Match matches the current ETag gets a 304 without
+touching the database, and a write makes every cached body and ETag of its
+resource stale at once by bumping the version.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'local')
+CACHE_FILE_PATH = os.getenv('CACHE_FILE_PATH',
+                            os.path.join(tempfile.gettempdir(), 'casting-agency-cache.sqlite3'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 512))
+CACHE_LOCK_TIMEOUT = float(os.getenv('CACHE_LOCK_TIMEOUT', 5))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 300))
+
+##############################################################################
+# BACKENDS ###################################################################
+##############################################################################
+
+class CacheBackend:
+    """Interface shared by the cache backends.
+
+    Entries set with a ttl may be evicted at any time; entries without one
+    (the version counters) are kept until deleted. Values must be
+    JSON-serializable.
+    """
+
+    def __init__(self):
+        # Striped locks give single-flight per key within the process
+        self._key_locks = [threading.Lock() for _ in range(64)]
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        """Sets 'key' only if it is absent; returns True if it was set."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_if(self, key, value):
+        """Deletes 'key' only if it holds 'value'; returns True if it did."""
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Atomically increments an integer counter and returns the new value."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def get_or_set(self, key, compute, ttl=None, lock_timeout=CACHE_LOCK_TIMEOUT):
+        """Returns the cached value of 'key', computing and caching it on a miss.
+
+        Concurrent callers missing the same key wait for the first one
+        instead of all calling compute(). Waiting is bounded by lock_timeout,
+        after which a caller computes the value itself.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._key_locks[hash(key) % len(self._key_locks)]:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            lock_key = f'lock:{key}'
+            deadline = time.monotonic() + lock_timeout
+            token = uuid.uuid4().hex
+            acquired = self.add(lock_key, token, ttl=lock_timeout)
+            while not acquired and time.monotonic() < deadline:
+                time.sleep(0.01)
+                value = self.get(key)
+                if value is not None:
+                    return value
+                acquired = self.add(lock_key, token, ttl=lock_timeout)
+
+            try:
+                value = compute()
+                self.set(key, value, ttl)
+                return value
+            finally:
+                if acquired:
+                    # Not a lock that expired and another caller took since
+                    self.delete_if(lock_key, token)
+
+
+class LocalCache(CacheBackend):
+    """In-process LRU cache with per-entry TTLs."""
+
+    def __init__(self, maxsize=CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pinned:
+                return self._pinned[key]
+            entry = self._live_entry(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _set(self, key, value, ttl):
+        # Callers hold self._lock
+        if ttl is None:
+            self._entries.pop(key, None)
+            self._pinned[key] = value
+            return
+        self._pinned.pop(key, None)
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        # Check and write under one lock hold, or two callers could both win
+        with self._lock:
+            if key in self._pinned or self._live_entry(key) is not None:
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._pinned.pop(key, None)
+            self._entries.pop(key, None)
+
+    def delete_if(self, key, value):
+        with self._lock:
+            if key in self._pinned:
+                if self._pinned[key] != value:
+                    return False
+                del self._pinned[key]
+                return True
+            entry = self._live_entry(key)
+            if entry is None or entry[0] != value:
+                return False
+            del self._entries[key]
+            return True
+
+    def incr(self, key):
+        with self._lock:
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+            return self._pinned[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+
+
+class FileCache(CacheBackend):
+    """Cache stored in a SQLite file, shared by all processes on the host.
+
+    Each thread of each process opens its own connection. The database runs
+    in WAL mode so readers never block on the single writer, and expired
+    entries are pruned as the number of entries passes max_entries.
+    """
+
+    def __init__(self, path=CACHE_FILE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets = 0
+
+    def _connection(self):
+        # Opened lazily, per thread, and never reused across a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=CACHE_LOCK_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _expiry(self, ttl):
+        return None if ttl is None else time.time() + ttl
+
+    def set(self, key, value, ttl=None):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), self._expiry(ttl))
+        )
+        self._sets += 1
+        if self._sets % 64 == 0:
+            self.prune()
+
+    def add(self, key, value, ttl=None):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires_at <= ?', (key, time.time())
+            )
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), self._expiry(ttl))
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_if(self, key, value):
+        cursor = self._connection().execute(
+            'DELETE FROM cache WHERE key = ? AND value = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, json.dumps(value), time.time())
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, '0', NULL)", (key,)
+            )
+            connection.execute(
+                'UPDATE cache SET value = CAST(value AS INTEGER) + 1 WHERE key = ?', (key,)
+            )
+            value = connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()[0]
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return int(value)
+
+    def prune(self):
+        """Drops expired entries, then the oldest expiring ones beyond max_entries."""
+        connection = self._connection()
+        connection.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+        connection.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache WHERE expires_at IS NOT NULL'
+            ' ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+
+BACKENDS = {
+    'local': LocalCache,
+    'file': FileCache,
+}
+
+
+def create_backend(name=CACHE_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown CACHE_BACKEND "{name}", expected one of: {", ".join(BACKENDS)}.')
+    return BACKENDS[name]()
+
+
+backend = create_backend()
+
+##############################################################################
+# RESPONSE CACHING ###########################################################
+##############################################################################
+
+class ResourceVersions:
+    """Per-resource version counters, kept in the cache backend.
+
+    With a shared backend every worker reads the same counters, so a bump
+    by any worker invalidates the cached responses of all of them. ETags
+    also carry an epoch stored next to the counters: if the counters are
+    ever lost (a new process with LocalCache, a deleted cache file), ETags
+    issued before can never be mistaken for current ones.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @property
+    def epoch(self):
+        epoch = self.cache.get('epoch')
+        if epoch is None:
+            self.cache.add('epoch', uuid.uuid4().hex)
+            epoch = self.cache.get('epoch')
+        return epoch
+
+    def get(self, resource):
+        return self.cache.get(f'version:{resource}') or 0
+
+    def bump(self, resource):
+        return self.cache.incr(f'version:{resource}')
+
+    def row_etag(self, resource, id):
+        return self.cache.get(f'row:{resource}:{id}')
+
+    def set_row_etag(self, resource, id, etag, version, ttl=RESPONSE_CACHE_TTL):
+        """Remembers a row's ETag, rendered while 'resource' was at 'version'.
+
+        A write may have committed while the row was rendered; it bumps the
+        resource before forgetting the row, so an ETag stored after that
+        finds the version moved on and is dropped again.
+        """
+        self.cache.set(f'row:{resource}:{id}', etag, ttl=ttl)
+        if self.get(resource) != version:
+            self.cache.delete(f'row:{resource}:{id}')
+
+    def forget_rows(self, resource, ids):
+        for id in ids:
+            self.cache.delete(f'row:{resource}:{id}')
+
+
+class NotCacheable(Exception):
+    """Raised inside a cache computation to skip caching a response."""
+
+    def __init__(self, response):
+        self.response = response
+
+
+class ResponseCache:
+    """Cache of serialized 200 responses, with per-process hit/miss counters."""
+
+    def __init__(self, cache, ttl=RESPONSE_CACHE_TTL):
+        self.cache = cache
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_not_modified(self):
+        self._count('not_modified')
+
+    def get_or_render(self, key, render):
+        """Returns (entry, hit). render() is called at most once per key at a
+        time and must return a 200 response or raise NotCacheable."""
+        rendered = []
+
+        def compute():
+            response = render()
+            rendered.append(response)
+            etag, weak = response.get_etag()
+            return {'body': response.get_data(as_text=True), 'mimetype': response.mimetype,
+                    'etag': None if weak else etag}
+
+        entry = self.cache.get_or_set(f'response:{key}', compute, ttl=self.ttl)
+        self._count('misses' if rendered else 'hits')
+        return entry, not rendered
+
+    def clear(self):
+        with self._lock:
+            self.hits = self.misses = self.not_modified = 0
+
+    def stats(self):
+        """Returns the hit/miss/304 counters and the hit ratio.
+
+        The ratio counts 304s as hits, since neither touched the database.
+        """
+        with self._lock:
+            served = self.hits + self.not_modified
+            lookups = served + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': served / lookups if lookups else 0.0,
+                'backend': type(self.cache).__name__,
+            }
+
+
+versions = ResourceVersions(backend)
+response_cache = ResponseCache(backend)
+
+
+def etag_for(key):
+    raw = '|'.join([versions.epoch, *map(str, key)]).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def invalidate(*resources, rows=()):
+    """Makes every cached response and ETag of 'resources' stale, in every
+    worker sharing the cache backend, and forgets the row ETags of 'rows'."""
+    for resource in resources:
+        versions.bump(resource)
+        versions.forget_rows(resource, rows)
+
+
+def cached_response(*resources, include=None, row=None):
+    """Decorator for read views: answers If-None-Match with 304 and serves
+    repeated requests from the response cache. Must sit below requires_auth
+    so the permission check still runs on every request.
+
+    A write to any of 'resources' makes the cached response stale. 'include'
+    maps ?include= names to the extra resources an expanded response
+    depends on, e.g. {'actors': ('actors', 'casts')} for /movies. A strong
+    ETag set by the view is kept and replaces the computed one.
+
+    'row' names the view argument holding the row id, for detail views whose
+    strong ETag is the row's version. That ETag is remembered per row, so it
+    is answered with 304 without rendering even after writes to other rows;
+    writes to the row must pass its id to invalidate(rows=...).
+    """
+    include = include or {}
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            depends = list(resources)
+            for name in request.args.get('include', '').split(','):
+                depends.extend(include.get(name.strip(), ()))
+            key = (*depends, *[versions.get(resource) for resource in depends],
+                   request.full_path)
+            etag = etag_for(key)
+            row_id = kwargs[row] if row and 'include' not in request.args else None
+            row_etag = versions.row_etag(resources[0], row_id) if row_id is not None else None
+            etag = row_etag or etag
+
+            if request.if_none_match.contains(etag):
+                response_cache.record_not_modified()
+                response = make_response('', 304)
+            else:
+                def render():
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        raise NotCacheable(response)
+                    return response
+
+                try:
+                    entry, hit = response_cache.get_or_render('|'.join(map(str, key)), render)
+                except NotCacheable as e:
+                    return e.response
+                # A view may set its own ETag, e.g. a row version that
+                # If-Match is checked against; conditional requests then
+                # need the cached entry to know it
+                if entry.get('etag'):
+                    etag = entry['etag']
+                    if row_id is not None and etag != row_etag:
+                        versions.set_row_etag(resources[0], row_id, etag, key[len(depends)])
+                if request.if_none_match.contains(etag):
+                    response_cache.record_not_modified()
+                    response = make_response('', 304)
+                else:
+                    response = make_response(entry['body'], 200)
+                    response.mimetype = entry['mimetype']
+                    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+
+            response.set_etag(etag)
+            # Clients may keep the body but must revalidate it on every use
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,157 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import testing
+
+testing.configure_environment()
+
+from cache import LocalCache, FileCache, ResourceVersions
+
+
+def run_concurrently(target, count=20):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class CacheBackendTests:
+    """Behaviour every cache backend must share"""
+
+    def make_cache(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.cache = self.make_cache()
+
+    def test_set_and_get(self):
+        self.cache.set('key', {'value': [1, 2]}, ttl=60)
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2]})
+        self.assertIsNone(self.cache.get('missing'))
+
+    def test_entries_expire(self):
+        self.cache.set('key', 'value', ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_only_sets_absent_keys(self):
+        self.assertTrue(self.cache.add('key', 'first', ttl=60))
+        self.assertFalse(self.cache.add('key', 'second', ttl=60))
+        self.assertEqual(self.cache.get('key'), 'first')
+
+    def test_add_replaces_expired_keys(self):
+        self.cache.add('key', 'first', ttl=0.05)
+        time.sleep(0.1)
+        self.assertTrue(self.cache.add('key', 'second', ttl=60))
+
+    def test_delete_if_only_deletes_the_given_value(self):
+        self.cache.set('key', 'mine', ttl=60)
+        self.assertFalse(self.cache.delete_if('key', 'theirs'))
+        self.assertEqual(self.cache.get('key'), 'mine')
+        self.assertTrue(self.cache.delete_if('key', 'mine'))
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.delete_if('key', 'mine'))
+
+    def test_incr(self):
+        self.assertEqual(self.cache.incr('counter'), 1)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.get('counter'), 2)
+
+    def test_get_or_set_computes_once_under_concurrency(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        results = []
+        run_concurrently(lambda: results.append(self.cache.get_or_set('key', compute, ttl=60)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 20)
+
+
+class LocalCacheTestCase(CacheBackendTests, unittest.TestCase):
+    """This class represents the test cases for the in-process cache"""
+
+    def make_cache(self):
+        return LocalCache(maxsize=2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', 1, ttl=60)
+        self.cache.set('b', 2, ttl=60)
+        self.cache.get('a')
+        self.cache.set('c', 3, ttl=60)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+
+    def test_entries_without_ttl_are_never_evicted(self):
+        self.cache.incr('counter')
+        for i in range(10):
+            self.cache.set(f'key{i}', i, ttl=60)
+        self.assertEqual(self.cache.get('counter'), 1)
+
+
+class FileCacheTestCase(CacheBackendTests, unittest.TestCase):
+    """This class represents the test cases for the cache shared through a file"""
+
+    def make_cache(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        return FileCache(self.path)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_workers_share_entries_and_counters(self):
+        other_worker = FileCache(self.path)
+        self.cache.set('key', 'value', ttl=60)
+        self.cache.incr('counter')
+        self.assertEqual(other_worker.get('key'), 'value')
+        self.assertEqual(other_worker.incr('counter'), 2)
+
+    def test_version_bump_is_seen_by_every_worker(self):
+        versions = ResourceVersions(self.cache)
+        other_worker = ResourceVersions(FileCache(self.path))
+        self.assertEqual(versions.epoch, other_worker.epoch)
+        other_worker.bump('movies')
+        self.assertEqual(versions.get('movies'), 1)
+
+    def test_get_or_set_computes_once_across_workers(self):
+        workers = [FileCache(self.path) for _ in range(4)]
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        threads = [
+            threading.Thread(target=worker.get_or_set, args=('key', compute), kwargs={'ttl': 60})
+            for worker in workers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_prune_keeps_counters(self):
+        cache = FileCache(self.path, max_entries=2)
+        cache.incr('counter')
+        for i in range(5):
+            cache.set(f'key{i}', i, ttl=60)
+        cache.prune()
+        self.assertEqual(cache.get('counter'), 1)
+        self.assertIsNone(cache.get('key0'))
+        self.assertEqual(cache.get('key4'), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+"""Change feed: every write to the catalog, in commit order.
+
+Each create, update and delete of a movie or actor, and each replacement of
+a cast, appends a row to the `changes` table in the same transaction as the
+write itself (a transactional outbox), so the feed can neither miss a
+committed write nor show one that was rolled back. Rows carry a sequence
+number, the resource and id, the operation and, except for deletes, the
+row as the API returns it.
+
+GET /changes?since=<seq> returns the changes after 'since' in order; a
+consumer stores the returned next_since and passes it back. With
+&wait=<seconds> (at most CHANGES_MAX_WAIT) an empty result is held open
+until a change arrives: writes made by the same process wake the request at
+once, writes from other workers are noticed within CHANGES_POLL_INTERVAL.
+No database connection is held while waiting, but the request does keep a
+worker thread.
+
+Sequence numbers are handed out when a change is inserted, while commits
+can finish in another order; a reader could then see seq 11 committed
+before seq 10 and skip 10 for good. On Postgres writers therefore take a
+transaction-level advisory lock before appending, so changes commit in
+sequence order (SQLite serializes writers anyway). The lock is held only
+from the append, the last statement of a write, to its commit.
+
+Deleting a movie or an actor also removes its casts (writes.delete_links);
+no separate 'casts' change is recorded for that.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from models import Change
+from queries import InvalidQuery, format_row, parse_limit
+
+CHANGES_MAX_WAIT = float(os.getenv('CHANGES_MAX_WAIT', 30))
+CHANGES_POLL_INTERVAL = float(os.getenv('CHANGES_POLL_INTERVAL', 1))
+
+# pg_advisory_xact_lock key serializing appends to the feed
+FEED_LOCK_KEY = 0x63686e67
+
+RESOURCES = ('movies', 'actors', 'casts')
+
+# Notified after a transaction that appended changes commits
+_new_changes = threading.Condition()
+
+
+def _jsonable(item):
+    """Dates as the API formats them, since the JSON column uses json.dumps."""
+    return format_row(list(item.values()), list(item))
+
+
+def record(session, resource, operation, changes):
+    """Appends (id, data) 'changes' to the feed within 'session''s
+    transaction; the caller commits."""
+    if not changes:
+        return
+    if session.bind.dialect.name == 'postgresql':
+        session.execute(select(func.pg_advisory_xact_lock(FEED_LOCK_KEY)))
+    session.execute(Change.__table__.insert(), [
+        {'resource': resource, 'resource_id': id, 'operation': operation,
+         'data': None if data is None else _jsonable(data)}
+        for id, data in changes
+    ])
+    session.info['changes_recorded'] = True
+
+
+def record_rows(session, model, operation, rows):
+    """Records 'create' or 'update' of formatted rows."""
+    record(session, model.__tablename__, operation, [(row['id'], row) for row in rows])
+
+
+def record_deletes(session, model, ids):
+    record(session, model.__tablename__, 'delete', [(id, None) for id in ids])
+
+
+def record_links(session, model, id, relation, ids):
+    """Records that row 'id' of 'model' is now linked to exactly 'ids', e.g.
+    {'id': 1, 'actors': [2, 5]} for PUT /movies/1/actors."""
+    record(session, 'casts', 'replace', [(id, {'id': id, 'resource': model.__tablename__, relation: ids})])
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_waiters(session):
+    if session.info.pop('changes_recorded', False):
+        with _new_changes:
+            _new_changes.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('changes_recorded', None)
+
+
+def parse_since(value):
+    if value in (None, ''):
+        return 0
+    try:
+        since = int(value)
+    except ValueError:
+        raise InvalidQuery('since must be an integer.')
+    if since < 0:
+        raise InvalidQuery('since must not be negative.')
+    return since
+
+
+def parse_wait(value):
+    """Seconds to hold an empty result open, capped at CHANGES_MAX_WAIT."""
+    if value in (None, ''):
+        return 0.0
+    try:
+        wait = float(value)
+    except ValueError:
+        raise InvalidQuery('wait must be a number of seconds.')
+    if not wait >= 0:
+        raise InvalidQuery('wait must not be negative.')
+    return min(wait, CHANGES_MAX_WAIT)
+
+
+def parse_resources(value):
+    if value in (None, ''):
+        return RESOURCES
+    resources = tuple(name.strip() for name in value.split(','))
+    unknown = [name for name in resources if name not in RESOURCES]
+    if unknown:
+        raise InvalidQuery(f'Unknown resources: {", ".join(unknown)}.')
+    return resources
+
+
+def fetch(session, since, limit, resources=RESOURCES):
+    """The first 'limit' changes after 'since', in order."""
+    table = Change.__table__
+    statement = select(table).where(table.c.seq > since).order_by(table.c.seq).limit(limit)
+    if resources != RESOURCES:
+        statement = statement.where(table.c.resource.in_(resources))
+    return [
+        {'seq': row.seq, 'resource': row.resource, 'id': row.resource_id,
+         'operation': row.operation, 'data': row.data}
+        for row in session.execute(statement)
+    ]
+
+
+def poll(session, args):
+    """Returns (changes, next_since) for GET /changes, waiting up to
+    ?wait= seconds for the first change."""
+    since = parse_since(args.get('since'))
+    limit = parse_limit(args.get('limit'))
+    wait = parse_wait(args.get('wait'))
+    resources = parse_resources(args.get('resources'))
+
+    deadline = time.monotonic() + wait
+    while True:
+        changes = fetch(session, since, limit, resources)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            break
+        # Give the connection back while waiting
+        session.close()
+        with _new_changes:
+            _new_changes.wait(min(remaining, CHANGES_POLL_INTERVAL))
+    return changes, changes[-1]['seq'] if changes else since
@@ -0,0 +1,113 @@
+import threading
+import time
+import unittest
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+import idempotency
+from models import db
+
+MOVIE = {'title': 'Movie', 'release_date': '2020-01-01'}
+
+
+class ChangeFeedTestCase(unittest.TestCase):
+    """This class represents the change feed test cases"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.headers = testing.auth_headers()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        cache.backend.clear()
+        idempotency.store.clear()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def feed(self, query=''):
+        response = self.client.get(f'/changes?{query}', headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.get_json()
+
+    def test_every_write_is_recorded_in_order(self):
+        self.client.post('/movies', headers=self.headers, json=MOVIE)
+        self.client.patch('/movies/1', headers=self.headers, json={'title': 'Changed'})
+        self.client.post('/actors/bulk', headers=self.headers, json=[
+            {'name': 'A', 'age': 30, 'gender': 'Male'}, {'name': 'B', 'age': 40, 'gender': 'Female'}])
+        self.client.put('/movies/1/actors', headers=self.headers, json={'actor_ids': [2, 1]})
+        self.client.delete('/actors/bulk', headers=self.headers, json=[1])
+        self.client.delete('/movies/1', headers=self.headers)
+
+        data = self.feed()
+        summary = [(change['seq'], change['resource'], change['id'], change['operation'])
+                   for change in data['changes']]
+        self.assertEqual(summary, [
+            (1, 'movies', 1, 'create'), (2, 'movies', 1, 'update'), (3, 'actors', 1, 'create'),
+            (4, 'actors', 2, 'create'), (5, 'casts', 1, 'replace'), (6, 'actors', 1, 'delete'),
+            (7, 'movies', 1, 'delete'),
+        ])
+        changes = data['changes']
+        self.assertEqual(changes[1]['data'], {'id': 1, 'title': 'Changed', 'release_date': '2020-01-01'})
+        self.assertEqual(changes[4]['data'], {'id': 1, 'resource': 'movies', 'actors': [1, 2]})
+        self.assertIsNone(changes[6]['data'])
+        self.assertEqual(data['next_since'], 7)
+
+    def test_feed_is_paged_with_since(self):
+        for _ in range(3):
+            self.client.post('/movies', headers=self.headers, json=MOVIE)
+        self.client.post('/actors', headers=self.headers, json={'name': 'A', 'age': 30, 'gender': 'Male'})
+
+        first = self.feed('limit=2')
+        self.assertEqual([change['seq'] for change in first['changes']], [1, 2])
+        second = self.feed(f'since={first["next_since"]}&limit=2')
+        self.assertEqual([change['seq'] for change in second['changes']], [3, 4])
+        self.assertEqual(self.feed(f'since={second["next_since"]}'), {
+            'success': True, 'changes': [], 'next_since': 4})
+        self.assertEqual([change['seq'] for change in self.feed('resources=actors')['changes']], [4])
+
+    def test_rolled_back_writes_are_not_recorded(self):
+        self.client.post('/movies/bulk', headers=self.headers, json=[MOVIE, {'title': 'No date'}])
+        self.client.patch('/movies/1', headers=self.headers, json={'title': 'Missing'})
+        self.assertEqual(self.feed()['changes'], [])
+
+    def test_invalid_parameters_are_bad_requests(self):
+        for query in ('since=-1', 'since=abc', 'wait=soon', 'wait=-1', 'resources=crew', 'limit=0'):
+            response = self.client.get(f'/changes?{query}', headers=self.headers)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_requires_movie_and_actor_permissions(self):
+        response = self.client.get('/changes', headers=testing.auth_headers(['get:movies']))
+        self.assertEqual(response.status_code, 403)
+
+    def test_long_poll_returns_when_a_change_is_committed(self):
+        results = []
+
+        def poll():
+            start = time.monotonic()
+            results.append((self.feed('wait=10'), time.monotonic() - start))
+
+        waiter = threading.Thread(target=poll)
+        waiter.start()
+        time.sleep(0.2)
+        self.client.post('/movies', headers=self.headers, json=MOVIE)
+        waiter.join()
+
+        data, elapsed = results[0]
+        self.assertEqual([change['operation'] for change in data['changes']], ['create'])
+        self.assertLess(elapsed, 5)
+
+    def test_long_poll_gives_up_after_wait(self):
+        start = time.monotonic()
+        self.assertEqual(self.feed('since=0&wait=0.2')['changes'], [])
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Streaming export of the full movie and actor catalogs.
+
+Rows are read through a server-side cursor (`stream_results`, a named cursor
+on psycopg2) in batches of EXPORT_BATCH_SIZE and written to the response as
+they arrive, so memory use does not depend on the table size and the first
+bytes go out as soon as the first batch is fetched.
+"""
+import os
+
+from flask import Response, stream_with_context
+from sqlalchemy import select
+
+from json_provider import dumps
+from queries import InvalidQuery, apply_filters, live, parse_fields
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def build_export_query(model, args):
+    """Builds the SELECT for an export: the list filters and fields= apply,
+    pagination does not, and deleted rows are left out. Returns (statement,
+    fields)."""
+    fields = parse_fields(model, args.get('fields'))
+    statement = select(*[getattr(model, field) for field in fields]).where(live(model))
+    statement = apply_filters(model, statement, args)
+    return statement.order_by(model.id).execution_options(stream_results=True), fields
+
+
+def iter_batches(session, statement, fields, batch_size=EXPORT_BATCH_SIZE):
+    """Yields lists of serialized rows, one list per fetched batch."""
+    result = session.connection().execute(statement)
+    try:
+        for partition in result.partitions(batch_size):
+            yield [dumps(dict(zip(fields, row))) for row in partition]
+    finally:
+        result.close()
+
+
+def ndjson_stream(batches):
+    for batch in batches:
+        yield b'\n'.join(batch) + b'\n'
+
+
+def json_array_stream(batches):
+    separator = b'['
+    for batch in batches:
+        yield separator + b','.join(batch)
+        separator = b','
+    yield b'[]' if separator == b'[' else b']'
+
+
+def export_response(session, model, args):
+    """Returns a streaming response with every matching row.
+
+    ?format=ndjson (default) writes one JSON object per line; ?format=json
+    writes a single JSON array, sent in chunks.
+    """
+    export_format = args.get('format', 'ndjson')
+    if export_format not in MIMETYPES:
+        raise InvalidQuery('format must be ndjson or json.')
+
+    statement, fields = build_export_query(model, args)
+    batches = iter_batches(session, statement, fields)
+    stream = ndjson_stream(batches) if export_format == 'ndjson' else json_array_stream(batches)
+
+    response = Response(stream_with_context(stream), mimetype=MIMETYPES[export_format])
+    # Ask reverse proxies not to buffer the whole export before sending it on
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,124 @@
+"""Gunicorn settings, read by `gunicorn -c gunicorn.conf.py app:app`.
+
+Every value can be overridden with the environment variable next to it.
+Without overrides the worker count follows the CPUs available, and the
+concurrency inside a worker follows the database pool, so a request never
+waits on a connection that is not there:
+
+- gthread (default): one worker per CPU plus one, DB_POOL_SIZE threads each,
+- gevent: WEB_CONCURRENCY workers with DB_POOL_SIZE + DB_MAX_OVERFLOW
+  greenlets each (needs `gevent` and `psycogreen` installed), each worker
+  importing the app itself,
+- sync: 2 * CPUs + 1 single-threaded workers.
+
+DB_MAX_CONNECTIONS, when set, caps the workers so that all of their pools
+together stay within the database's connection limit.
+"""
+import os
+
+import models
+from changes import CHANGES_MAX_WAIT
+
+SUPPORTED_WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+
+def cpu_count():
+    # The CPUs this process may run on, which is fewer than os.cpu_count()
+    # in a container with a CPU set
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def connections_per_worker(concurrency):
+    if models.DB_NULL_POOL:
+        # One connection per request in flight, opened through the pooler
+        return concurrency
+    return models.DB_POOL_SIZE + models.DB_MAX_OVERFLOW
+
+
+def default_workers(cpus, worker_class, concurrency, connection_limit=None):
+    workers = 2 * cpus + 1 if worker_class == 'sync' else cpus + 1
+    if connection_limit:
+        workers = min(workers, connection_limit // connections_per_worker(concurrency))
+    return max(workers, 1)
+
+
+threads = int(os.environ.get('GUNICORN_THREADS', models.DB_POOL_SIZE))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+if worker_class not in SUPPORTED_WORKER_CLASSES:
+    raise ValueError(f'GUNICORN_WORKER_CLASS must be one of {", ".join(SUPPORTED_WORKER_CLASSES)}.')
+if worker_class == 'sync':
+    # gunicorn quietly swaps sync workers for gthread ones when threads > 1
+    threads = 1
+
+# gevent runs one greenlet per client connection, so its clients follow the
+# pool. gthread also caps its open connections, idle keep-alive ones
+# included, with this setting, and closes idle ones at the cap: it keeps
+# gunicorn's default, its threads already bound the requests in flight
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS',
+                                        models.DB_POOL_SIZE + models.DB_MAX_OVERFLOW
+                                        if worker_class == 'gevent' else 1000))
+concurrency = {'sync': 1, 'gthread': threads, 'gevent': worker_connections}[worker_class]
+
+connection_limit = int(os.environ.get('DB_MAX_CONNECTIONS', 0)) or None
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             default_workers(cpu_count(), worker_class, concurrency, connection_limit)))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8001)}"
+
+# Each worker's local cache only sees the writes that worker handles, so with
+# several workers the others would keep serving stale bodies and row ETags
+# (false 412s on If-Match) for up to RESPONSE_CACHE_TTL. Share the cache
+# through the file backend instead, unless CACHE_BACKEND says otherwise. Set
+# before the app (and cache.py) is imported, in the master or the workers.
+cache_backend = os.environ.setdefault('CACHE_BACKEND', 'file' if workers > 1 else 'local')
+
+# Importing the app does no I/O (see create_app), so it is loaded once in the
+# master and shared copy-on-write by the workers. Not with gevent: gunicorn
+# monkey-patches each worker only after the fork, so a preloaded app would
+# keep real threading locks (the cache and JWKS locks) and thread-locals (the
+# metrics phases) that block the worker's hub or are shared between
+# greenlets. gevent workers import the app themselves, after patching.
+preload_app = worker_class != 'gevent'
+
+# Recycle workers after a number of requests to bound memory growth; the
+# jitter keeps them from all restarting at the same moment
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+# A sync worker cannot report in while a GET /changes?wait= long poll holds
+# it, so the timeout must outlast the longest wait, plus time to answer
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', CHANGES_MAX_WAIT + 30))
+if worker_class == 'sync' and timeout <= CHANGES_MAX_WAIT:
+    raise ValueError('GUNICORN_TIMEOUT must exceed CHANGES_MAX_WAIT with sync workers.')
+graceful_timeout = timeout
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Worker heartbeats go to a file; keep it in memory rather than on a disk
+# that may block (as Docker's overlay filesystems can)
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def _dispose_engine(server):
+    # Without preload_app the app (and its engine) only exists in workers
+    if server.cfg.preload_app:
+        models.db.get_engine(server.app.wsgi()).dispose()
+
+
+def pre_fork(server, worker):
+    # Anything the master connected for (nothing, normally) is closed before
+    # forking, so no socket to the database is shared with a worker
+    _dispose_engine(server)
+
+
+def post_fork(server, worker):
+    # A fresh pool in the worker; connections are opened on first use
+    _dispose_engine(server)
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole worker unless it yields to gevent
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    server.log.info('Worker %s: %s, concurrency %s, pool %s + %s',
+                    worker.pid, worker_class, concurrency, models.DB_POOL_SIZE, models.DB_MAX_OVERFLOW)
@@ -0,0 +1,79 @@
+import os
+import runpy
+import unittest
+from unittest import mock
+
+import testing
+
+testing.configure_environment()
+
+import models
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+GUNICORN_VARIABLES = ('WEB_CONCURRENCY', 'GUNICORN_THREADS', 'GUNICORN_WORKER_CLASS',
+                      'GUNICORN_WORKER_CONNECTIONS', 'DB_MAX_CONNECTIONS', 'CACHE_BACKEND', 'GUNICORN_TIMEOUT')
+
+
+class GunicornConfigTestCase(unittest.TestCase):
+    """This class represents the gunicorn settings test cases"""
+
+    def load(self, cpus=4, pool_size=4, max_overflow=2, null_pool=False, max_wait=30, **environ):
+        """Evaluates gunicorn.conf.py as gunicorn would, with the given CPU
+        count, pool settings and environment."""
+        environ = {key: str(value) for key, value in environ.items()}
+        base = {key: value for key, value in os.environ.items() if key not in GUNICORN_VARIABLES}
+        with mock.patch.dict(os.environ, dict(base, **environ), clear=True), \
+                mock.patch.multiple(models, DB_POOL_SIZE=pool_size, DB_MAX_OVERFLOW=max_overflow,
+                                    DB_NULL_POOL=null_pool), \
+                mock.patch('changes.CHANGES_MAX_WAIT', max_wait), \
+                mock.patch('os.sched_getaffinity', return_value=set(range(cpus)), create=True):
+            return runpy.run_path(CONFIG_PATH)
+
+    def test_defaults_to_threads_matching_the_pool(self):
+        config = self.load(cpus=4, pool_size=6)
+        self.assertEqual(config['worker_class'], 'gthread')
+        self.assertEqual((config['workers'], config['threads']), (5, 6))
+        # Not capped at the pool: idle keep-alive connections would be closed
+        self.assertEqual(config['worker_connections'], 1000)
+        self.assertTrue(config['preload_app'])
+        self.assertGreater(config['max_requests'], config['max_requests_jitter'])
+        self.assertGreater(config['max_requests_jitter'], 0)
+
+    def test_sync_workers_are_single_threaded(self):
+        config = self.load(cpus=2, GUNICORN_WORKER_CLASS='sync')
+        self.assertEqual((config['workers'], config['threads']), (5, 1))
+        self.assertEqual(self.load(pool_size=1)['worker_class'], 'sync')
+
+    def test_gevent_concurrency_follows_the_pool(self):
+        config = self.load(pool_size=5, max_overflow=3, GUNICORN_WORKER_CLASS='gevent')
+        self.assertEqual(config['worker_connections'], 8)
+        # The app must be imported after gevent patches the worker
+        self.assertFalse(config['preload_app'])
+
+    def test_workers_fit_the_database_connection_limit(self):
+        self.assertEqual(self.load(cpus=8, DB_MAX_CONNECTIONS=20)['workers'], 3)
+        self.assertEqual(self.load(cpus=8, DB_MAX_CONNECTIONS=4)['workers'], 1)
+        self.assertEqual(self.load(cpus=8, null_pool=True, DB_MAX_CONNECTIONS=20)['workers'], 5)
+
+    def test_several_workers_share_the_cache(self):
+        self.assertEqual(self.load(cpus=4)['cache_backend'], 'file')
+        self.assertEqual(self.load(WEB_CONCURRENCY=1)['cache_backend'], 'local')
+        self.assertEqual(self.load(cpus=4, CACHE_BACKEND='local')['cache_backend'], 'local')
+
+    def test_timeout_outlasts_a_changes_long_poll(self):
+        # Sync workers are blocked for the whole wait
+        self.assertEqual(self.load(pool_size=1)['timeout'], 60)
+        self.assertEqual(self.load(pool_size=1, max_wait=100)['timeout'], 130)
+        self.assertEqual(self.load(GUNICORN_TIMEOUT=10)['timeout'], 10)
+        with self.assertRaises(ValueError):
+            self.load(pool_size=1, GUNICORN_TIMEOUT=30)
+
+    def test_environment_overrides(self):
+        config = self.load(WEB_CONCURRENCY=3, GUNICORN_THREADS=2, PORT=5000)
+        self.assertEqual((config['workers'], config['threads'], config['bind']), (3, 2, '0.0.0.0:5000'))
+        with self.assertRaises(ValueError):
+            self.load(GUNICORN_WORKER_CLASS='eventlet')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""Idempotency-Key support for the POST routes.
+
+A client that times out on a POST cannot tell whether the row was created,
+so it retries, and a plain retry creates a duplicate. With an
+`Idempotency-Key: <unique value>` header the first request runs as usual
+and its response is stored for IDEMPOTENCY_TTL seconds; a retry with the
+same key gets that response back (marked `Idempotent-Replayed: true`)
+without validating or writing anything again.
+
+- Keys are scoped to the caller (the token's `sub`) and the route, so two
+  clients can never see each other's responses.
+- A retry carrying a different body than the original gets 422: the key
+  was reused for another request.
+- A retry arriving while the original is still running waits for it, up
+  to IDEMPOTENCY_LOCK_TIMEOUT seconds, then gets 409 rather than running
+  the write a second time. The original holds the key for up to
+  IDEMPOTENCY_LOCK_TTL seconds, which must exceed the longest a request
+  can run (GUNICORN_TIMEOUT), or a retry could take over a key whose
+  write is still running.
+- Responses with a 5xx status (and aborted requests) are not stored, so
+  a retry after a failure runs the write again.
+
+Records live in a bounded store of the CACHE_BACKEND kind, separate from
+the response cache so cached reads can never evict them: with `local`
+each worker keeps its own (so a retry must reach the same worker to be
+recognized), with `file` every worker on the host shares them.
+"""
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+from functools import wraps
+
+from flask import abort, make_response, request
+
+from cache import CACHE_BACKEND, BACKENDS, FileCache, LocalCache
+
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 30))
+IDEMPOTENCY_LOCK_TTL = float(os.getenv('IDEMPOTENCY_LOCK_TTL', 300))
+IDEMPOTENCY_FILE_PATH = os.getenv('IDEMPOTENCY_FILE_PATH',
+                                  os.path.join(tempfile.gettempdir(), 'casting-agency-idempotency.sqlite3'))
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def create_store(name=CACHE_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown CACHE_BACKEND "{name}", expected one of: {", ".join(BACKENDS)}.')
+    if name == 'file':
+        return FileCache(IDEMPOTENCY_FILE_PATH, max_entries=IDEMPOTENCY_MAX_ENTRIES)
+    return LocalCache(maxsize=IDEMPOTENCY_MAX_ENTRIES)
+
+
+store = create_store()
+
+
+class InProgress(Exception):
+    """Raised when the request holding a key does not finish in time."""
+
+
+def _digest(*parts):
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def check_key(key):
+    if not key or len(key) > MAX_KEY_LENGTH:
+        abort(400, f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters long.')
+
+
+def scoped_key(payload, method, path, key):
+    """The store key of a client's Idempotency-Key on a route."""
+    return 'idempotency:' + _digest(str(payload.get('sub', '')), method, path, key)
+
+
+def fingerprint(query_string, body):
+    """Identifies the request body (and query string) a key was used with."""
+    return _digest(query_string.decode('latin-1'), hashlib.sha256(body).hexdigest())
+
+
+def request_fingerprint():
+    return fingerprint(request.query_string, request.get_data())
+
+
+def check_fingerprint(record, fingerprint):
+    if record['fingerprint'] != fingerprint:
+        abort(422, f'This {HEADER} was already used with a different request.')
+
+
+def abort_in_progress():
+    abort(409, f'A request with this {HEADER} is still in progress.')
+
+
+def _record(response):
+    headers = [[name, value] for name, value in response.headers if name.lower() != 'content-length']
+    return {'status': response.status_code, 'headers': headers, 'body': response.get_data(as_text=True)}
+
+
+def new_token():
+    # Unique per request: threads of one worker share a pid
+    return uuid.uuid4().hex
+
+
+def claim(key, token, lock_ttl=IDEMPOTENCY_LOCK_TTL):
+    """One attempt at 'key': returns (stored record or None, whether this
+    request now holds the key with 'token')."""
+    record = store.get(key)
+    if record is not None:
+        return record, False
+    if not store.add(f'lock:{key}', token, ttl=lock_ttl):
+        return None, False
+    # The holder may have finished between our get() and add()
+    record = store.get(key)
+    if record is not None:
+        release(key, token)
+        return record, False
+    return None, True
+
+
+def save(key, record, ttl=IDEMPOTENCY_TTL):
+    if record['status'] < 500:
+        store.set(key, record, ttl)
+
+
+def release(key, token):
+    # Only our own lock: after lock_ttl it may belong to another request
+    store.delete_if(f'lock:{key}', token)
+
+
+def run_once(key, fingerprint, view, ttl=IDEMPOTENCY_TTL, lock_timeout=IDEMPOTENCY_LOCK_TIMEOUT,
+             lock_ttl=IDEMPOTENCY_LOCK_TTL):
+    """Returns (record, replayed): the stored record of 'key', or that of
+    calling view() now if there is none. Concurrent callers with the same
+    key wait for the first one; raises InProgress if it takes longer than
+    'lock_timeout'. The first one holds the key for at most 'lock_ttl', so
+    a crashed worker cannot block it for longer."""
+    token = new_token()
+    deadline = time.monotonic() + lock_timeout
+    record, acquired = claim(key, token, lock_ttl)
+    while record is None and not acquired:
+        if time.monotonic() >= deadline:
+            raise InProgress(key)
+        time.sleep(0.01)
+        record, acquired = claim(key, token, lock_ttl)
+    if record is not None:
+        return record, True
+
+    try:
+        record = dict(_record(make_response(view())), fingerprint=fingerprint)
+        save(key, record, ttl)
+        return record, False
+    finally:
+        release(key, token)
+
+
+def idempotent(f):
+    """Decorator for POST views: honours the Idempotency-Key header. Must
+    sit below requires_auth, whose payload scopes the keys."""
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return f(payload, *args, **kwargs)
+        check_key(key)
+
+        fingerprint = request_fingerprint()
+        try:
+            record, replayed = run_once(scoped_key(payload, request.method, request.path, key), fingerprint,
+                                        lambda: f(payload, *args, **kwargs))
+        except InProgress:
+            abort_in_progress()
+        check_fingerprint(record, fingerprint)
+
+        response = make_response(record['body'], record['status'], record['headers'])
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    return wrapper
@@ -0,0 +1,190 @@
+import threading
+import time
+import unittest
+from datetime import date
+from unittest import mock
+
+from flask import Response
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+import idempotency
+from idempotency import InProgress, run_once
+from models import db, Movie
+
+MOVIE = {'title': 'Movie', 'release_date': '2020-01-01'}
+
+
+class IdempotentPostTestCase(unittest.TestCase):
+    """This class represents the Idempotency-Key test cases for the POST routes"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        cache.backend.clear()
+        idempotency.store.clear()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def post(self, path, body, key, **claims):
+        headers = dict(testing.auth_headers(**claims), **{'Idempotency-Key': key})
+        return self.client.post(path, headers=headers, json=body)
+
+    def count_movies(self):
+        with app.app_context():
+            return Movie.query.count()
+
+    def test_retry_replays_the_original_response(self):
+        first = self.post('/movies', MOVIE, 'key-1')
+        retry = self.post('/movies', MOVIE, 'key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.data), (201, first.data))
+        self.assertEqual(retry.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertEqual(self.count_movies(), 1)
+
+        self.assertEqual(self.post('/movies', MOVIE, 'key-2').status_code, 201)
+        self.assertEqual(self.count_movies(), 2)
+
+    def test_keys_are_scoped_to_the_caller_and_route(self):
+        self.post('/movies', MOVIE, 'key')
+        self.assertNotIn('Idempotent-Replayed', self.post('/movies', MOVIE, 'key', sub='other').headers)
+        self.assertNotIn('Idempotent-Replayed', self.post('/movies/bulk', [MOVIE], 'key').headers)
+        self.assertEqual(self.count_movies(), 3)
+
+    def test_reused_key_with_another_body_is_unprocessable(self):
+        self.post('/movies', MOVIE, 'key')
+        response = self.post('/movies', dict(MOVIE, title='Other'), 'key')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.count_movies(), 1)
+
+    def test_invalid_requests_are_not_stored(self):
+        self.assertEqual(self.post('/movies', {'title': 'No date'}, 'key').status_code, 422)
+        # Nothing was stored, so the corrected retry is not a reused key
+        self.assertEqual(self.post('/movies', MOVIE, 'key').status_code, 201)
+        self.assertEqual(self.post('/actors', {}, 'x' * 256).status_code, 400)
+
+    def test_concurrent_duplicates_create_one_row(self):
+        store = idempotency.store
+        set_entry = store._set
+
+        def slow_set(*args):
+            # Widens the window between checking for the lock and taking it
+            time.sleep(0.02)
+            set_entry(*args)
+
+        def create():
+            db.session.add(Movie(title='Movie', release_date=date(2020, 1, 1)))
+            db.session.commit()
+            return Response('created', 201)
+
+        def send():
+            with app.test_request_context():
+                run_once('key', 'fingerprint', create)
+                db.session.remove()
+
+        threads = [threading.Thread(target=send) for _ in range(5)]
+        with mock.patch.object(store, '_set', slow_set):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(self.count_movies(), 1)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.client.post('/movies', headers=testing.auth_headers(), json=MOVIE)
+        self.client.post('/movies', headers=testing.auth_headers(), json=MOVIE)
+        self.assertEqual(self.count_movies(), 2)
+
+
+class RunOnceTestCase(unittest.TestCase):
+    """This class represents the single-flight store test cases"""
+
+    def setUp(self):
+        idempotency.store.clear()
+
+    def test_concurrent_duplicates_wait_for_the_first(self):
+        calls = []
+
+        def view():
+            calls.append(1)
+            time.sleep(0.05)
+            return Response('created', 201)
+
+        results = []
+
+        def send():
+            with app.test_request_context():
+                results.append(run_once('key', 'fingerprint', view))
+
+        threads = [threading.Thread(target=send) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(replayed for _, replayed in results), [False] + [True] * 7)
+        self.assertEqual({record['body'] for record, _ in results}, {'created'})
+
+    def test_waiting_is_bounded(self):
+        idempotency.store.add('lock:key', 'holder', ttl=60)
+        with app.test_request_context(), self.assertRaises(InProgress):
+            run_once('key', 'fingerprint', lambda: Response('created', 201), lock_timeout=0.05)
+
+    def test_a_slow_original_is_not_run_twice(self):
+        calls, results = [], []
+
+        def view():
+            calls.append(1)
+            time.sleep(0.2)
+            return Response('created', 201)
+
+        def send():
+            with app.test_request_context():
+                try:
+                    results.append(run_once('key', 'fingerprint', view, lock_timeout=0.05))
+                except InProgress:
+                    results.append('in progress')
+
+        original = threading.Thread(target=send)
+        original.start()
+        time.sleep(0.05)
+        # The retry gives up waiting long before the original's lock expires
+        send()
+        original.join()
+        send()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0], 'in progress')
+        self.assertEqual([replayed for _, replayed in results[1:]], [False, True])
+
+    def test_an_expired_lock_taken_over_is_not_released(self):
+        def view():
+            time.sleep(0.1)
+            # This request's lock expired and another one took the key
+            self.assertTrue(idempotency.store.add('lock:key', 'other', ttl=60))
+            return Response('created', 201)
+
+        with app.test_request_context():
+            run_once('key', 'fingerprint', view, lock_ttl=0.05)
+        self.assertEqual(idempotency.store.get('lock:key'), 'other')
+
+    def test_server_errors_are_not_stored(self):
+        with app.test_request_context():
+            record, _ = run_once('key', 'fingerprint', lambda: Response('error', 500))
+            self.assertEqual(record['status'], 500)
+            self.assertIsNone(idempotency.store.get('key'))
+            self.assertIsNone(idempotency.store.get('lock:key'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from datetime import date
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import json_provider
+from json_provider import OrjsonProvider, StdlibProvider, create_provider
+
+DOCUMENT = {
+    'success': True,
+    'movies': [{'id': 1, 'title': 'Amélie', 'release_date': date(2001, 4, 25)}],
+    'next_cursor': None,
+}
+
+EXPECTED = ('{"movies":[{"id":1,"release_date":"2001-04-25","title":"Amélie"}],'
+            '"next_cursor":null,"success":true}').encode('utf-8')
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    """This class represents the JSON provider test cases"""
+
+    def providers(self):
+        yield StdlibProvider()
+        if json_provider.orjson is not None:
+            yield OrjsonProvider()
+
+    def test_providers_encode_alike(self):
+        for provider in self.providers():
+            with self.subTest(provider=type(provider).__name__):
+                self.assertEqual(provider.dumps(DOCUMENT), EXPECTED)
+
+    def test_unserializable_values_are_rejected(self):
+        for provider in self.providers():
+            with self.subTest(provider=type(provider).__name__), self.assertRaises(TypeError):
+                provider.dumps({'value': object()})
+
+    def test_response_is_compact_json_with_a_trailing_newline(self):
+        with app.test_request_context():
+            response = json_provider.jsonify(success=True, deleted=2)
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(response.get_data(), b'{"deleted":2,"success":true}\n')
+            self.assertEqual(json_provider.jsonify(1, 2).get_data(), b'[1,2]\n')
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            create_provider('yaml')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,42 +1,43 @@
+"""Bulk loader for the movies and actors tables.
+
+Streams CSV or NDJSON files of any size into Postgres with COPY FROM STDIN,
+one transaction per batch, so memory use is bounded by the batch size and a
+failure only rolls back the batch it happened in. Rows are validated like
+API requests; invalid rows are skipped and reported.
+
+    python load_data.py                                   # the sample data below
+    python load_data.py movies movies.csv
+    python load_data.py actors actors.ndjson --batch-size 20000 --upsert
+    cat movies.ndjson | python load_data.py movies - --format ndjson
+
+Files need a header (CSV) or keys (NDJSON) named after the columns. Rows
+may carry an 'id': with --upsert an existing row with that id is updated,
+otherwise the id must be new.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+
 import psycopg2
 from psycopg2 import sql
-import os
-from urllib.parse import urlparse
-
-# Get the DATABASE_URL from the environment variable
-DATABASE_URL = os.environ.get('DATABASE_URL')
-
-# Parse the URL to extract connection components
-result = urlparse(DATABASE_URL)
-username = result.username
-password = result.password
-database = result.path[1:]  # Remove the leading '/'
-hostname = result.hostname
-port = result.port
-
-# Connect to the database
-try:
-    connection = psycopg2.connect(
-        dbname=database,
-        user=username,
-        password=password,
-        host=hostname,
-        port=port
-    )
 
-    cursor = connection.cursor()
+from validation import ValidationError, validate_movie, validate_actor
 
-    # Test query
-    cursor.execute("SELECT version();")
-    db_version = cursor.fetchone()
-    print(f"Connected to database: {db_version[0]}")
+LOAD_BATCH_SIZE = int(os.environ.get('LOAD_BATCH_SIZE', 10000))
 
-    # Don't forget to close the connection
-    cursor.close()
-    connection.close()
+# Only the first few invalid rows are kept for the report
+MAX_REPORTED_ERRORS = 10
 
-except Exception as e:
-    print(f"Unable to connect to the database: {e}")
+# table -> (columns, validator)
+TABLES = {
+    'movies': (('title', 'release_date'), validate_movie),
+    'actors': (('name', 'age', 'gender'), validate_actor),
+}
 
 # Actors data
 actors_data = [
@@ -61,53 +62,222 @@ movies_data = [
     ('Sci-Fi Revolution', '2023-09-30')
 ]
 
-# Function to load actors data
-def load_actors(cursor):
-    insert_actor_query = sql.SQL("""
-        INSERT INTO actors (name, age, gender)
-        VALUES (%s, %s, %s)
-    """)
-    
-    try:
-        for actor in actors_data:
-            cursor.execute(insert_actor_query, actor)
-        print("Actors data loaded successfully.")
-    except Exception as e:
-        print(f"Error inserting actors data: {e}")
-
-# Function to load movies data
-def load_movies(cursor):
-    insert_movie_query = sql.SQL("""
-        INSERT INTO movies (title, release_date)
-        VALUES (%s, %s)
-    """)
-    
-    try:
-        for movie in movies_data:
-            cursor.execute(insert_movie_query, movie)
-        print("Movies data loaded successfully.")
-    except Exception as e:
-        print(f"Error inserting movies data: {e}")
-
-# Main function to connect to the database and load data
-def main():
+
+def read_csv(f):
+    yield from csv.DictReader(f)
+
+
+def read_ndjson(f):
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Passed on as is, so it is reported as an invalid row
+            yield line
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+def _parse_id(record):
+    id = record.get('id') if isinstance(record, dict) else None
+    if id in (None, ''):
+        return None
+    if isinstance(id, str) and id.isdigit():
+        id = int(id)
+    if not isinstance(id, int) or isinstance(id, bool) or id < 1:
+        raise ValidationError('id must be a positive integer.')
+    return id
+
+
+def validated_rows(table, records, errors):
+    """Yields (id, *column values) for every valid record; invalid ones are
+    counted in errors['count'] and the first few kept in errors['rows']."""
+    columns, validate = TABLES[table]
+    for number, record in enumerate(records, 1):
+        try:
+            id = _parse_id(record)
+            values = validate(record)
+        except ValidationError as e:
+            errors['count'] += 1
+            if len(errors['rows']) < MAX_REPORTED_ERRORS:
+                errors['rows'].append((number, str(e)))
+            continue
+        yield (id, *[values[column] for column in columns])
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Sends rows to 'table' with a single COPY FROM STDIN."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    statement = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(
+        sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns))
+    )
+    cursor.copy_expert(statement.as_string(cursor), buffer)
+
+
+def upsert_rows(cursor, table, columns, rows):
+    """COPYs rows into a session-local staging table, then merges them into
+    'table' with INSERT ... ON CONFLICT (id) DO UPDATE, bumping the version
+    and updated_at of every row it changes and restoring deleted ones."""
+    staging = sql.Identifier(f'staging_{table}')
+    names = sql.SQL(', ').join(map(sql.Identifier, ('id', *columns)))
+    cursor.execute(sql.SQL(
+        'CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+    ).format(staging, sql.Identifier(table)))
+    copy_rows(cursor, f'staging_{table}', ('id', *columns), rows)
+    cursor.execute(sql.SQL(
+        'INSERT INTO {table} ({names}) SELECT {names} FROM {staging} '
+        'ON CONFLICT (id) DO UPDATE SET {updates}, version = {table}.version + 1, '
+        'updated_at = now(), deleted_at = NULL'
+    ).format(
+        table=sql.Identifier(table), names=names, staging=staging,
+        updates=sql.SQL(', ').join(
+            sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(column)) for column in columns
+        ),
+    ))
+
+
+def write_batch(connection, table, rows, upsert=False):
+    """Writes one batch in its own transaction and returns the number of
+    rows written."""
+    columns, _ = TABLES[table]
+    new = [row[1:] for row in rows if row[0] is None]
+    # ON CONFLICT can only touch a row once per statement: last one wins
+    keyed = list({row[0]: row for row in rows if row[0] is not None}.values())
+
+    with connection, connection.cursor() as cursor:
+        if new:
+            copy_rows(cursor, table, columns, new)
+        if keyed and upsert:
+            upsert_rows(cursor, table, columns, keyed)
+        elif keyed:
+            copy_rows(cursor, table, ('id', *columns), keyed)
+    return len(new) + len(keyed)
+
+
+def reset_sequence(connection, table):
+    """Moves the id sequence past ids that were loaded explicitly."""
+    with connection, connection.cursor() as cursor:
+        cursor.execute(sql.SQL(
+            "SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(max(id), 0) + 1, false) FROM {}"
+        ).format(sql.Identifier(table)), (table,))
+
+
+def load(connection, table, records, batch_size=LOAD_BATCH_SIZE, upsert=False, progress=None):
+    """Loads an iterable of records (dicts) into 'table'.
+
+    Returns {'loaded', 'skipped', 'errors', 'seconds'}. progress, if given,
+    is called with (rows loaded so far, seconds elapsed) after each batch.
+    """
+    errors = {'count': 0, 'rows': []}
+    rows = validated_rows(table, records, errors)
+    loaded = 0
+    keyed = False
+    started = time.perf_counter()
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        loaded += write_batch(connection, table, batch, upsert)
+        keyed = keyed or any(row[0] is not None for row in batch)
+        if progress:
+            progress(loaded, time.perf_counter() - started)
+
+    if keyed:
+        reset_sequence(connection, table)
+    return {
+        'loaded': loaded,
+        'skipped': errors['count'],
+        'errors': errors['rows'],
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def sample_records(table):
+    columns, _ = TABLES[table]
+    data = movies_data if table == 'movies' else actors_data
+    return [dict(zip(columns, row)) for row in data]
+
+
+def open_input(path):
+    if path == '-':
+        return sys.stdin
+    return open(path, newline='', encoding='utf-8')
+
+
+def detect_format(path):
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('table', nargs='?', choices=sorted(TABLES),
+                        help='table to load; without it the sample data is loaded')
+    parser.add_argument('files', nargs='*', help="CSV/NDJSON files, or '-' for stdin")
+    parser.add_argument('--format', choices=sorted(READERS),
+                        help='input format (default: from the file extension, else csv)')
+    parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE)
+    parser.add_argument('--upsert', action='store_true',
+                        help='update existing rows that have the same id')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('DATABASE_URL is not set.')
+    if args.table and not args.files:
+        parser.error('No input files given.')
+
+    def report(table):
+        def progress(loaded, seconds):
+            print(f'{table}: {loaded} rows, {loaded / seconds:.0f} rows/s', file=sys.stderr)
+        return progress
+
+    if args.table:
+        sources = [(args.table, path) for path in args.files]
+    else:
+        sources = [('actors', None), ('movies', None)]
+
+    connection = psycopg2.connect(args.database_url)
+    status = 0
     try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # Load actors and movies data
-        load_actors(cursor)
-        load_movies(cursor)
-
-        # Close the connection
-        cursor.close()
-        conn.close()
-        print("Data loading completed.")
-    
-    except Exception as e:
-        print(f"Error connecting to the database: {e}")
+        for table, path in sources:
+            if path is None:
+                result = load(connection, table, sample_records(table), args.batch_size, args.upsert)
+            else:
+                reader = READERS[args.format or detect_format(path)]
+                f = open_input(path)
+                try:
+                    result = load(connection, table, reader(f), args.batch_size, args.upsert,
+                                  progress=report(table))
+                finally:
+                    if f is not sys.stdin:
+                        f.close()
+
+            rate = result['loaded'] / result['seconds'] if result['seconds'] else 0
+            print(f"{table}{f' from {path}' if path else ''}: loaded {result['loaded']} rows "
+                  f"in {result['seconds']:.2f} s ({rate:.0f} rows/s), skipped {result['skipped']}")
+            for number, message in result['errors']:
+                print(f'  record {number}: {message}', file=sys.stderr)
+            if result['skipped']:
+                status = 1
+    except psycopg2.Error as e:
+        # Batches committed before the failing one stay loaded
+        print(f'Error loading data: {e}', file=sys.stderr)
+        status = 2
+    finally:
+        connection.close()
+    return status
+
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
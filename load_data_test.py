@@ -0,0 +1,64 @@
+import io
+import os
+import unittest
+
+import psycopg2
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+from models import db
+import load_data
+
+
+@unittest.skipUnless(os.environ['DATABASE_URL'].startswith('postgresql'),
+                     'the loader uses COPY, which needs Postgres')
+class LoadDataTestCase(unittest.TestCase):
+    """This class represents the bulk loader test cases"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.connection = psycopg2.connect(os.environ['DATABASE_URL'])
+
+    def tearDown(self):
+        self.connection.close()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def rows(self, query):
+        with self.connection, self.connection.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchall()
+
+    def test_csv_is_loaded_in_batches(self):
+        data = 'title,release_date\n' + ''.join(f'Movie {i},2020-01-01\n' for i in range(25))
+        progress = []
+        result = load_data.load(self.connection, 'movies', load_data.read_csv(io.StringIO(data)),
+                                batch_size=10, progress=lambda loaded, seconds: progress.append(loaded))
+        self.assertEqual(result['loaded'], 25)
+        self.assertEqual(progress, [10, 20, 25])
+        self.assertEqual(self.rows('SELECT count(*) FROM movies'), [(25,)])
+
+    def test_invalid_records_are_skipped_and_reported(self):
+        data = '{"name": "A", "age": 30, "gender": "Male"}\nnot json\n{"name": "B", "age": -1, "gender": "Male"}\n'
+        result = load_data.load(self.connection, 'actors', load_data.read_ndjson(io.StringIO(data)))
+        self.assertEqual((result['loaded'], result['skipped']), (1, 2))
+        self.assertEqual([number for number, _ in result['errors']], [2, 3])
+
+    def test_upsert_updates_rows_by_id_and_moves_the_sequence(self):
+        load_data.load(self.connection, 'actors', load_data.sample_records('actors'))
+        self.rows('UPDATE actors SET deleted_at = now() WHERE id = 2 RETURNING id')
+        data = 'id,name,age,gender\n2,Jane Smith,29,Female\n50,New Actor,40,Male\n'
+        load_data.load(self.connection, 'actors', load_data.read_csv(io.StringIO(data)), upsert=True)
+        self.assertEqual(self.rows('SELECT age, deleted_at FROM actors WHERE id = 2'), [(29, None)])
+        self.assertEqual(self.rows('SELECT count(*) FROM actors'), [(11,)])
+        self.assertEqual(self.rows("SELECT nextval(pg_get_serial_sequence('actors', 'id'))"), [(51,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+"""Request timing histograms, served at /metrics in Prometheus' text format.
+
+Every request is timed per route template (`/movies/<int:id>`, not the URL
+that was asked for) and split into phases:
+
+- auth_header: reading the bearer token from the Authorization header,
+- jwt: verifying it (`verify_decode_jwt`), a token cache hit included,
+- db: time spent executing SQL, from SQLAlchemy cursor events,
+- serialize: encoding the JSON response body (timed by json_provider).
+
+Recording a request takes a few dict updates under a lock, cheap enough to
+leave on; METRICS_ENABLED=0 turns it off. Numbers are per process, so with
+several gunicorn workers each scrape sees the worker that answered it: the
+`pid` label keeps their series apart for sum() and rate().
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Phases of a request typically take microseconds to milliseconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels."""
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = ('pid', *labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        pid = os.getpid()
+        for labels, value in values.items():
+            yield f'{self.name}{_labels(self.labelnames, (pid, *labels))} {_number(value)}'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, as Prometheus expects."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = ('pid', *labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above the last, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        pid = os.getpid()
+        for labels, values in series.items():
+            labels = (pid, *labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), values):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-1])}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+REQUEST_SECONDS = Histogram('casting_request_duration_seconds',
+                            'Time from the start of a request until its response is ready.',
+                            ('method', 'route'))
+REQUESTS = Counter('casting_requests_total', 'Requests answered, by response status.',
+                   ('method', 'route', 'status'))
+PHASE_SECONDS = Histogram('casting_request_phase_seconds',
+                          'Time a request spent in each phase (auth_header, jwt, db, serialize).',
+                          ('method', 'route', 'phase'))
+DB_STATEMENTS = Counter('casting_db_statements_total', 'SQL statements executed while handling requests.',
+                        ('method', 'route'))
+
+METRICS = [REQUEST_SECONDS, REQUESTS, PHASE_SECONDS, DB_STATEMENTS]
+
+
+# The request being timed by this thread (or greenlet, under gevent). Kept
+# out of flask.g, whose proxy lookups cost more than the timing itself.
+_current = threading.local()
+
+
+def add_phase_time(phase, seconds):
+    """Adds 'seconds' to the current request's time in 'phase'. Does nothing
+    outside a request or with metrics disabled."""
+    phases = getattr(_current, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Times the block as part of the current request's 'name' phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(name, time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    phases = getattr(_current, 'phases', None)
+    if start is not None and phases is not None:
+        phases['db'] = phases.get('db', 0.0) + time.perf_counter() - start
+        _current.statements += 1
+
+
+def _start_request():
+    _current.start = time.perf_counter()
+    _current.phases = {}
+    _current.statements = 0
+
+
+def _record_request(response):
+    phases = getattr(_current, 'phases', None)
+    if phases is None:
+        return response
+    _current.phases = None
+    # Unmatched URLs share one label so scanners cannot blow up the series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    method = request.method
+    REQUEST_SECONDS.observe(time.perf_counter() - _current.start, method, route)
+    REQUESTS.inc(method, route, response.status_code)
+    for name, seconds in phases.items():
+        PHASE_SECONDS.observe(seconds, method, route, name)
+    if _current.statements:
+        DB_STATEMENTS.inc(method, route, amount=_current.statements)
+    return response
+
+
+def init_app(app, enabled=METRICS_ENABLED):
+    """Times every request of 'app' and the SQL it runs."""
+    if not enabled:
+        return
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def family(name, help, type, samples):
+    """Lines for a metric computed at scrape time: 'samples' are (labels
+    dict, value) pairs."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+    for labels, value in samples:
+        labels = {'pid': os.getpid(), **labels}
+        lines.append(f'{name}{_labels(labels, labels.values())} {_number(value)}')
+    return lines
+
+
+def render(collectors=()):
+    """The current values of every metric in Prometheus' text format.
+    'collectors' are callables returning extra lines, e.g. pool gauges."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    for collect in collectors:
+        lines.extend(collect())
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    for metric in METRICS:
+        metric.clear()
@@ -0,0 +1,119 @@
+import os
+import re
+import unittest
+from unittest import mock
+from datetime import date
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+import metrics
+from metrics import Counter, Histogram
+from models import db, Movie
+
+
+def sample(text, name, **labels):
+    """The value of the sample 'name' whose labels include 'labels'."""
+    for line in text.splitlines():
+        match = re.fullmatch(r'(\w+)(?:\{(.*)\})? (\S+)', line)
+        if match is None or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or ''))
+        if all(found.get(key) == str(value) for key, value in labels.items()):
+            return float(match.group(3))
+    return None
+
+
+class MetricTypesTestCase(unittest.TestCase):
+    """This class represents the histogram and counter test cases"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, '/movies')
+        text = '\n'.join(histogram.samples())
+        self.assertEqual(sample(text, 'latency_seconds_bucket', route='/movies', le='0.1'), 2)
+        self.assertEqual(sample(text, 'latency_seconds_bucket', route='/movies', le='1.0'), 3)
+        self.assertEqual(sample(text, 'latency_seconds_bucket', route='/movies', le='+Inf'), 4)
+        self.assertEqual(sample(text, 'latency_seconds_count', route='/movies'), 4)
+        self.assertAlmostEqual(sample(text, 'latency_seconds_sum', route='/movies'), 3.65)
+        self.assertEqual(sample(text, 'latency_seconds_count', pid=os.getpid()), 4)
+
+    def test_label_values_are_escaped(self):
+        counter = Counter('requests_total', 'Requests.', ('route',))
+        counter.inc('say "hi"\\\n')
+        counter.inc('say "hi"\\\n', amount=2)
+        self.assertEqual(list(counter.samples()),
+                         [f'requests_total{{pid="{os.getpid()}",route="say \\"hi\\"\\\\\\n"}} 3'])
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    """This class represents the /metrics endpoint test cases"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.headers = testing.auth_headers()
+        with app.app_context():
+            db.create_all()
+            db.session.add(Movie(title='Movie', release_date=date(2020, 1, 1)))
+            db.session.commit()
+        cache.backend.clear()
+        cache.response_cache.clear()
+        metrics.clear()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def scrape(self):
+        response = self.client.get('/metrics', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, metrics.CONTENT_TYPE)
+        return response.get_data(as_text=True)
+
+    def test_requests_are_timed_per_route_template_and_phase(self):
+        self.client.get('/movies/1', headers=self.headers)
+        self.client.get('/movies/2', headers=self.headers)
+        text = self.scrape()
+        route = {'method': 'GET', 'route': '/movies/<int:id>'}
+        self.assertEqual(sample(text, 'casting_request_duration_seconds_count', **route), 2)
+        self.assertEqual(sample(text, 'casting_requests_total', status=200, **route), 1)
+        self.assertEqual(sample(text, 'casting_requests_total', status=404, **route), 1)
+        for phase in ('auth_header', 'jwt', 'db', 'serialize'):
+            self.assertEqual(sample(text, 'casting_request_phase_seconds_count', phase=phase, **route), 2, phase)
+            self.assertGreater(sample(text, 'casting_request_phase_seconds_sum', phase=phase, **route), 0, phase)
+        self.assertEqual(sample(text, 'casting_db_statements_total', **route), 2)
+
+    def test_cache_hits_skip_the_database_and_serialization(self):
+        self.client.get('/movies', headers=self.headers)
+        self.client.get('/movies', headers=self.headers)
+        text = self.scrape()
+        route = {'method': 'GET', 'route': '/movies'}
+        self.assertEqual(sample(text, 'casting_request_phase_seconds_count', phase='jwt', **route), 2)
+        self.assertEqual(sample(text, 'casting_request_phase_seconds_count', phase='db', **route), 1)
+        self.assertEqual(sample(text, 'casting_request_phase_seconds_count', phase='serialize', **route), 1)
+        self.assertEqual(sample(text, 'casting_response_cache_requests_total', result='hit'), 1)
+
+    def test_unmatched_urls_share_one_label(self):
+        self.client.get('/nothing/here')
+        self.client.get('/nor/here')
+        text = self.scrape()
+        self.assertEqual(sample(text, 'casting_requests_total', route='unmatched', status=404), 2)
+
+    def test_scrapes_need_a_permission_or_the_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        headers = testing.auth_headers(['get:movies'])
+        self.assertEqual(self.client.get('/metrics', headers=headers).status_code, 403)
+        scraper = {'Authorization': 'Bearer scrape-secret'}
+        self.assertEqual(self.client.get('/metrics', headers=scraper).status_code, 401)
+        with mock.patch('auth.METRICS_TOKEN', 'scrape-secret'):
+            self.assertEqual(self.client.get('/metrics', headers=scraper).status_code, 200)
+            self.assertEqual(self.client.get('/health/db', headers=scraper).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
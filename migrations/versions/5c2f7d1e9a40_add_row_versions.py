@@ -0,0 +1,27 @@
+"""Add row versions
+
+Revision ID: 5c2f7d1e9a40
+Revises: 63e6e76c7392
+Create Date: 2026-10-18 14:12:05.318224
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2f7d1e9a40'
+down_revision = '63e6e76c7392'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows start at version 1
+    op.add_column('actors', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('movies', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('movies', 'version')
+    op.drop_column('actors', 'version')
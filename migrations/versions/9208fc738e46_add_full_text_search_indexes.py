@@ -0,0 +1,58 @@
+"""Add full-text search indexes
+
+GIN indexes on to_tsvector('simple', ...) on Postgres; FTS5 tables kept in
+sync by triggers on SQLite. See search.py.
+
+Revision ID: 9208fc738e46
+Revises: 401b47cae141
+Create Date: 2026-10-18 06:40:31.892160
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9208fc738e46'
+down_revision = '401b47cae141'
+branch_labels = None
+depends_on = None
+
+
+# table -> searched column
+SEARCHED = {'movies': 'title', 'actors': 'name'}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCHED.items():
+        if dialect == 'postgresql':
+            op.create_index(
+                f'ix_{table}_{column}_search', table,
+                [sa.text(f"to_tsvector('simple', {column})")],
+                postgresql_using='gin'
+            )
+        elif dialect == 'sqlite':
+            fts = f'{table}_search'
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', content_rowid='id')")
+            op.execute(f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            op.execute(f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            op.execute(f'CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            # Index the rows that already exist
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCHED.items():
+        if dialect == 'postgresql':
+            op.drop_index(f'ix_{table}_{column}_search', table_name=table)
+        elif dialect == 'sqlite':
+            fts = f'{table}_search'
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f'DROP TRIGGER {fts}_{trigger}')
+            op.execute(f'DROP TABLE {fts}')
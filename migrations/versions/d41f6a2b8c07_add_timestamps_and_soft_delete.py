@@ -0,0 +1,43 @@
+"""Add timestamps and soft delete
+
+Revision ID: d41f6a2b8c07
+Revises: b7e3a91c5d28
+Create Date: 2026-10-18 16:22:08.314275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f6a2b8c07'
+down_revision = 'b7e3a91c5d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    for table in ('movies', 'actors'):
+        for column in ('created_at', 'updated_at'):
+            # SQLite cannot add a column whose default is not a constant:
+            # add it nullable, then stamp the existing rows
+            op.add_column(table, sa.Column(column, sa.DateTime(timezone=True), nullable=True))
+            op.execute(sa.table(table, sa.column(column)).update().values({column: sa.func.current_timestamp()}))
+            # Tightening the column on SQLite means rebuilding the table, which
+            # drops the search triggers and, through ON DELETE CASCADE, the
+            # casts; the models set both columns on every insert there
+            if not sqlite:
+                op.alter_column(table, column, nullable=False, server_default=sa.func.current_timestamp())
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+        op.create_index(op.f(f'ix_{table}_created_at'), table, ['created_at'], unique=False)
+        op.create_index(op.f(f'ix_{table}_updated_at'), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('actors', 'movies'):
+        op.drop_index(op.f(f'ix_{table}_updated_at'), table_name=table)
+        op.drop_index(op.f(f'ix_{table}_created_at'), table_name=table)
+        op.drop_column(table, 'deleted_at')
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'created_at')
@@ -1,5 +1,12 @@
+import logging
 import os
-from sqlalchemy import Column, String, Integer, Date, create_engine
+import sqlite3
+import threading
+import time
+from sqlalchemy import (Column, String, Integer, BigInteger, Date, DateTime, JSON, ForeignKey, create_engine,
+                        event, exc, func)
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, QueuePool
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 
@@ -11,21 +18,150 @@ database_path = os.environ.get('DATABASE_URL')
 if not database_path:
     raise ValueError("DATABASE_URL environment variable is not set.")
 
+# Connection pool settings. Each gunicorn worker has its own pool, so the
+# defaults give every worker thread a connection plus a little overflow;
+# keep WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below the
+# database's connection limit. DB_NULL_POOL=1 opens a connection per checkout
+# instead, for running behind an external pooler such as pgbouncer.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 4)))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 2))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no')
+DB_NULL_POOL = os.environ.get('DB_NULL_POOL', '0').lower() in ('1', 'true', 'yes')
+
 db = SQLAlchemy()
 
+class PoolStats:
+    """Counts connection checkouts and how long they waited for the pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection,
+    including the time to open one when the pool grows."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return connection
+
+# SQLAlchemy names a pool's logger after its class, so this one sits outside
+# the 'sqlalchemy' hierarchy that is kept at WARNING unless echo_pool is set
+logging.getLogger(f'{__name__}.{InstrumentedQueuePool.__name__}').setLevel(logging.WARNING)
+
+def engine_options(database_path):
+    """Returns the SQLAlchemy engine options for 'database_path'.
+
+    SQLite (used for local tests) keeps Flask-SQLAlchemy's own pool setup.
+    """
+    if database_path.startswith('sqlite'):
+        return {}
+    if DB_NULL_POOL:
+        return {'poolclass': NullPool}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+def pool_status():
+    """Returns the current state of the connection pool and checkout waits."""
+    pool = db.engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            # QueuePool counts unopened pool slots as negative overflow
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+        })
+    status.update(pool_stats.snapshot())
+    return status
+
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
 
-class Movie(db.Model):
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys (and so ON DELETE CASCADE) unless asked."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+# Which actors are cast in which movies. Soft deletes remove a row's casts
+# with one DELETE (writes.delete_links); rows removed for good take theirs
+# with them (ON DELETE CASCADE).
+movie_actors = db.Table(
+    'movie_actors',
+    Column('movie_id', Integer, ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True),
+    Column('actor_id', Integer, ForeignKey('actors.id', ondelete='CASCADE'), primary_key=True,
+           index=True),
+)
+
+class Timestamped:
+    """Write timestamps, set by the database so every worker uses the same
+    clock, and the soft delete marker.
+
+    Deleting a row only sets deleted_at (see writes.delete_row); the row is
+    kept as a tombstone for GET /movies?updated_since= and hidden everywhere
+    else. Indexed for those delta queries. Inserts set both timestamps
+    themselves as well, since a migrated SQLite database has no column
+    default for them.
+    """
+    created_at = Column(DateTime(timezone=True), nullable=False, default=func.now(),
+                        server_default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=func.now(),
+                        server_default=func.now(), onupdate=func.now(), index=True)
+    deleted_at = Column(DateTime(timezone=True))
+
+
+class Movie(Timestamped, db.Model):
     __tablename__ = 'movies'
 
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
-    release_date = Column(Date, nullable=False)
+    release_date = Column(Date, nullable=False, index=True)
+    # Bumped by every write; exposed as the ETag for If-Match (see writes.py)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    actors = db.relationship('Actor', secondary=movie_actors, back_populates='movies',
+                             order_by='Actor.id', passive_deletes=True)
 
     def format(self):
         """Method to format the movie data."""
@@ -36,13 +172,16 @@ class Movie(db.Model):
         }
 
 
-class Actor(db.Model):
+class Actor(Timestamped, db.Model):
     __tablename__ = 'actors'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
-    age = db.Column(db.Integer, nullable=False)
-    gender = db.Column(db.String(10), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
+    age = db.Column(db.Integer, nullable=False, index=True)
+    gender = db.Column(db.String(10), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    movies = db.relationship('Movie', secondary=movie_actors, back_populates='actors',
+                             order_by='Movie.id', passive_deletes=True)
 
     def format(self):
         """Method to format the actor data."""
@@ -53,3 +192,15 @@ class Actor(db.Model):
             'gender': self.gender
         }
 
+
+class Change(db.Model):
+    """One row per write to movies, actors or casts, added in the write's own
+    transaction and served in order by GET /changes (see changes.py)."""
+    __tablename__ = 'changes'
+
+    seq = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    resource = Column(String(16), nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    operation = Column(String(16), nullable=False)
+    # The row after the write; null for deletes
+    data = Column(JSON)
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import NullPool
+
+import testing
+
+testing.configure_environment()
+
+import models
+from models import InstrumentedQueuePool, PoolStats, engine_options, pool_status
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class represents the connection pool settings test cases"""
+
+    def test_sqlite_keeps_the_default_pool(self):
+        self.assertEqual(engine_options('sqlite://'), {})
+        self.assertEqual(engine_options('sqlite:////tmp/casting.db'), {})
+
+    def test_postgres_gets_the_instrumented_queue_pool(self):
+        with mock.patch.multiple(models, DB_POOL_SIZE=6, DB_MAX_OVERFLOW=3, DB_POOL_TIMEOUT=2.5,
+                                 DB_POOL_RECYCLE=600, DB_POOL_PRE_PING=False):
+            self.assertEqual(engine_options('postgresql://postgres@localhost/casting'), {
+                'poolclass': InstrumentedQueuePool,
+                'pool_size': 6,
+                'max_overflow': 3,
+                'pool_timeout': 2.5,
+                'pool_recycle': 600,
+                'pool_pre_ping': False,
+            })
+
+    def test_null_pool_behind_an_external_pooler(self):
+        with mock.patch.object(models, 'DB_NULL_POOL', True):
+            self.assertEqual(engine_options('postgresql://postgres@localhost/casting'), {'poolclass': NullPool})
+            # SQLite is unaffected
+            self.assertEqual(engine_options('sqlite://'), {})
+
+
+class InstrumentedQueuePoolTestCase(unittest.TestCase):
+    """This class represents the checkout wait accounting test cases"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.engine = create_engine(f'sqlite:///{self.path}', poolclass=InstrumentedQueuePool,
+                                    pool_size=1, max_overflow=0, pool_timeout=0.05)
+        self.stats = PoolStats()
+        patches = [mock.patch.object(models, 'pool_stats', self.stats),
+                   mock.patch.object(models, 'db', SimpleNamespace(engine=self.engine))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_checkouts_beyond_the_pool_time_out(self):
+        with self.engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+            status = pool_status()
+            self.assertEqual((status['pool'], status['size']), ('InstrumentedQueuePool', 1))
+            self.assertEqual((status['checked_out'], status['checked_in']), (1, 0))
+
+        status = pool_status()
+        self.assertEqual((status['checkouts'], status['timeouts']), (2, 1))
+        self.assertGreaterEqual(status['wait_seconds_max'], 0.05)
+        self.assertGreaterEqual(status['wait_seconds_total'], status['wait_seconds_max'])
+        self.assertEqual((status['checked_out'], status['checked_in']), (0, 1))
+
+    def test_checkouts_from_the_pool_are_counted(self):
+        for _ in range(3):
+            with self.engine.connect():
+                pass
+        status = pool_status()
+        self.assertEqual((status['checkouts'], status['timeouts']), (3, 0))
+        self.assertLess(status['wait_seconds_max'], 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+import testing
+
+testing.configure_environment()
+
+from app import app
+import cache
+from models import db
+
+# Large enough that Postgres prefers an index whenever one applies; with
+# much smaller tables a hash join over a whole table is genuinely cheaper
+# (e.g. for include= below ~100k rows).
+PLAN_TEST_ROWS = int(os.environ.get('PLAN_TEST_ROWS', 200000))
+
+SEED = [
+    # One write a minute up to now, every 100th row deleted
+    f"""INSERT INTO movies (title, release_date, updated_at, deleted_at)
+        SELECT 'Movie ' || g, date '1950-01-01' + g % 27000, t, CASE WHEN g % 100 = 0 THEN t END
+        FROM generate_series(1, {PLAN_TEST_ROWS}) g,
+             LATERAL (SELECT now() - ({PLAN_TEST_ROWS} - g) * interval '1 minute' AS t) w""",
+    f"""INSERT INTO actors (name, age, gender)
+        SELECT 'Actor ' || g, 18 + g % 80, CASE WHEN g % 2 = 0 THEN 'Female' ELSE 'Male' END
+        FROM generate_series(1, {PLAN_TEST_ROWS}) g""",
+    f"""INSERT INTO movie_actors (movie_id, actor_id)
+        SELECT g, 1 + (g * k) % {PLAN_TEST_ROWS}
+        FROM generate_series(1, {PLAN_TEST_ROWS}) g, generate_series(1, 3) k
+        ON CONFLICT DO NOTHING""",
+    f"""INSERT INTO changes (resource, resource_id, operation)
+        SELECT (ARRAY['movies', 'actors', 'casts'])[1 + g % 3], g, 'update'
+        FROM generate_series(1, {PLAN_TEST_ROWS}) g""",
+    'ANALYZE movies, actors, movie_actors, changes',
+]
+
+# Every read endpoint, with the parameters that change its query. The
+# exports are left out: they read whole tables by design.
+PATHS = [
+    '/movies',
+    '/movies?cursor={cursor}',
+    '/movies?release_date_from=2020-01-01',
+    '/movies?release_date_from=1960-01-01&release_date_to=1960-01-31',
+    '/movies?include=actors',
+    '/movies?updated_since={hour_ago}',
+    '/movies?updated_since={hour_ago}&include=actors',
+    '/movies/123',
+    '/movies/123?include=actors',
+    '/movies/123/actors',
+    '/actors',
+    '/actors?gender=Female',
+    '/actors?age_min=96',
+    '/actors?age_min=30&age_max=31&gender=Male',
+    '/actors?include=movies',
+    '/actors/123?include=movies',
+    '/actors/123/movies',
+    '/search?q=12345',
+    '/search?q=actor+4242&type=actors',
+    '/changes',
+    '/changes?since={recent_seq}',
+]
+
+
+@unittest.skipUnless(os.environ['DATABASE_URL'].startswith('postgresql'),
+                     'query plans are only checked on Postgres')
+class QueryPlanTestCase(unittest.TestCase):
+    """Runs EXPLAIN on every query the read endpoints issue against a large
+    seeded catalog and fails on any sequential scan.
+
+        DATABASE_URL=postgresql://localhost/casting_test python -m pytest plan_test.py
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as connection:
+                for statement in SEED:
+                    connection.execute(text(statement))
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.headers = testing.auth_headers()
+        cache.backend.clear()
+
+    def test_endpoints_do_not_scan_tables(self):
+        cursor = self.client.get('/movies?limit=5', headers=self.headers).get_json()['next_cursor']
+        hour_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for path in PATHS:
+            path = path.format(cursor=cursor, hour_ago=hour_ago, recent_seq=PLAN_TEST_ROWS - 50)
+            with self.subTest(path=path):
+                with app.app_context(), testing.capture_queries(db.engine) as queries:
+                    response = self.client.get(path, headers=self.headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(queries)
+
+                with app.app_context(), db.engine.connect() as connection:
+                    for statement, parameters in queries:
+                        self.assertEqual(testing.seq_scans(connection, statement, parameters), [],
+                                         statement)
+
+    def test_seq_scans_reports_full_table_reads(self):
+        with app.app_context(), db.engine.connect() as connection:
+            self.assertEqual(testing.seq_scans(connection, 'SELECT count(*) FROM movies'), ['movies'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""Slow-query log and an opt-in, sampled request profiler.
+
+Statements on the app's engine that run longer than SLOW_QUERY_MS are
+logged as warnings with their SQL, parameters and duration, tagged with the
+request they ran for.
+
+With PROFILE_SAMPLE_RATE above 0, that fraction of requests (optionally
+only those to PROFILE_ROUTES) runs under cProfile, and each profile is
+written to PROFILE_DIR/<method>_<route>/ as a .prof file. At most one
+request per process is profiled at a time; the others run as usual. To see
+where a route spends its time, combine its profiles:
+
+    PROFILE_SAMPLE_RATE=0.05 PROFILE_ROUTES=/actors gunicorn -c gunicorn.conf.py app:app
+    python profiling.py --route /actors
+"""
+import argparse
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+SLOW_QUERY_MAX_PARAMETERS_LENGTH = 1000
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'casting-agency-profiles'))
+PROFILE_ROUTES = {route.strip() for route in os.getenv('PROFILE_ROUTES', '').split(',') if route.strip()}
+
+logger = logging.getLogger(__name__)
+
+
+def describe_parameters(parameters, executemany, max_length=SLOW_QUERY_MAX_PARAMETERS_LENGTH):
+    """A bounded repr of a statement's parameters; executemany batches can
+    hold thousands of rows."""
+    if executemany:
+        described = f'{len(parameters)} rows, first: {parameters[0]!r}' if parameters else '0 rows'
+    else:
+        described = repr(parameters)
+    if len(described) > max_length:
+        described = described[:max_length] + '...'
+    return described
+
+
+def log_slow_queries(engine, threshold_ms=SLOW_QUERY_MS):
+    """Logs statements executed on 'engine' that take longer than
+    'threshold_ms'."""
+    threshold = threshold_ms / 1000
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._slow_query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def log_if_slow(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_slow_query_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if elapsed >= threshold:
+            logger.warning('Slow query', extra={
+                'duration_ms': round(elapsed * 1000, 3),
+                'statement': statement,
+                'parameters': describe_parameters(parameters, executemany),
+            })
+
+
+def route_slug(route):
+    """'/movies/<int:id>' -> 'movies_int-id', usable as a directory name."""
+    return re.sub(r'[^\w-]+', '_', route.replace(':', '-')).strip('_') or 'root'
+
+
+def profile_path(directory, method, route):
+    """PROFILE_DIR/GET_movies_int-id/<time>-<pid>.prof for GET /movies/<int:id>."""
+    return os.path.join(directory, f'{method}_{route_slug(route)}', f'{time.time_ns()}-{os.getpid()}.prof')
+
+
+def profile_requests(app, sample_rate=PROFILE_SAMPLE_RATE, directory=PROFILE_DIR, routes=PROFILE_ROUTES):
+    """Runs a 'sample_rate' fraction of the requests to 'routes' (all routes
+    if empty) under cProfile and writes one profile per request."""
+    # cProfile cannot run in two threads of one process at once
+    busy = threading.Lock()
+
+    @app.before_request
+    def start_profiler():
+        rule = request.url_rule
+        if rule is None or (routes and rule.rule not in routes) or random.random() >= sample_rate:
+            return
+        if not busy.acquire(blocking=False):
+            return
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    @app.teardown_request
+    def write_profile(exc):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        busy.release()
+        path = profile_path(directory, request.method, request.url_rule.rule)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
+        logger.debug('Profiled request', extra={'profile': path})
+
+
+def init_app(app):
+    """Logs slow statements on the app's engine and, if PROFILE_SAMPLE_RATE
+    is set, profiles a sample of its requests."""
+    # Imported here so the report CLI runs without a DATABASE_URL
+    from models import db
+
+    if SLOW_QUERY_MS > 0:
+        log_slow_queries(db.get_engine(app), SLOW_QUERY_MS)
+    if PROFILE_SAMPLE_RATE > 0:
+        profile_requests(app)
+
+
+def report(directory=PROFILE_DIR, route=None, limit=25, sort='cumulative', stream=sys.stdout):
+    """Prints the combined profile of each route found in 'directory', or of
+    just 'route' (e.g. /actors or GET /actors). Returns the number of routes."""
+    method, _, template = (route or '').rpartition(' ')
+    found = 0
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        # Directories are named <METHOD>_<route slug>
+        name_method, _, slug = name.partition('_')
+        if route and (slug != route_slug(template) or method and method.upper() != name_method):
+            continue
+        files = sorted(os.path.join(directory, name, file)
+                       for file in os.listdir(os.path.join(directory, name)) if file.endswith('.prof'))
+        if not files:
+            continue
+        found += 1
+        print(f'== {name}: {len(files)} profiled requests', file=stream)
+        stats = pstats.Stats(*files, stream=stream)
+        # Otherwise the report starts with one line per profile file
+        stats.files = []
+        stats.strip_dirs().sort_stats(sort).print_stats(*([limit] if limit else []))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prints the combined request profiles of each route.')
+    parser.add_argument('--dir', default=PROFILE_DIR, help='where the profiles were written (PROFILE_DIR)')
+    parser.add_argument('--route', help='only this route template, e.g. /actors or "GET /movies/<int:id>"')
+    parser.add_argument('--limit', type=int, default=25, help='functions listed per route (0 for all)')
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key, e.g. cumulative or tottime')
+    args = parser.parse_args(argv)
+
+    if not report(args.dir, args.route, args.limit, args.sort):
+        print(f'No profiles found in {args.dir}.', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import io
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, text
+
+import testing
+
+testing.configure_environment()
+
+from app import create_app
+import profiling
+from models import db, Actor
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    """This class represents the slow-query log test cases"""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_statements_over_the_threshold_are_logged(self):
+        profiling.log_slow_queries(self.engine, threshold_ms=0)
+        with self.assertLogs('profiling', 'WARNING') as logs, self.engine.connect() as connection:
+            connection.execute(text('SELECT :value'), {'value': 42})
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), 'Slow query')
+        self.assertEqual(record.statement, 'SELECT ?')
+        self.assertEqual(record.parameters, '(42,)')
+        self.assertGreaterEqual(record.duration_ms, 0)
+
+    def test_fast_statements_are_not_logged(self):
+        profiling.log_slow_queries(self.engine, threshold_ms=60000)
+        with self.assertRaises(AssertionError), self.assertLogs('profiling', 'WARNING'):
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+
+    def test_parameters_of_batches_are_summarized(self):
+        rows = [{'name': 'x' * 100}] * 500
+        described = profiling.describe_parameters(rows, executemany=True, max_length=40)
+        self.assertEqual(described, "500 rows, first: {'name': 'xxxxxxxxxxxxx...")
+
+
+class RequestProfilerTestCase(unittest.TestCase):
+    """This class represents the sampled request profiler test cases"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app()
+        profiling.profile_requests(self.app, sample_rate=1, directory=self.directory.name, routes={'/actors'})
+        self.client = self.app.test_client()
+        self.headers = testing.auth_headers()
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(Actor(name='Actor', age=30, gender='Male'))
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.directory.cleanup()
+
+    def test_sampled_requests_are_profiled_per_route(self):
+        self.client.get('/actors', headers=self.headers)
+        self.client.get('/actors?limit=1', headers=self.headers)
+        self.client.get('/movies', headers=self.headers)
+        self.assertEqual(os.listdir(self.directory.name), ['GET_actors'])
+        self.assertEqual(len(os.listdir(os.path.join(self.directory.name, 'GET_actors'))), 2)
+
+        output = io.StringIO()
+        self.assertEqual(profiling.report(self.directory.name, route='GET /actors', limit=None, stream=output), 1)
+        self.assertIn('2 profiled requests', output.getvalue())
+        self.assertIn('fetch_page', output.getvalue())
+        self.assertEqual(profiling.report(self.directory.name, route='/movies', stream=io.StringIO()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
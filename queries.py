@@ -0,0 +1,297 @@
+"""Query building for the list endpoints.
+
+GET /movies and GET /actors are paginated with keyset (a.k.a. cursor)
+pagination on the primary key: every page is `WHERE id > <last id> ORDER BY
+id LIMIT n`, so each page is an index range scan no matter how deep the
+client pages, and rows inserted while a client is paging can never shift
+rows between pages (new rows get higher ids and show up on later pages).
+
+Only the requested columns (`fields=`) are selected and filters are applied
+in SQL. The builders return plain SQLAlchemy Core statements so they can be
+executed from any session.
+
+`include=` expands related rows (a movie's actors, an actor's movies) with
+one extra IN query for the whole page, the same strategy as the ORM's
+`selectinload`, so a page costs the same number of queries however many
+rows it has.
+
+`updated_since=` turns a list into a delta for sync jobs: the rows written
+at or after that time (created_at/updated_at are indexed), each with its
+updated_at, and for rows deleted since a tombstone
+{'id': 7, 'deleted': true, 'updated_at': ...} instead of the row. Without
+it lists only show rows that are not deleted. Tombstones are kept for
+TOMBSTONE_RETENTION_DAYS (see writes.purge_tombstones), so an older
+updated_since could miss deletions and is refused; such a client has to
+read the full list again.
+"""
+import base64
+import binascii
+import json
+import operator
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from models import Movie, Actor, movie_actors
+
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+DEFAULT_PAGE_SIZE = min(int(os.getenv('DEFAULT_PAGE_SIZE', MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+# Days deleted rows are kept as tombstones; 0 keeps them forever
+TOMBSTONE_RETENTION_DAYS = float(os.getenv('TOMBSTONE_RETENTION_DAYS', 30))
+
+
+class InvalidQuery(ValueError):
+    """Raised when list parameters (limit, cursor, fields, filters) are malformed."""
+
+
+def parse_date(value):
+    return date.fromisoformat(value)
+
+
+def parse_timestamp(value, name):
+    """Parses an ISO 8601 timestamp into an aware UTC datetime; one without
+    an offset is taken to be UTC."""
+    if value in (None, ''):
+        return None
+    if value[-1:] in ('Z', 'z'):
+        # datetime.fromisoformat only reads 'Z' from Python 3.11 on
+        value = value[:-1] + '+00:00'
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidQuery(f'{name} must be an ISO 8601 timestamp.')
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def parse_updated_since(value):
+    """The updated_since= timestamp, which must lie within the tombstone
+    retention window."""
+    since = parse_timestamp(value, 'updated_since')
+    if since is not None and TOMBSTONE_RETENTION_DAYS:
+        oldest = datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        if since < oldest:
+            raise InvalidQuery(f'updated_since must be within the last {TOMBSTONE_RETENTION_DAYS:g} days; '
+                               'older deletions are no longer kept, read the full list instead.')
+    return since
+
+
+def format_timestamp(value):
+    """Formats a stored timestamp as UTC ISO 8601 (SQLite returns naive
+    UTC values)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def live(model):
+    """WHERE clause excluding soft-deleted rows."""
+    return model.deleted_at.is_(None)
+
+
+def get_live(session, model, id, options=()):
+    """Loads row 'id' through the ORM; None if there is none or it was deleted."""
+    row = session.get(model, id, options=options)
+    return None if row is None or row.deleted_at is not None else row
+
+
+# Columns a client may select, in response order. 'id' is always included.
+FIELDS = {
+    Movie: ('id', 'title', 'release_date'),
+    Actor: ('id', 'name', 'age', 'gender'),
+}
+
+# Query parameter -> (column, comparison, value parser)
+FILTERS = {
+    Movie: {
+        'release_date_from': (Movie.release_date, operator.ge, parse_date),
+        'release_date_to': (Movie.release_date, operator.le, parse_date),
+    },
+    Actor: {
+        'gender': (Actor.gender, operator.eq, str),
+        'age_min': (Actor.age, operator.ge, int),
+        'age_max': (Actor.age, operator.le, int),
+    },
+}
+
+
+# include= name -> (related model, owner key, related key) in movie_actors
+RELATIONS = {
+    Movie: {'actors': (Actor, movie_actors.c.movie_id, movie_actors.c.actor_id)},
+    Actor: {'movies': (Movie, movie_actors.c.actor_id, movie_actors.c.movie_id)},
+}
+
+
+def encode_cursor(last_id):
+    """Encodes the last id of a page as an opaque cursor token."""
+    raw = json.dumps({'id': last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(token):
+    """Decodes a cursor token back into the id to continue after."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        last_id = json.loads(raw)['id']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidQuery('Invalid cursor.')
+    if not isinstance(last_id, int):
+        raise InvalidQuery('Invalid cursor.')
+    return last_id
+
+
+def parse_limit(value):
+    """Returns the page size, capped at MAX_PAGE_SIZE."""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidQuery('limit must be an integer.')
+    if limit < 1:
+        raise InvalidQuery('limit must be at least 1.')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_fields(model, value):
+    """Returns the requested column names, in the model's field order."""
+    allowed = FIELDS[model]
+    if value in (None, ''):
+        return list(allowed)
+
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidQuery(f'Unknown fields: {", ".join(sorted(unknown))}.')
+    return [field for field in allowed if field == 'id' or field in requested]
+
+
+def parse_include(model, value):
+    """Returns the relations to expand, in the model's relation order."""
+    allowed = RELATIONS[model]
+    if value in (None, ''):
+        return []
+
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidQuery(f'Unknown include: {", ".join(sorted(unknown))}.')
+    return [name for name in allowed if name in requested]
+
+
+def linked_to(model, relation, id):
+    """WHERE clause matching the 'relation' rows linked to row 'id' of
+    'model', e.g. the actors cast in one movie."""
+    related, owner_key, related_key = RELATIONS[model][relation]
+    return related.id.in_(select(related_key).where(owner_key == id))
+
+
+def apply_filters(model, statement, args):
+    """Adds a WHERE clause for every filter parameter present in 'args'."""
+    for name, (column, compare, parse) in FILTERS[model].items():
+        value = args.get(name)
+        if value in (None, ''):
+            continue
+        try:
+            value = parse(value)
+        except ValueError:
+            raise InvalidQuery(f'Invalid value for {name}.')
+        statement = statement.where(compare(column, value))
+    return statement
+
+
+def build_list_query(model, args, where=None):
+    """Builds the SELECT for one page of a list endpoint.
+
+    Returns (statement, fields, limit). The statement fetches limit + 1 rows
+    so the caller can tell whether another page follows without a COUNT.
+    'where' optionally narrows the list further (see linked_to). With
+    updated_since= deleted rows are included and updated_at and deleted_at
+    are selected after 'fields' (see delta_item).
+    """
+    fields = parse_fields(model, args.get('fields'))
+    limit = parse_limit(args.get('limit'))
+    since = parse_updated_since(args.get('updated_since'))
+
+    columns = [getattr(model, field) for field in fields]
+    if since is None:
+        statement = select(*columns).where(live(model))
+    else:
+        statement = select(*columns, model.updated_at, model.deleted_at).where(model.updated_at >= since)
+    statement = apply_filters(model, statement, args)
+    if where is not None:
+        statement = statement.where(where)
+    if args.get('cursor'):
+        statement = statement.where(model.id > decode_cursor(args['cursor']))
+
+    return statement.order_by(model.id).limit(limit + 1), fields, limit
+
+
+def format_row(row, fields):
+    """Formats a selected row like Movie.format()/Actor.format() would."""
+    item = {}
+    for field, value in zip(fields, row):
+        if isinstance(value, date):
+            value = value.strftime('%Y-%m-%d')
+        item[field] = value
+    return item
+
+
+def fetch_related(session, model, relation, ids):
+    """Loads 'relation' for all of 'ids' with a single query and returns
+    {id: [related rows as dicts]}, related rows ordered by id."""
+    related, owner_key, related_key = RELATIONS[model][relation]
+    fields = FIELDS[related]
+    statement = (
+        select(owner_key, *[getattr(related, field) for field in fields])
+        .join(related, related.id == related_key)
+        .where(owner_key.in_(ids))
+        .order_by(owner_key, related.id)
+    )
+
+    grouped = {id: [] for id in ids}
+    for row in session.execute(statement):
+        grouped[row[0]].append(dict(zip(fields, row[1:])))
+    return grouped
+
+
+def delta_item(row, fields):
+    """An item of an updated_since= page: the row with its updated_at, or a
+    tombstone if it was deleted."""
+    updated_at = format_timestamp(row.updated_at)
+    if row.deleted_at is not None:
+        return {'id': row.id, 'deleted': True, 'updated_at': updated_at}
+    item = dict(zip(fields, row))
+    item['updated_at'] = updated_at
+    return item
+
+
+def fetch_page(session, model, args, where=None):
+    """Runs a list query and returns (items, next_cursor).
+
+    next_cursor is None on the last page. Each relation named in include=
+    adds one query, whatever the page size. Values are left as fetched
+    (dates as dates) for json_provider to encode.
+    """
+    includes = parse_include(model, args.get('include'))
+    statement, fields, limit = build_list_query(model, args, where)
+    rows = session.execute(statement).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    if args.get('updated_since'):
+        items = [delta_item(row, fields) for row in rows]
+    else:
+        items = [dict(zip(fields, row)) for row in rows]
+    # Tombstones have no relations
+    expanded = [item for item in items if not item.get('deleted')]
+    for relation in includes:
+        related = fetch_related(session, model, relation, [item['id'] for item in expanded]) if expanded else {}
+        for item in expanded:
+            item[relation] = related[item['id']]
+    return items, next_cursor
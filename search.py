@@ -0,0 +1,170 @@
+"""Full-text search over movie titles and actor names.
+
+GET /search?q= matches every word of the query as a prefix ("star wa" finds
+"Star Wars") and ranks movies and actors together. Matching never scans the
+tables:
+
+- on Postgres it uses GIN indexes on to_tsvector(SEARCH_CONFIG, title/name)
+  and ranks with ts_rank,
+- on SQLite (local tests) it uses FTS5 tables kept in sync by triggers and
+  ranks with bm25.
+
+Both are created by the migrations, and by the DDL hooks below when tests
+build the schema with db.create_all().
+"""
+import base64
+import binascii
+import json
+import re
+
+from sqlalchemy import DDL, event, func, literal, literal_column, select, table, column, union_all
+
+from models import Movie, Actor
+from queries import InvalidQuery, live, parse_limit
+
+# The 'simple' configuration does no stemming or stop-word removal, which
+# suits names and keeps prefix matching predictable.
+SEARCH_CONFIG = 'simple'
+MAX_QUERY_TERMS = 8
+
+# ?type= value -> (model, result type, searched column)
+SEARCHABLE = {
+    'movies': (Movie, 'movie', 'title'),
+    'actors': (Actor, 'actor', 'name'),
+}
+
+
+def _postgres_index(tablename, column_name):
+    return DDL(
+        f'CREATE INDEX ix_{tablename}_{column_name}_search ON {tablename} '
+        f"USING gin (to_tsvector('{SEARCH_CONFIG}', {column_name}))"
+    ).execute_if(dialect='postgresql')
+
+
+def _sqlite_fts(tablename, column_name):
+    """FTS5 table indexing one column of 'tablename', plus the triggers
+    that keep it current."""
+    fts = f'{tablename}_search'
+    statements = [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({column_name}, content='{tablename}', content_rowid='id')",
+        f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {tablename} BEGIN '
+        f'INSERT INTO {fts}(rowid, {column_name}) VALUES (new.id, new.{column_name}); END',
+        f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {tablename} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {column_name}) VALUES ('delete', old.id, old.{column_name}); END",
+        f'CREATE TRIGGER {fts}_update AFTER UPDATE OF {column_name} ON {tablename} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {column_name}) VALUES ('delete', old.id, old.{column_name}); "
+        f'INSERT INTO {fts}(rowid, {column_name}) VALUES (new.id, new.{column_name}); END',
+    ]
+    return [DDL(statement).execute_if(dialect='sqlite') for statement in statements]
+
+
+for _model, _, _column_name in SEARCHABLE.values():
+    _table = _model.__table__
+    event.listen(_table, 'after_create', _postgres_index(_table.name, _column_name))
+    for _ddl in _sqlite_fts(_table.name, _column_name):
+        event.listen(_table, 'after_create', _ddl)
+    # The triggers go with the table; the FTS table has to be dropped by hand
+    event.listen(_table, 'before_drop',
+                 DDL(f'DROP TABLE IF EXISTS {_table.name}_search').execute_if(dialect='sqlite'))
+
+
+def parse_terms(q):
+    """Returns the lower-cased words of a query; punctuation is ignored so
+    no user input reaches the tsquery/FTS5 query syntax."""
+    terms = re.findall(r'\w+', (q or '').lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        raise InvalidQuery('q must contain at least one word.')
+    return terms
+
+
+def parse_types(value):
+    if value in (None, ''):
+        return list(SEARCHABLE)
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(SEARCHABLE)
+    if unknown:
+        raise InvalidQuery(f'Unknown type: {", ".join(sorted(unknown))}.')
+    return [name for name in SEARCHABLE if name in requested]
+
+
+def encode_offset(offset):
+    raw = json.dumps({'offset': offset}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_offset(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        offset = json.loads(raw)['offset']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidQuery('Invalid cursor.')
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidQuery('Invalid cursor.')
+    return offset
+
+
+def _postgres_matches(name, terms):
+    model, result_type, column_name = SEARCHABLE[name]
+    text = getattr(model, column_name)
+    # Same expression as the index, so the planner can use it
+    vector = func.to_tsvector(literal_column(f"'{SEARCH_CONFIG}'"), text)
+    query = func.to_tsquery(literal_column(f"'{SEARCH_CONFIG}'"), ' & '.join(f'{term}:*' for term in terms))
+    return (
+        select(literal(result_type).label('type'), model.id.label('id'), text.label('text'),
+               func.ts_rank(vector, query).label('rank'))
+        .where(vector.op('@@')(query), live(model))
+    )
+
+
+def _sqlite_matches(name, terms):
+    model, result_type, column_name = SEARCHABLE[name]
+    fts_name = f'{model.__tablename__}_search'
+    fts = table(fts_name, column('rowid'))
+    # bm25() is lower for better matches
+    return (
+        select(literal(result_type).label('type'), model.id.label('id'),
+               getattr(model, column_name).label('text'),
+               (-func.bm25(literal_column(fts_name))).label('rank'))
+        .select_from(fts.join(model.__table__, model.id == fts.c.rowid))
+        .where(literal_column(fts_name).op('MATCH')(' '.join(f'"{term}"*' for term in terms)), live(model))
+    )
+
+
+MATCHERS = {
+    'postgresql': _postgres_matches,
+    'sqlite': _sqlite_matches,
+}
+
+
+def search(session, args):
+    """Runs a search and returns (results, next_cursor).
+
+    Results are ordered by rank, best first; each is {'type', 'id', 'title'}
+    for movies or {'type', 'id', 'name'} for actors, plus its 'rank'.
+    """
+    terms = parse_terms(args.get('q'))
+    names = parse_types(args.get('type'))
+    limit = parse_limit(args.get('limit'))
+    offset = decode_offset(args['cursor']) if args.get('cursor') else 0
+
+    matches = MATCHERS[session.bind.dialect.name]
+    results = union_all(*[matches(name, terms) for name in names]).subquery()
+    statement = (
+        select(results)
+        .order_by(results.c.rank.desc(), results.c.type, results.c.id)
+        .limit(limit + 1)
+        .offset(offset)
+    )
+    rows = session.execute(statement).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_offset(offset + limit)
+
+    return [{
+        'type': row.type,
+        'id': row.id,
+        'title' if row.type == 'movie' else 'name': row.text,
+        'rank': round(row.rank, 6),
+    } for row in rows], next_cursor
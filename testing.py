@@ -0,0 +1,131 @@
+"""Helpers for running the API against a local RSA key instead of Auth0.
+
+Tests and benchmarks import this module before `auth`/`app` so that the Auth0
+settings point at a throwaway signing key and a local JWKS file.
+"""
+import base64
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from sqlalchemy import event
+
+TEST_KID = 'local-test-key'
+TEST_DOMAIN = 'casting.test'
+TEST_AUDIENCE = 'https://casting.test/api'
+
+ALL_PERMISSIONS = [
+    'get:movies', 'get:actors',
+    'post:movies', 'post:actors',
+    'patch:movies', 'patch:actors',
+    'delete:movies', 'delete:actors',
+    'get:metrics',
+]
+
+_private_key = None
+
+
+def private_key():
+    """Returns the RSA private key used to sign local tokens."""
+    global _private_key
+    if _private_key is None:
+        _private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return _private_key
+
+
+def _b64url_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def jwks(kid=TEST_KID, key=None):
+    """Returns a JWKS document exposing the public half of 'key'."""
+    numbers = (key or private_key()).public_key().public_numbers()
+    return {
+        'keys': [{
+            'kty': 'RSA',
+            'kid': kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': _b64url_uint(numbers.n),
+            'e': _b64url_uint(numbers.e),
+        }]
+    }
+
+
+def write_jwks_file(document=None, directory=None):
+    """Writes a JWKS document to a temporary file and returns its file:// URL."""
+    fd, path = tempfile.mkstemp(suffix='.json', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(document or jwks(), f)
+    return 'file://' + path
+
+
+def mint_token(permissions=ALL_PERMISSIONS, expires_in=3600, kid=TEST_KID, key=None, **claims):
+    """Mints an RS256 access token that `auth.verify_decode_jwt` accepts."""
+    now = int(time.time())
+    payload = {
+        'iss': f'https://{os.environ["AUTH0_DOMAIN"]}/',
+        'aud': os.environ['AUDIENCE'],
+        'sub': 'auth0|local-test-user',
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': list(permissions),
+    }
+    payload.update(claims)
+    return jwt.encode(payload, key or private_key(), algorithm='RS256', headers={'kid': kid})
+
+
+def configure_environment(database_url='sqlite://'):
+    """Points the app at a local database and a local JWKS file.
+
+    Must be called before `auth` or `app` are imported, since both read their
+    settings from the environment at import time.
+    """
+    os.environ['AUTH0_DOMAIN'] = TEST_DOMAIN
+    os.environ['AUDIENCE'] = TEST_AUDIENCE
+    os.environ.setdefault('DATABASE_URL', database_url)
+    os.environ.setdefault('JWKS_URL', write_jwks_file())
+
+
+def auth_headers(permissions=ALL_PERMISSIONS, **claims):
+    """Returns request headers carrying a freshly minted bearer token."""
+    return {'Authorization': f'Bearer {mint_token(permissions, **claims)}'}
+
+
+@contextmanager
+def capture_queries(engine):
+    """Collects (statement, parameters) for every SQL statement executed on
+    'engine' inside the block.
+
+        with capture_queries(db.engine) as queries:
+            client.get('/movies?include=actors', headers=headers)
+        assert len(queries) == 2
+    """
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def seq_scans(connection, statement, parameters=None):
+    """Returns the tables Postgres would read with a sequential scan to run
+    'statement', according to EXPLAIN."""
+    plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+    tables, nodes = [], [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            tables.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return tables
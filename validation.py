@@ -0,0 +1,82 @@
+"""Request body validation shared by the single-row and bulk write handlers."""
+from datetime import date
+
+
+class ValidationError(ValueError):
+    """Raised when a movie or actor payload is incomplete or malformed."""
+
+
+def _string(body, key, max_length=None):
+    value = body[key]
+    if not isinstance(value, str):
+        raise ValidationError(f'{key} must be a string.')
+    if max_length is not None and len(value) > max_length:
+        raise ValidationError(f'{key} must be at most {max_length} characters.')
+    return value
+
+
+def _date(body, key):
+    try:
+        return date.fromisoformat(body[key])
+    except (TypeError, ValueError):
+        raise ValidationError(f'{key} must be a date formatted as YYYY-MM-DD.')
+
+
+def _positive_int(body, key):
+    value = body[key]
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValidationError(f'{key} must be a positive integer.')
+    return value
+
+
+def _validate(body, parsers, partial):
+    if not isinstance(body, dict):
+        raise ValidationError('Expected a JSON object.')
+
+    # Like the original handlers, empty values count as missing
+    present = [key for key in parsers if body.get(key)]
+    if not partial and len(present) < len(parsers):
+        missing = [key for key in parsers if key not in present]
+        raise ValidationError(f'Missing required fields: {", ".join(missing)}.')
+
+    return {key: parsers[key](body, key) for key in present}
+
+
+MOVIE_FIELDS = {
+    'title': _string,
+    'release_date': _date,
+}
+
+ACTOR_FIELDS = {
+    'name': lambda body, key: _string(body, key, max_length=120),
+    'age': _positive_int,
+    'gender': lambda body, key: _string(body, key, max_length=10),
+}
+
+
+def validate_movie(body, partial=False):
+    """Returns the column values of a movie payload.
+
+    With partial=True (PATCH) every field is optional.
+    """
+    return _validate(body, MOVIE_FIELDS, partial)
+
+
+def validate_actor(body, partial=False):
+    """Returns the column values of an actor payload.
+
+    With partial=True (PATCH) every field is optional.
+    """
+    return _validate(body, ACTOR_FIELDS, partial)
+
+
+def validate_ids(body, key):
+    """Returns the distinct ids listed under 'key', in input order."""
+    if not isinstance(body, dict) or not isinstance(body.get(key), list):
+        raise ValidationError(f'Expected an object with a "{key}" array.')
+    ids = body[key]
+    if any(not isinstance(id, int) or isinstance(id, bool) for id in ids):
+        raise ValidationError(f'{key} must only contain integer ids.')
+    return list(dict.fromkeys(ids))
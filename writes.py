@@ -0,0 +1,157 @@
+"""Single-row writes for the PATCH and DELETE handlers.
+
+Loading a row through the ORM to change or delete it costs a SELECT before
+the write, and formatting it after the commit another one (the session
+expires it). Here each write is one statement whose outcome tells whether
+the row existed:
+
+- updates are one UPDATE ... WHERE id = :id RETURNING <columns>, no row
+  returned meaning 404,
+- deletes are soft: UPDATE ... SET deleted_at = now() WHERE id = :id, with
+  the DELETE of the row's casts in a CTE alongside, no row updated meaning
+  404. The row stays behind as a tombstone for updated_since= deltas (see
+  queries.py) and is otherwise treated as gone.
+
+SQLite (used for local tests) has neither UPDATE ... RETURNING in
+SQLAlchemy 1.4 nor writes inside a CTE, so there each write takes a second
+statement: reading the updated row back, or deleting the casts.
+
+Every update bumps the row's version column, which single-row responses
+carry as their ETag ("3" for version 3). A write sent with If-Match only
+applies if the row is still at one of the given versions: the check is part
+of the statement's WHERE clause, so concurrent writers need no locks, and
+the loser of a race gets 412 Precondition Failed instead of silently
+overwriting the other's change.
+"""
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from sqlalchemy import bindparam, delete, func, select
+from werkzeug.http import parse_etags
+
+from queries import FIELDS, RELATIONS, TOMBSTONE_RETENTION_DAYS, live
+
+
+def row_etag(version):
+    """The ETag (without quotes) of a row at 'version'."""
+    return str(version)
+
+
+def expected_versions(if_match):
+    """The row versions an If-Match header value accepts: None if any
+    version will do (no header, or *), otherwise a possibly empty list."""
+    if not if_match:
+        return None
+    etags = parse_etags(if_match)
+    if etags.star_tag:
+        return None
+    # If-Match compares strongly: weak ETags never match, nor can tags that
+    # are not versions (and would overflow the column)
+    return [int(tag) for tag in etags.as_set() if tag.isascii() and tag.isdigit() and len(tag) < 10]
+
+
+def _output_columns(model):
+    return [getattr(model.__table__.c, field) for field in FIELDS[model]]
+
+
+def _where(model, id, versions):
+    table = model.__table__
+    where = (table.c.id == id) & live(model)
+    if versions is not None:
+        where &= table.c.version.in_(versions)
+    return where
+
+
+def update_row(session, model, id, values, versions=None):
+    """Applies validated 'values' to row 'id', if it is at one of 'versions'
+    (any version if None). Returns (row as a dict, new version), or None if
+    no row matched (see missing_status)."""
+    table = model.__table__
+    fields = FIELDS[model]
+    columns = [*_output_columns(model), table.c.version]
+    where = _where(model, id, versions)
+
+    if not values:
+        row = session.execute(select(*columns).where(where)).first()
+    else:
+        statement = table.update().where(where).values({**values, 'version': table.c.version + 1})
+        if getattr(session.bind.dialect, 'full_returning', False):
+            row = session.execute(statement.returning(*columns)).first()
+        else:
+            if not session.execute(statement).rowcount:
+                return None
+            row = session.execute(select(*columns).where(table.c.id == id)).first()
+    return None if row is None else (dict(zip(fields, row)), row.version)
+
+
+def tombstone_values(table):
+    """The values that soft-delete rows of 'table'."""
+    return {'deleted_at': func.now(), 'version': table.c.version + 1}
+
+
+def delete_links(session, model, ids):
+    """Removes rows 'ids' of 'model' from every cast."""
+    for _, owner_key, _ in RELATIONS[model].values():
+        session.execute(delete(owner_key.table).where(owner_key.in_(ids)))
+
+
+@lru_cache(maxsize=None)
+def _delete_statement(model, versioned):
+    """The Postgres soft delete, bound to :row_id (and :versions if 'versioned')
+    and built once per model, since building it costs more than running it:
+    WITH deleted AS (UPDATE ... RETURNING id), unlinked_<relation> AS
+    (DELETE FROM <casts> WHERE ... IN deleted) SELECT the counts of both."""
+    table = model.__table__
+    where = (table.c.id == bindparam('row_id')) & live(model)
+    if versioned:
+        where &= table.c.version.in_(bindparam('versions', expanding=True))
+    deleted = table.update().where(where).values(tombstone_values(table)).returning(table.c.id).cte('deleted')
+    unlinked = [
+        delete(owner_key.table).where(owner_key.in_(select(deleted.c.id))).returning(owner_key)
+        .cte(f'unlinked_{name}')
+        for name, (_, owner_key, _) in RELATIONS[model].items()
+    ]
+    return select(*[select(func.count()).select_from(cte).scalar_subquery() for cte in (deleted, *unlinked)])
+
+
+def delete_row(session, model, id, versions=None):
+    """Soft-deletes row 'id' if it is at one of 'versions' (any version if
+    None) and removes it from its casts. Returns whether a row was deleted
+    (see missing_status)."""
+    if session.bind.dialect.name == 'postgresql':
+        params = {'row_id': id} if versions is None else {'row_id': id, 'versions': versions}
+        return bool(session.execute(_delete_statement(model, versions is not None), params).scalar())
+
+    table = model.__table__
+    statement = table.update().where(_where(model, id, versions)).values(tombstone_values(table))
+    if not session.execute(statement).rowcount:
+        return False
+    delete_links(session, model, [id])
+    return True
+
+
+def purge_tombstones(session, model, days=TOMBSTONE_RETENTION_DAYS):
+    """Removes rows of 'model' deleted more than 'days' ago for good and
+    returns how many; updated_since= no longer reaches back that far."""
+    if not days:
+        return 0
+    table = model.__table__
+    before = datetime.now(timezone.utc) - timedelta(days=days)
+    # A tombstone's updated_at is its deleted_at; testing both lets the
+    # updated_at index find them
+    statement = table.delete().where(table.c.deleted_at < before, table.c.updated_at < before)
+    return session.execute(statement).rowcount
+
+
+def row_exists(session, model, id):
+    """Whether row 'id' exists and is not deleted."""
+    table = model.__table__
+    return session.execute(select(table.c.id).where(table.c.id == id, live(model))).first() is not None
+
+
+def missing_status(session, model, id, versions=None):
+    """The status for a write that matched no row: 412 if the row exists
+    but at another version than If-Match asked for, otherwise 404."""
+    if versions is not None and row_exists(session, model, id):
+        return 412
+    return 404